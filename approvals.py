@@ -0,0 +1,176 @@
+from sqlalchemy import update, select, case
+from models import Storage, Request
+
+# Тексты для админа, если решение не применилось
+ALREADY_PROCESSED = "Заявка уже обработана"
+NOT_ENOUGH_STOCK = "Мало товара!"
+STOCK_CHANGED = "Остатки изменились, попробуйте еще раз"
+
+
+class Decision:
+    """
+    Результат решения по заявке.
+    request_rows / storage_rows — сколько строк изменили UPDATE (0 — условие не выполнилось).
+    quantity — новый остаток товара (только для одобрения).
+    """
+    __slots__ = ("ok", "error", "request_rows", "storage_rows", "item_id", "quantity")
+
+    def __init__(self, ok, error=None, request_rows=0, storage_rows=0, item_id=None, quantity=None):
+        self.ok = ok
+        self.error = error
+        self.request_rows = request_rows
+        self.storage_rows = storage_rows
+        self.item_id = item_id
+        self.quantity = quantity
+
+
+def _transition(session, req_id, old_status, new_status, is_approved):
+    """Compare-and-set статуса заявки: меняет, только если статус все еще old_status"""
+    return session.execute(
+        update(Request)
+        .where(Request.id == req_id, Request.status == old_status)
+        .values(status=new_status, is_approved=is_approved)
+    ).rowcount
+
+
+def approve_request(session, req_id):
+    """
+    Одобрение без чтения-проверки-записи в Python:
+    1. UPDATE requests ... WHERE id = ? AND status = 'pending' — второй админ получит 0 строк;
+    2. UPDATE storage SET quantity = quantity - n WHERE id = ? AND quantity >= n —
+       остаток не уйдет в минус при параллельных одобрениях разных заявок.
+    Если товара не хватило, статус возвращается в 'pending' (строка заявки уже заблокирована нами).
+    Блокировки только строчные, на время транзакции апдейта; commit — за вызывающим.
+    """
+    row = session.execute(
+        select(Request.item_id, Request.req_count).where(Request.id == req_id)
+    ).first()
+    if row is None:
+        return Decision(False, ALREADY_PROCESSED)
+    item_id, count = row
+
+    request_rows = _transition(session, req_id, 'pending', 'approved', True)
+    if request_rows != 1:
+        return Decision(False, ALREADY_PROCESSED, request_rows=request_rows, item_id=item_id)
+
+    storage_rows = session.execute(
+        update(Storage)
+        .where(Storage.id == item_id, Storage.quantity >= count)
+        .values(quantity=Storage.quantity - count)
+    ).rowcount
+    if storage_rows != 1:
+        _transition(session, req_id, 'approved', 'pending', False)
+        return Decision(False, NOT_ENOUGH_STOCK, request_rows, storage_rows, item_id)
+
+    quantity = session.execute(select(Storage.quantity).where(Storage.id == item_id)).scalar_one()
+    return Decision(True, None, request_rows, storage_rows, item_id, quantity)
+
+
+def reject_request(session, req_id):
+    """Отказ: только compare-and-set статуса, склад не трогаем"""
+    request_rows = _transition(session, req_id, 'pending', 'rejected', False)
+    if request_rows != 1:
+        return Decision(False, ALREADY_PROCESSED, request_rows=request_rows)
+    return Decision(True, request_rows=request_rows)
+
+
+# --- ПАКЕТНЫЕ РЕШЕНИЯ (/pending) ---
+
+class BatchDecision:
+    """
+    Результат пакетного решения.
+    done — id заявок, к которым применено решение; skipped — уже не 'pending';
+    short — не хватило товара (остались 'pending'). error — пакет не применен, нужен rollback.
+    """
+    __slots__ = ("done", "skipped", "short", "error", "request_rows", "storage_rows", "quantities")
+
+    def __init__(self, done=(), skipped=(), short=(), error=None, request_rows=0, storage_rows=0, quantities=None):
+        self.done = list(done)
+        self.skipped = list(skipped)
+        self.short = list(short)
+        self.error = error
+        self.request_rows = request_rows
+        self.storage_rows = storage_rows
+        self.quantities = quantities or {}  # item_id -> новый остаток
+
+
+def _lock_pending(session, req_ids):
+    """Ожидающие заявки из списка (строки блокируются до конца транзакции, где это поддерживается)"""
+    return session.execute(
+        select(Request.id, Request.item_id, Request.req_count)
+        .where(Request.id.in_(req_ids), Request.status == 'pending')
+        .order_by(Request.id)
+        .with_for_update()
+    ).all()
+
+
+def approve_requests(session, req_ids):
+    """
+    Одобряет пачку заявок в одной транзакции:
+    - заявки одобряются по порядку id, пока хватает остатка товара;
+    - статусы меняются одним UPDATE ... WHERE id IN (...) AND status = 'pending';
+    - склад уменьшается одним UPDATE с CASE по товарам и условием quantity >= списания.
+    Если какой-то UPDATE задел не все строки (параллельное изменение), возвращается error —
+    вызывающий должен откатить транзакцию.
+    """
+    rows = _lock_pending(session, req_ids)
+    pending_ids = {r.id for r in rows}
+    skipped = [i for i in req_ids if i not in pending_ids]
+    if not rows:
+        return BatchDecision(skipped=skipped)
+
+    stock = dict(session.execute(
+        select(Storage.id, Storage.quantity).where(Storage.id.in_({r.item_id for r in rows}))
+    ).all())
+
+    done, short, need = [], [], {}
+    for r in rows:
+        if need.get(r.item_id, 0) + r.req_count <= stock.get(r.item_id, 0):
+            need[r.item_id] = need.get(r.item_id, 0) + r.req_count
+            done.append(r.id)
+        else:
+            short.append(r.id)
+    if not done:
+        return BatchDecision(skipped=skipped, short=short)
+
+    request_rows = session.execute(
+        update(Request)
+        .where(Request.id.in_(done), Request.status == 'pending')
+        .values(status='approved', is_approved=True)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    amount = case(need, value=Storage.id)
+    storage_rows = session.execute(
+        update(Storage)
+        .where(Storage.id.in_(need), Storage.quantity >= amount)
+        .values(quantity=Storage.quantity - amount)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    if request_rows != len(done) or storage_rows != len(need):
+        return BatchDecision(error=STOCK_CHANGED, request_rows=request_rows, storage_rows=storage_rows)
+
+    quantities = dict(session.execute(
+        select(Storage.id, Storage.quantity).where(Storage.id.in_(need))
+    ).all())
+    return BatchDecision(done, skipped, short, None, request_rows, storage_rows, quantities)
+
+
+def reject_requests(session, req_ids):
+    """Отклоняет пачку заявок одним UPDATE; склад не трогаем"""
+    rows = _lock_pending(session, req_ids)
+    done = [r.id for r in rows]
+    skipped = [i for i in req_ids if i not in set(done)]
+    if not done:
+        return BatchDecision(skipped=skipped)
+
+    request_rows = session.execute(
+        update(Request)
+        .where(Request.id.in_(done), Request.status == 'pending')
+        .values(status='rejected', is_approved=False)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if request_rows != len(done):
+        return BatchDecision(error=ALREADY_PROCESSED, request_rows=request_rows)
+    return BatchDecision(done, skipped, request_rows=request_rows)
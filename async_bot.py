@@ -0,0 +1,540 @@
+"""
+Асинхронный режим (RUN_MODE=async): AsyncTeleBot и хендлеры-корутины.
+
+- Запросы к БД — обычные сессии SQLAlchemy в пуле потоков (asyncio.to_thread),
+  одна сессия и один commit на вызов db_call.
+- Независимые вызовы Telegram API идут параллельно (asyncio.gather): например,
+  отчет в админ-группу и подтверждение пользователю в confirm_order.
+- Диалоги админки (/add, /edit, /pending, /export, /dbstats) выполняет синхронный код group.py
+  в потоке — через синхронный клиент main.outbox_bot.
+- Сообщения (send/edit/delete) идут через тот же outbox, что и в синхронном режиме:
+  лимиты на чат и админ-группу и повтор после 429 действуют и здесь. AsyncTeleBot
+  получает апдейты и отвечает на callback/inline-запросы.
+
+Синхронный режим (polling/webhook) остается без изменений.
+"""
+import asyncio
+from telebot import types
+from sqlalchemy.orm import joinedload
+from telebot.async_telebot import AsyncTeleBot
+from config import BOT_TOKEN, GROUP_ID, OUTBOX_RESULT_TIMEOUT
+from db import Session, update_session, after_commit
+from models import User, Storage, Request
+from excel_logger import log_user_action, log_admin_action
+from catalog_cache import catalog
+from state_store import UserSession
+from approvals import approve_request, reject_request
+from search_index import search
+from user_cache import users
+from sql_profiler import profiler, describe_update
+import main
+from main import (
+    STATES, user_data, clear_state, build_user_interface, order_prompt_text, parse_category_callback,
+    kb_categories, kb_items, kb_confirm, kb_cancel_only, kb_search_results,
+    INLINE_SEARCH_BUTTON, inline_results
+)
+from group import (
+    ADMIN_STATES, start_add_process, start_edit_process, handle_admin_text,
+    handle_admin_callback, export_audit_log, show_db_stats,
+    start_pending_review, handle_pending_callback
+)
+
+abot = AsyncTeleBot(BOT_TOKEN)
+
+
+class OutboxClient:
+    """Сообщения через outbox (main.outbox); ожидание ответа не блокирует event loop"""
+
+    def __init__(self, outbox):
+        self.outbox = outbox
+
+    @staticmethod
+    async def _wait(job):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(job):
+            if future.done():
+                return
+            try:
+                future.set_result(job.result(0))
+            except Exception as e:
+                future.set_exception(e)
+
+        # Вызов выполнится в потоке outbox — результат передаем в event loop
+        job.add_done_callback(lambda job: loop.call_soon_threadsafe(resolve, job))
+        return await asyncio.wait_for(future, OUTBOX_RESULT_TIMEOUT)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._wait(self.outbox.send_message(chat_id, text, **kwargs))
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return await self._wait(self.outbox.edit_message_text(text, chat_id, message_id, **kwargs))
+
+    async def delete_message(self, chat_id, message_id):
+        return await self._wait(self.outbox.delete_message(chat_id, message_id))
+
+
+tg = OutboxClient(main.outbox)
+
+
+# --- ХЕЛПЕРЫ ---
+
+async def db_call(fn, *args):
+    """fn(session, *args) в потоке: своя сессия, commit в конце, rollback при ошибке"""
+    def run():
+        session = Session()
+        try:
+            result = fn(session, *args)
+            session.commit()
+            return result
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    return await asyncio.to_thread(run)
+
+async def sync_admin_call(fn, *args):
+    """Синхронный хендлер админки (group.py) в потоке — с unit of work, как в SessionMiddleware"""
+    def run():
+        update_session.remove()
+        profiler.begin(describe_update(args[0]) if args else fn.__name__)
+        try:
+            result = fn(main.outbox_bot, *args)
+            update_session().commit()
+            return result
+        except Exception:
+            update_session().rollback()
+            raise
+        finally:
+            update_session.remove()
+            profiler.end()
+    return await asyncio.to_thread(run)
+
+async def quietly(coro):
+    """Вызов API, ошибка которого не важна (удаление старого сообщения и т.п.)"""
+    try:
+        return await coro
+    except Exception:
+        return None
+
+def is_admin_group(chat_id):
+    return str(chat_id) == str(GROUP_ID)
+
+def _set_last_msg_id(chat_id, message_id):
+    # Пишется в БД пачкой (user_cache, write-behind) — отдельный поток не нужен
+    users.remember_last_msg_id(chat_id, message_id)
+
+def _user_last_msg_id(session, chat_id):
+    user = users.get(session, chat_id)
+    return user.last_msg_id if user else None
+
+async def edit_or_send(chat_id, message_id, text, markup):
+    """Редактирует сообщение меню; если не вышло — присылает новое и запоминает его id"""
+    if message_id:
+        try:
+            await tg.edit_message_text(text, chat_id, message_id, parse_mode="Markdown", reply_markup=markup)
+            return
+        except Exception:
+            pass
+    msg = await tg.send_message(chat_id, text, parse_mode="Markdown", reply_markup=markup)
+    _set_last_msg_id(chat_id, msg.message_id)
+
+
+# --- КОМАНДЫ ---
+
+@abot.message_handler(commands=['start'])
+async def cmd_start(message):
+    chat_id = message.chat.id
+    if is_admin_group(chat_id):
+        return
+
+    def load(session):
+        user = users.get(session, chat_id)
+        if user is None:
+            return None
+        return user.first_name, user.last_msg_id, kb_categories(session)
+
+    found = await db_call(load)
+    if found is None:
+        user_data.put(chat_id, UserSession(state=STATES['REG_IT']))
+        await tg.send_message(chat_id, "Вы не зарегистрированы.\nВведите ваш IT-код (например, IT293):")
+        return
+
+    first_name, last_msg_id, markup = found
+    # Удаление старого меню и отправка нового не зависят друг от друга
+    msg, _ = await asyncio.gather(
+        tg.send_message(chat_id, f"Привет, {first_name}! Выбери категорию:", reply_markup=markup),
+        quietly(tg.delete_message(chat_id, last_msg_id)) if last_msg_id else asyncio.sleep(0),
+    )
+    _set_last_msg_id(chat_id, msg.message_id)
+
+async def replace_menu(chat_id, last_msg_id, text, markup, parse_mode=None):
+    """Новое меню вниз чата и удаление старого — параллельно"""
+    msg, _ = await asyncio.gather(
+        tg.send_message(chat_id, text, reply_markup=markup, parse_mode=parse_mode),
+        quietly(tg.delete_message(chat_id, last_msg_id)) if last_msg_id else asyncio.sleep(0),
+    )
+    _set_last_msg_id(chat_id, msg.message_id)
+
+@abot.message_handler(commands=['find'])
+async def cmd_find(message):
+    chat_id = message.chat.id
+    if is_admin_group(chat_id):
+        return
+    query = message.text.partition(" ")[2].strip()
+    if not query:
+        await tg.send_message(chat_id, "Формат: /find hdmi\nИли наберите здесь @имя_бота и запрос.")
+        return
+
+    def load(session):
+        user = users.get(session, chat_id)
+        if user is None:
+            return None
+        items = search.search(session, query)
+        return user.last_msg_id, len(items), kb_search_results(items) if items else kb_categories(session)
+
+    found = await db_call(load)
+    if found is None:
+        await tg.send_message(chat_id, "Вы не зарегистрированы. /start")
+        return
+    last_msg_id, count, markup = found
+    text = f"🔎 «{query}»: найдено {count}" if count else f"🔎 «{query}»: ничего не найдено. Выберите категорию:"
+    await asyncio.gather(
+        replace_menu(chat_id, last_msg_id, text, markup),
+        quietly(tg.delete_message(chat_id, message.message_id)),
+    )
+
+@abot.message_handler(commands=['item'])
+async def cmd_item(message):
+    chat_id = message.chat.id
+    if is_admin_group(chat_id):
+        return
+    arg = message.text.partition(" ")[2].strip()
+
+    def load(session):
+        user = users.get(session, chat_id)
+        if user is None:
+            return None
+        item = session.query(Storage).get(int(arg)) if arg.isdigit() else None
+        return user.last_msg_id, item.id if item else None, order_prompt_text(item) if item else None
+
+    found = await db_call(load)
+    cleanup = asyncio.ensure_future(quietly(tg.delete_message(chat_id, message.message_id)))
+    if found is None:
+        await tg.send_message(chat_id, "Вы не зарегистрированы. /start")
+    elif found[1] is None:
+        await tg.send_message(chat_id, "Товар не найден.")
+    else:
+        last_msg_id, item_id, text = found
+        user_data.put(chat_id, UserSession(state=STATES['WAIT_QTY'], item_id=item_id))
+        await replace_menu(chat_id, last_msg_id, text, kb_cancel_only(), parse_mode="Markdown")
+    await cleanup
+
+@abot.inline_handler(func=lambda query: True)
+async def handle_inline_query(query):
+    if query.chat_type != 'sender':
+        await abot.answer_inline_query(query.id, [], cache_time=0, button=INLINE_SEARCH_BUTTON)
+        return
+
+    def load(session):
+        return search.search(session, query.query) if query.query.strip() else []
+
+    items = await db_call(load)
+    await abot.answer_inline_query(query.id, inline_results(items), cache_time=0)
+
+@abot.message_handler(commands=['add', 'add_item'])
+async def cmd_add_item(message):
+    if is_admin_group(message.chat.id):
+        await sync_admin_call(start_add_process, message)
+
+@abot.message_handler(commands=['edit', 'change'])
+async def cmd_edit_item(message):
+    if is_admin_group(message.chat.id):
+        await sync_admin_call(start_edit_process, message)
+
+@abot.message_handler(commands=['export'])
+async def cmd_export_log(message):
+    if is_admin_group(message.chat.id):
+        await sync_admin_call(export_audit_log, message)
+
+@abot.message_handler(commands=['dbstats'])
+async def cmd_db_stats(message):
+    if is_admin_group(message.chat.id):
+        await sync_admin_call(show_db_stats, message)
+
+@abot.message_handler(commands=['pending'])
+async def cmd_pending(message):
+    if is_admin_group(message.chat.id):
+        await sync_admin_call(start_pending_review, message)
+
+
+# --- ТЕКСТ ---
+
+@abot.message_handler(content_types=['text'])
+async def handle_text(message):
+    chat_id = message.chat.id
+
+    # 1. Админские состояния (ввод цены, названия и т.д.)
+    if ADMIN_STATES.get(message.from_user.id) is not None:
+        if await sync_admin_call(handle_admin_text, message):
+            return
+
+    # 2. Админ-группа без админского состояния -> игнор
+    if is_admin_group(chat_id):
+        return
+
+    # 3. Пользовательские состояния
+    draft = user_data.get(chat_id)
+    if draft is None:
+        return
+
+    state = draft.state
+    text = message.text.strip()
+    # Удаляем сообщение пользователя параллельно с остальной работой
+    cleanup = asyncio.ensure_future(quietly(tg.delete_message(chat_id, message.message_id)))
+
+    if state == STATES['REG_IT']:
+        draft.it_code = text
+        draft.state = STATES['REG_NAME']
+        user_data.put(chat_id, draft)
+        await tg.send_message(chat_id, "Введите Имя и Фамилию:")
+
+    elif state == STATES['REG_NAME']:
+        parts = text.split(maxsplit=1)
+
+        def register(session):
+            new_user = User(user_id=chat_id, it_code=draft.it_code, first_name=parts[0],
+                            last_name=parts[1] if len(parts) > 1 else "")
+            session.add(new_user)
+            session.flush()
+            log_user_action(new_user, "Регистрация", status="Success")
+            return kb_categories(session)
+
+        try:
+            markup = await db_call(register)
+        except Exception:
+            await tg.send_message(chat_id, "Ошибка регистрации. /start")
+        else:
+            user_data.put(chat_id, UserSession())
+            msg = await tg.send_message(chat_id, "✅ Регистрация успешна!", reply_markup=markup)
+            _set_last_msg_id(chat_id, msg.message_id)
+
+    elif state == STATES['WAIT_QTY']:
+        if text.isdigit():
+            qty = int(text)
+
+            def load(session):
+                item = session.query(Storage).get(draft.item_id)
+                last_id = _user_last_msg_id(session, chat_id)
+                if item is None:
+                    # Товар удалили, пока шел ввод: вместо товара — меню категорий
+                    return None, 0, last_id, kb_categories(session)
+                return item.item_name, item.quantity, last_id, None
+
+            item_name, available, last_id, menu = await db_call(load)
+            if item_name is None:
+                clear_state(chat_id)
+                await replace_menu(chat_id, last_id, "Товар больше недоступен. Выберите категорию:", menu)
+            elif available < qty:
+                await tg.send_message(chat_id, f"❌ Недостаточно товара. Доступно: {available}")
+            else:
+                draft.qty = qty
+                draft.state = STATES['WAIT_COMMENT']
+                user_data.put(chat_id, draft)
+                msg_text = f"Товар: **{item_name}**\nКоличество: {qty}\n\n📝 Напишите комментарий (цель использования):"
+                if last_id:
+                    await edit_or_send(chat_id, last_id, msg_text, kb_cancel_only())
+
+    elif state == STATES['WAIT_COMMENT']:
+        draft.comment = text
+
+        def load(session):
+            item = session.query(Storage).get(draft.item_id)
+            return item.item_name, _user_last_msg_id(session, chat_id)
+
+        item_name, last_id = await db_call(load)
+        summary = f"📋 **Проверка**:\nТовар: {item_name}\nКол-во: {draft.qty}\nКоммент: {draft.comment}"
+        await edit_or_send(chat_id, last_id, summary, kb_confirm())
+        draft.state = None
+        user_data.put(chat_id, draft)
+
+    await cleanup
+
+
+# --- КНОПКИ ---
+
+@abot.callback_query_handler(func=lambda call: True)
+async def handle_all_callbacks(call):
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+    data = call.data
+
+    if data.startswith("adm_") or data.startswith("edt_") or data.startswith("conf_"):
+        await sync_admin_call(handle_admin_callback, call)
+        return
+
+    if data.startswith("pnd_"):
+        # Уведомления сотрудникам уходят через outbox (после commit)
+        await sync_admin_call(handle_pending_callback, call, main.notify_user)
+        return
+
+    if data.startswith("req_"):
+        await handle_request_decision(call)
+        return
+
+    # === ЛОГИКА ПОЛЬЗОВАТЕЛЯ ===
+    # last_msg_id сохраняем тем же обращением к БД, что и основная работа
+
+    if data.startswith("cat_") or data.startswith("pg:"):
+        # pg:<курсор>:<id категории> — другая страница той же категории
+        category_id, cursor = parse_category_callback(data)
+
+        def load(session):
+            _set_last_msg_id(chat_id, message_id)
+            category = catalog.category(session, category_id)
+            if category is None:
+                return "Категория не найдена. Выберите категорию:", kb_categories(session)
+            return f"📂 Категория: {category.name}", kb_items(session, category.id, cursor)
+
+        text, markup = await db_call(load)
+        await tg.edit_message_text(text, chat_id, message_id, reply_markup=markup)
+
+    elif data == "back_main" or data == "cancel_order":
+        if data == "cancel_order":
+            clear_state(chat_id)
+
+        def load(session):
+            _set_last_msg_id(chat_id, message_id)
+            return kb_categories(session)
+
+        markup = await db_call(load)
+        text = "Выберите категорию:" if data == "back_main" else "Отменено.\nВыберите категорию:"
+        await tg.edit_message_text(text, chat_id, message_id, reply_markup=markup)
+
+    elif data.startswith("prod_"):
+        item_id = int(data.split("prod_")[1])
+
+        def load(session):
+            _set_last_msg_id(chat_id, message_id)
+            return order_prompt_text(session.query(Storage).get(item_id))
+
+        text_msg = await db_call(load)
+        user_data.put(chat_id, UserSession(state=STATES['WAIT_QTY'], item_id=item_id))
+        await tg.edit_message_text(text_msg, chat_id, message_id, parse_mode="Markdown", reply_markup=kb_cancel_only())
+
+    elif data == "confirm_order":
+        draft = user_data.get(chat_id)
+        if draft is None or draft.item_id is None or draft.qty is None:
+            await abot.answer_callback_query(call.id, "Сессия истекла")
+            return
+        await confirm_order(chat_id, message_id, draft)
+
+async def confirm_order(chat_id, message_id, draft):
+    def create(session):
+        _set_last_msg_id(chat_id, message_id)
+        item = session.query(Storage).get(draft.item_id)
+        user = users.get(session, chat_id)
+        new_req = Request(user_pk=user.id, item_id=draft.item_id, req_count=draft.qty,
+                          comment=draft.comment, status='pending')
+        session.add(new_req)
+        session.flush()
+        log_user_action(user, "Новая заявка", item.item_name, draft.qty, draft.comment, "Pending")
+        report = (
+            f"📦 **НОВАЯ ЗАЯВКА** #{new_req.id}\n"
+            f"▸ Сотрудник: {user.it_code} ({user.first_name} {user.last_name})\n"
+            f"▸ Товар: {item.item_name}\n"
+            f"▸ Запрос: {draft.qty} шт.\n"
+            f"▸ На складе: {item.quantity} шт.\n\n"
+            f"💬 Цель: {draft.comment}"
+        )
+        return new_req.id, report, kb_categories(session)
+
+    req_id, report, markup = await db_call(create)
+
+    markup_admin = types.InlineKeyboardMarkup()
+    markup_admin.add(
+        types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"req_appr:{req_id}"),
+        types.InlineKeyboardButton("⛔ Отказать", callback_data=f"req_rej:{req_id}")
+    )
+    success_text = f"✅ **Заявка #{req_id} отправлена!**\n\nНужно заказать что-то ещё? Выберите категорию:"
+
+    # Подтверждение пользователю и отчет админам — одновременно
+    await asyncio.gather(
+        tg.edit_message_text(success_text, chat_id, message_id, parse_mode="Markdown", reply_markup=markup),
+        tg.send_message(GROUP_ID, report, parse_mode="Markdown", reply_markup=markup_admin),
+    )
+    clear_state(chat_id)
+
+async def handle_request_decision(call):
+    """req_appr / req_rej из админ-группы"""
+    action, req_id = call.data.split(":")
+    req_id = int(req_id)
+    admin_id = call.from_user.id
+
+    def decide(session):
+        # Сотрудник и товар — тем же запросом (без двух ленивых SELECT)
+        req = (
+            session.query(Request)
+            .options(joinedload(Request.user), joinedload(Request.item))
+            .filter(Request.id == req_id)
+            .first()
+        )
+        if not req or req.status != 'pending':
+            return {'error': "Заявка уже обработана"}
+
+        user = req.user
+        item = req.item
+
+        if action == "req_appr":
+            decision = approve_request(session, req_id)
+            if not decision.ok:
+                return {'error': decision.error}
+            after_commit(session, lambda: catalog.set_quantity(decision.item_id, decision.quantity))
+
+            log_admin_action(admin_id, "Одобрение заявки", f"Заявка #{req.id}, Товар: {item.item_name}, Кол-во: {req.req_count}")
+            log_user_action(user, "Заявка обновлена", item.item_name, req.req_count, req.comment, "Approved")
+            notification = f"✅ Ваша заявка #{req.id} на **{item.item_name}** одобрена! Можете забирать."
+            mark = "\n\n✅ ОДОБРЕНО администратором."
+        else:
+            decision = reject_request(session, req_id)
+            if not decision.ok:
+                return {'error': decision.error}
+
+            log_admin_action(admin_id, "Отказ заявки", f"Заявка #{req.id}")
+            log_user_action(user, "Заявка обновлена", item.item_name, req.req_count, req.comment, "Rejected")
+            notification = f"⛔ Ваша заявка #{req.id} на **{item.item_name}** отклонена."
+            mark = "\n\n⛔ ОТКЛОНЕНО администратором."
+
+        session.flush()
+        text, markup = build_user_interface(user.user_id, session)
+        return {
+            'user_chat': user.user_id, 'last_msg_id': user.last_msg_id,
+            'notification': notification, 'mark': mark, 'menu': (text, markup),
+        }
+
+    result = await db_call(decide)
+    if 'error' in result:
+        await abot.answer_callback_query(call.id, result['error'])
+        return
+
+    user_chat = result['user_chat']
+    menu_text, menu_markup = result['menu']
+    # Отметка в группе, уведомление и удаление старого меню пользователя — параллельно
+    await asyncio.gather(
+        quietly(tg.edit_message_text(call.message.text + result['mark'], call.message.chat.id, call.message.message_id, reply_markup=None)),
+        quietly(tg.send_message(user_chat, result['notification'], parse_mode="Markdown")),
+        quietly(tg.delete_message(user_chat, result['last_msg_id'])) if result['last_msg_id'] else asyncio.sleep(0),
+    )
+    # Новое меню — вниз чата, после уведомления
+    try:
+        msg = await tg.send_message(user_chat, menu_text, reply_markup=menu_markup, parse_mode="Markdown")
+        _set_last_msg_id(user_chat, msg.message_id)
+    except Exception as e:
+        print(f"Error restoring UI: {e}")
+
+
+def run_async():
+    print("Бот запущен (async)...")
+    asyncio.run(abot.infinity_polling())
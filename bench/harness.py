@@ -0,0 +1,255 @@
+"""
+Общая часть бенчмарков: окружение без сети, записывающий фейк Telegram,
+сборка апдейтов и засев SQLite.
+
+prepare_env() нужно вызвать ДО импорта модулей бота: config читает env при импорте,
+а DispatchingTeleBot наследуется от telebot.TeleBot в момент импорта dispatcher.py.
+"""
+import os
+import sys
+import time
+import itertools
+import tempfile
+import threading
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ADMIN_ID = 900000001
+GROUP_ID = -1000000000001
+EMPLOYEE_BASE = 100000
+
+
+def prepare_env(workdir=None, db_url=None, dispatch_workers=0, **overrides):
+    """Env для бота: SQLite во временной папке, без диспетчера, метрик и лимитов отправки"""
+    workdir = workdir or tempfile.mkdtemp(prefix="bot-bench-")
+    env = {
+        "BOT_TOKEN": "123456:BENCH",
+        "GROUP_ID": str(GROUP_ID),
+        "DB_URL": db_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "DISPATCH_WORKERS": str(dispatch_workers),
+        "STATE_DB_PATH": os.path.join(workdir, "state.sqlite"),
+        "EXCEL_LOG_DIR": workdir,
+        "EXCEL_LOG_FLUSH_INTERVAL": "0.5",
+        "METRICS_ENABLED": "0",
+        "SQL_SLOW_LOG": os.path.join(workdir, "slow_queries.log"),
+        # Лимиты Telegram фейку не нужны: иначе замеряли бы паузы outbox, а не код
+        "OUTBOX_GLOBAL_RATE": "1000000",
+        "OUTBOX_CHAT_RATE": "1000000",
+        "OUTBOX_CHAT_BURST": "1000000",
+        "OUTBOX_GROUP_PER_MINUTE": "60000000",
+    }
+    env.update({k: str(v) for k, v in overrides.items()})
+    os.environ.update(env)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    install_fake_telegram()
+    return workdir
+
+
+# --- ФЕЙКОВЫЙ TELEGRAM ---
+
+def install_fake_telegram():
+    """Подменяет telebot.TeleBot записывающим фейком (до импорта dispatcher/main)"""
+    import telebot
+    if getattr(telebot.TeleBot, "is_fake", False):
+        return
+    telebot.TeleBot = _make_recording_bot(telebot.TeleBot)
+
+
+def _make_recording_bot(base):
+    from telebot import types
+
+    class RecordingTeleBot(base):
+        """Вызовы Bot API не уходят в сеть: пишутся в calls, ответы — правдоподобные"""
+        is_fake = True
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._calls_lock = threading.Lock()
+            self._message_ids = itertools.count(1000)
+            self.calls = []  # (метод, chat_id)
+
+        def _record(self, method, chat_id=None):
+            with self._calls_lock:
+                self.calls.append((method, chat_id))
+
+        def _message(self, chat_id):
+            return types.Message.de_json({
+                'message_id': next(self._message_ids), 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if int(chat_id) > 0 else 'supergroup'},
+                'text': '',
+            })
+
+        def send_message(self, chat_id, text, *args, **kwargs):
+            self._record("send_message", chat_id)
+            return self._message(chat_id)
+
+        def send_document(self, chat_id, document, *args, **kwargs):
+            self._record("send_document", chat_id)
+            return self._message(chat_id)
+
+        def edit_message_text(self, text=None, chat_id=None, message_id=None, *args, **kwargs):
+            self._record("edit_message_text", chat_id)
+            return True
+
+        def delete_message(self, chat_id, message_id, *args, **kwargs):
+            self._record("delete_message", chat_id)
+            return True
+
+        def answer_callback_query(self, callback_query_id, *args, **kwargs):
+            self._record("answer_callback_query")
+            return True
+
+        def answer_inline_query(self, inline_query_id, results, *args, **kwargs):
+            self._record("answer_inline_query")
+            return True
+
+        def remove_webhook(self):
+            return True
+
+        def call_count(self):
+            with self._calls_lock:
+                return len(self.calls)
+
+    return RecordingTeleBot
+
+
+# --- АПДЕЙТЫ ---
+
+class UpdateFactory:
+    """Апдейты в том виде, в каком их присылает Telegram (через Update.de_json)"""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    @staticmethod
+    def _chat(chat_id):
+        return {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'}
+
+    def message(self, chat_id, text, from_id=None):
+        from telebot import types
+        update_id = next(self._ids)
+        message = {
+            'message_id': update_id, 'date': int(time.time()), 'chat': self._chat(chat_id),
+            'from': {'id': from_id or chat_id, 'is_bot': False, 'first_name': 'Bench'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return types.Update.de_json({'update_id': update_id, 'message': message})
+
+    def callback(self, chat_id, data, from_id=None, text="menu", message_id=50):
+        from telebot import types
+        update_id = next(self._ids)
+        return types.Update.de_json({'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'chat_instance': 'bench', 'data': data,
+            'from': {'id': from_id or chat_id, 'is_bot': False, 'first_name': 'Bench'},
+            'message': {'message_id': message_id, 'date': int(time.time()), 'chat': self._chat(chat_id), 'text': text},
+        }})
+
+
+# --- БАЗА ---
+
+class Catalog:
+    """Что засеяно: категории, товары по категориям, сотрудники"""
+
+    def __init__(self, categories, items, employees):
+        self.categories = categories  # [id категории, ...] (в callback_data идут id)
+        self.items = items            # id категории -> [id товара, ...]
+        self.employees = employees    # [telegram id, ...]
+
+
+def seed(categories=5, items_per_category=20, employees=50, history=0, quantity=10 ** 9):
+    """
+    Чистая схема + каталог, сотрудники и history обработанных заявок.
+    Остатки огромные, чтобы одобрения в замерах никогда не упирались в склад.
+    """
+    from sqlalchemy import insert
+    from db import engine
+    from models import Base, Category, Storage, User, Request
+    from create_db import init_tables
+    from config import DB_URL
+
+    Base.metadata.drop_all(engine)
+    init_tables(DB_URL)
+
+    with engine.begin() as conn:
+        conn.execute(insert(Category), [{'name': f"Category {c}"} for c in range(categories)])
+        category_ids = [row[0] for row in conn.execute(Category.__table__.select().with_only_columns(Category.id).order_by(Category.id))]
+        conn.execute(insert(Storage), [
+            {'category_id': cat, 'item_name': f"Category {n} item {i}", 'quantity': quantity, 'cost_price': Decimal("9.99")}
+            for n, cat in enumerate(category_ids) for i in range(items_per_category)
+        ])
+        conn.execute(insert(User), [
+            {'user_id': EMPLOYEE_BASE + e, 'it_code': f"IT{e}", 'first_name': "Bench", 'last_name': f"User {e}"}
+            for e in range(employees)
+        ])
+        item_rows = conn.execute(Storage.__table__.select().with_only_columns(Storage.id, Storage.category_id)).all()
+        user_pks = [row[0] for row in conn.execute(User.__table__.select().with_only_columns(User.id))]
+        if history and item_rows and user_pks:
+            statuses = ('approved', 'rejected')
+            for start in range(0, history, 1000):
+                conn.execute(insert(Request), [
+                    {'user_pk': user_pks[n % len(user_pks)], 'item_id': item_rows[n % len(item_rows)][0],
+                     'req_count': 1, 'comment': "history", 'status': statuses[n % 2],
+                     'is_approved': n % 2 == 0}
+                    for n in range(start, min(history, start + 1000))
+                ])
+
+    items = {}
+    for item_id, category_id in item_rows:
+        items.setdefault(category_id, []).append(item_id)
+    return Catalog(category_ids, items, [EMPLOYEE_BASE + e for e in range(employees)])
+
+
+def add_pending_request(user_id, item_id, count=1):
+    """Ожидающая заявка напрямую в БД (подготовка к req_appr вне замера)"""
+    from db import Session
+    from models import User, Request
+    session = Session()
+    try:
+        user_pk = session.query(User.id).filter(User.user_id == user_id).scalar()
+        req = Request(user_pk=user_pk, item_id=item_id, req_count=count, comment="bench", status='pending')
+        session.add(req)
+        session.commit()
+        return req.id
+    finally:
+        session.close()
+
+
+# --- ЗАМЕРЫ ---
+
+class QueryCounter:
+    """Число SQL-запросов, выполненных в заданном потоке (фоновые потоки не считаются)"""
+
+    def __init__(self, engine, thread_id=None):
+        from sqlalchemy import event
+        self.thread_id = thread_id or threading.get_ident()
+        self.count = 0
+        event.listen(engine, "after_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread_id:
+            self.count += 1
+
+
+def wait_idle(main, timeout=30):
+    """Ждет, пока диспетчер разберет апдейты и outbox отправит все вызовы"""
+    deadline = time.monotonic() + timeout
+    dispatcher = getattr(main.bot, "dispatcher", None)
+    while time.monotonic() < deadline:
+        busy = dispatcher is not None and dispatcher.stats()['queued']
+        if not busy and not main.outbox.pending():
+            return True
+        time.sleep(0.0002)
+    return False
+
+
+def percentile(values, q):
+    """Перцентиль q (0..100) по ближайшему рангу"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
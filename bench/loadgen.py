@@ -0,0 +1,412 @@
+"""
+Нагрузочный генератор: N виртуальных сотрудников и M админов одновременно
+заказывают и одобряют через реальные хендлеры и ChatDispatcher (как при polling).
+
+    python -m bench.loadgen                                  # ступени 10,25,50,100 сотрудников
+    python -m bench.loadgen --employees 20,80,160 --admins 3 --think 0.2 --duration 15
+    python -m bench.loadgen --categories 50 --items 200 --history 200000 --json load.json
+
+Закрытая модель: виртуальный пользователь отправляет апдейт, ждет его обработки,
+«думает» (экспоненциально, в среднем --think секунд) и отправляет следующий.
+Отчет по ступеням: пропускная способность, p50/p99, таймауты и отброшенные апдейты,
+время UPDATE storage (на MySQL — еще и Innodb_row_lock_*), ожидание пула.
+Точка насыщения — первая ступень, где рост пользователей почти не дал роста
+пропускной способности или p99 вышел за --slo-ms.
+Отдельно — рост user_data / ADMIN_STATES / кеша пользователей во времени.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+
+from bench.harness import (
+    prepare_env, seed, UpdateFactory, wait_idle, percentile, ADMIN_ID, GROUP_ID,
+)
+
+# Ступень считается насыщенной, если рост пропускной способности меньше этой доли
+SATURATION_GAIN = 0.10
+
+
+class LoadStats:
+    """Задержки апдейтов от отправки до конца обработки + ожидающие их пользователи"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiting = {}  # update_id -> (время отправки, Event)
+        self.latencies = []
+        self.timeouts = 0
+        self.orders = 0
+        self.approvals = 0
+
+    def submitted(self, update):
+        done = threading.Event()
+        with self._lock:
+            self._waiting[update.update_id] = (time.perf_counter(), done)
+        return done
+
+    def finished(self, update):
+        with self._lock:
+            entry = self._waiting.pop(update.update_id, None)
+            if entry is not None:
+                self.latencies.append(time.perf_counter() - entry[0])
+        if entry is not None:
+            entry[1].set()
+
+    def add(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def reset(self):
+        with self._lock:
+            self._waiting.clear()
+            self.latencies = []
+            self.timeouts = 0
+            self.orders = 0
+            self.approvals = 0
+
+
+class StorageLockProbe:
+    """
+    Время UPDATE storage (ожидание строчных блокировок + сама запись) и ошибки блокировок.
+    На MySQL дополнительно — приращение Innodb_row_lock_waits / Innodb_row_lock_time.
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+        event.listen(engine, "handle_error", self._error)
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+            self.lock_errors = 0
+        self._innodb_start = self._innodb()
+
+    @staticmethod
+    def _is_storage_write(statement):
+        return statement.lstrip()[:14].upper() == "UPDATE STORAGE"
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if self._is_storage_write(statement):
+            self._local.started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(self._local, "started", None)
+        if started is None or not self._is_storage_write(statement):
+            return
+        self._local.started = None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.count += 1
+            self.total += elapsed
+            self.max = max(self.max, elapsed)
+
+    def _error(self, context):
+        self._local.started = None
+        message = str(context.original_exception).lower()
+        if "lock" in message or "deadlock" in message:
+            with self._lock:
+                self.lock_errors += 1
+
+    def _innodb(self):
+        if self.engine.dialect.name != "mysql":
+            return None
+        from sqlalchemy import text
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("SHOW GLOBAL STATUS LIKE 'Innodb_row_lock_%'")).all()
+        return {name: int(value) for name, value in rows}
+
+    def snapshot(self):
+        with self._lock:
+            result = {
+                'storage_updates': self.count,
+                'storage_update_avg_ms': self.total / self.count * 1000 if self.count else 0.0,
+                'storage_update_max_ms': self.max * 1000,
+                'lock_errors': self.lock_errors,
+            }
+        now = self._innodb()
+        if now is not None and self._innodb_start is not None:
+            result['innodb_row_lock_waits'] = now.get('Innodb_row_lock_waits', 0) - self._innodb_start.get('Innodb_row_lock_waits', 0)
+            result['innodb_row_lock_time_ms'] = now.get('Innodb_row_lock_time', 0) - self._innodb_start.get('Innodb_row_lock_time', 0)
+        return result
+
+
+class VirtualUsers:
+    """Потоки сотрудников и админов одной ступени"""
+
+    def __init__(self, main, catalog, updates, stats, think, timeout, seed_value):
+        self.main = main
+        self.catalog = catalog
+        self.updates = updates
+        self.stats = stats
+        self.think = think
+        self.timeout = timeout
+        self.random = random.Random(seed_value)
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _pause(self, rnd):
+        if self.think > 0:
+            self._stop.wait(rnd.expovariate(1.0 / self.think))
+
+    def _send(self, update):
+        """Отправка апдейта и ожидание его обработки (False — таймаут или отброшен)"""
+        done = self.stats.submitted(update)
+        self.main.bot.process_new_updates([update])
+        if not done.wait(self.timeout):
+            self.stats.add("timeouts")
+            return False
+        return True
+
+    def _employee(self, chat_id, rnd):
+        categories = self.catalog.categories
+        while not self._stop.is_set():
+            category = rnd.choice(categories)
+            item_id = rnd.choice(self.catalog.items[category])
+            steps = [
+                self.updates.callback(chat_id, f"cat_{category}"),
+                self.updates.callback(chat_id, f"prod_{item_id}"),
+                self.updates.message(chat_id, str(rnd.randint(1, 3))),
+                self.updates.message(chat_id, "load test"),
+                self.updates.callback(chat_id, "confirm_order"),
+            ]
+            for step in steps:
+                if self._stop.is_set() or not self._send(step):
+                    break
+                self._pause(rnd)
+            else:
+                self.stats.add("orders")
+
+    def _admin(self, admin_id, rnd):
+        from sqlalchemy import select
+        from db import Session
+        from models import Request
+        while not self._stop.is_set():
+            session = Session()
+            try:
+                ids = session.execute(
+                    select(Request.id).where(Request.status == 'pending').order_by(Request.id).limit(20)
+                ).scalars().all()
+            finally:
+                session.close()
+            if not ids:
+                self._stop.wait(0.05)
+                continue
+            # Админы берут заявки вразнобой: столкновения на одной заявке — тоже часть нагрузки
+            req_id = rnd.choice(ids)
+            if self._send(self.updates.callback(GROUP_ID, f"req_appr:{req_id}", from_id=admin_id, text="📦 НОВАЯ ЗАЯВКА")):
+                self.stats.add("approvals")
+            self._pause(rnd)
+
+    def start(self, employees, admins):
+        for n in range(employees):
+            chat_id = self.catalog.employees[n % len(self.catalog.employees)]
+            rnd = random.Random(self.random.random())
+            self._threads.append(threading.Thread(target=self._employee, args=(chat_id, rnd), daemon=True))
+        for n in range(admins):
+            rnd = random.Random(self.random.random())
+            self._threads.append(threading.Thread(target=self._admin, args=(ADMIN_ID + n, rnd), daemon=True))
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        self._stop.set()
+        for t in self._threads:
+            t.join(self.timeout + 1)
+
+
+class StateSampler:
+    """Размеры хранилищ состояний и кешей раз в interval секунд"""
+
+    def __init__(self, main, interval):
+        self.main = main
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._loop, name="state-sampler", daemon=True)
+
+    def sample(self, stage):
+        from group import ADMIN_STATES
+        from user_cache import users
+        dispatcher = self.main.bot.dispatcher
+        queued = dispatcher.stats()['queued'] if dispatcher is not None else 0
+        self.samples.append({
+            't_sec': round(time.perf_counter() - self._started, 2),
+            'stage': stage,
+            'user_data': len(self.main.user_data),
+            'admin_states': len(ADMIN_STATES),
+            'user_cache': users.stats()['size'],
+            'dispatch_queued': queued,
+            'outbox_pending': self.main.outbox.pending(),
+        })
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.sample(self.stage)
+
+    def start(self):
+        self.stage = 0
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_stage(main, catalog, stats, probe, args, employees, stage_no):
+    from db import pool_stats
+    stats.reset()
+    probe.reset()
+    pool_before = pool_stats()
+    dropped_before = main.bot.dispatcher.stats()['dropped'] if main.bot.dispatcher is not None else 0
+
+    crowd = VirtualUsers(main, catalog, UpdateFactory(), stats, args.think, args.timeout, args.seed + stage_no)
+    started = time.perf_counter()
+    crowd.start(employees, args.admins)
+    time.sleep(args.duration)
+    crowd.stop()
+    elapsed = time.perf_counter() - started
+    wait_idle(main, timeout=args.timeout)
+
+    pool_after = pool_stats()
+    acquired = pool_after['acquired'] - pool_before['acquired']
+    waited = pool_after['wait_total_sec'] - pool_before['wait_total_sec']
+    latencies = list(stats.latencies)
+    result = {
+        'employees': employees,
+        'admins': args.admins,
+        'seconds': round(elapsed, 2),
+        'updates': len(latencies),
+        'updates_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'orders': stats.orders,
+        'approvals': stats.approvals,
+        'timeouts': stats.timeouts,
+        'dropped': (main.bot.dispatcher.stats()['dropped'] if main.bot.dispatcher is not None else 0) - dropped_before,
+        'pool_wait_avg_ms': waited / acquired * 1000 if acquired else 0.0,
+        'pool_timeouts': pool_after['timeouts'] - pool_before['timeouts'],
+    }
+    result.update(probe.snapshot())
+    return result
+
+
+def find_saturation(stages, slo_ms):
+    """Первая ступень, где пропускная способность перестала расти или p99 вышел за SLO"""
+    for prev, cur in zip(stages, stages[1:]):
+        gain = (cur['updates_per_sec'] - prev['updates_per_sec']) / prev['updates_per_sec'] if prev['updates_per_sec'] else 0
+        if gain < SATURATION_GAIN or cur['p99_ms'] > slo_ms or cur['timeouts'] or cur['dropped']:
+            return cur
+    if stages and stages[0]['p99_ms'] > slo_ms:
+        return stages[0]
+    return None
+
+
+def print_report(stages, samples, saturation, slo_ms):
+    header = (f"{'empl':>5}{'adm':>4}{'upd/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'orders':>8}{'appr':>6}"
+              f"{'t/o':>5}{'drop':>5}{'stor ms':>9}{'stor max':>9}{'lockerr':>8}{'pool ms':>8}")
+    print(header)
+    print("-" * len(header))
+    for s in stages:
+        print(f"{s['employees']:>5}{s['admins']:>4}{s['updates_per_sec']:>9.1f}{s['p50_ms']:>9.1f}{s['p99_ms']:>9.1f}"
+              f"{s['orders']:>8}{s['approvals']:>6}{s['timeouts']:>5}{s['dropped']:>5}"
+              f"{s['storage_update_avg_ms']:>9.2f}{s['storage_update_max_ms']:>9.1f}{s['lock_errors']:>8}{s['pool_wait_avg_ms']:>8.2f}")
+        if 'innodb_row_lock_waits' in s:
+            print(f"      InnoDB: ожиданий блокировок {s['innodb_row_lock_waits']}, {s['innodb_row_lock_time_ms']} мс")
+
+    if saturation is None:
+        print(f"\nНасыщение не достигнуто (p99 < {slo_ms:.0f} мс на всех ступенях)")
+    else:
+        print(f"\nНасыщение: ~{saturation['employees']} сотрудников, {saturation['updates_per_sec']:.1f} апд/с, p99 {saturation['p99_ms']:.0f} мс")
+
+    print("\nРост состояний (user_data / ADMIN_STATES / кеш пользователей / очередь диспетчера / outbox):")
+    step = max(1, len(samples) // 20)
+    for s in samples[::step]:
+        print(f"  t={s['t_sec']:>7.1f}s ступень {s['stage']}: {s['user_data']:>6} / {s['admin_states']:>4} / "
+              f"{s['user_cache']:>6} / {s['dispatch_queued']:>4} / {s['outbox_pending']:>4}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный генератор: виртуальные сотрудники и админы")
+    parser.add_argument("--employees", default="10,25,50,100", help="ступени: число сотрудников через запятую")
+    parser.add_argument("--admins", type=int, default=2)
+    parser.add_argument("--think", type=float, default=0.5, help="среднее время «раздумий» между шагами, с")
+    parser.add_argument("--duration", type=float, default=20, help="длительность ступени, с")
+    parser.add_argument("--timeout", type=float, default=30, help="ожидание обработки одного апдейта, с")
+    parser.add_argument("--workers", type=int, default=8, help="потоков диспетчера (DISPATCH_WORKERS)")
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument("--items", type=int, default=50, help="товаров в категории")
+    parser.add_argument("--history", type=int, default=10000, help="обработанных заявок в истории")
+    parser.add_argument("--slo-ms", type=float, default=1000, help="порог p99 для точки насыщения")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="период замера состояний, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db-url", default=None, help="вместо временного SQLite (БД будет пересоздана!)")
+    parser.add_argument("--json", dest="json_path", default=None, help="записать результаты в файл JSON")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    levels = [int(n) for n in args.employees.split(",") if n.strip()]
+    workdir = prepare_env(db_url=args.db_url, dispatch_workers=args.workers)
+
+    catalog = seed(args.categories, args.items, max(levels), args.history)
+    import main
+    from db import engine
+
+    stats = LoadStats()
+    if main.bot.dispatcher is not None:
+        inner = main.bot.dispatcher.handle
+
+        def handle(update):
+            try:
+                inner(update)
+            finally:
+                stats.finished(update)
+        main.bot.dispatcher.handle = handle
+    else:
+        # Без диспетчера апдейт обрабатывается прямо в process_new_updates
+        inner = main.bot.process_new_updates
+
+        def process(updates):
+            inner(updates)
+            for update in updates:
+                stats.finished(update)
+        main.bot.process_new_updates = process
+
+    probe = StorageLockProbe(engine)
+    sampler = StateSampler(main, args.sample_interval)
+    sampler.start()
+
+    stages = []
+    for n, employees in enumerate(levels, 1):
+        sampler.stage = n
+        print(f"▶ Ступень {n}: {employees} сотрудников, {args.admins} админов, {args.duration:.0f} с")
+        stages.append(run_stage(main, catalog, stats, probe, args, employees, n))
+    sampler.sample(len(levels))
+    sampler.stop()
+
+    saturation = find_saturation(stages, args.slo_ms)
+    print()
+    print_report(stages, sampler.samples, saturation, args.slo_ms)
+    print(f"\nБД и журналы: {workdir}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({'args': vars(args), 'stages': stages, 'saturation': saturation,
+                       'state_samples': sampler.samples}, f, ensure_ascii=False, indent=2)
+    main.outbox.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
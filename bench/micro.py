@@ -0,0 +1,344 @@
+"""
+Микробенчмарки горячих путей на засеянных данных (без сети).
+
+    python -m bench.micro --json before.json
+    python -m bench.micro --json after.json --compare before.json --tolerance 0.2
+    python -m bench.micro --filter kb_ --log-rows 1000,10000
+
+Время — мкс на вызов: медиана и минимум по повторам. Число вызовов в повторе подбирается так,
+чтобы повтор длился не меньше MIN_REPEAT_SEC (иначе микросекундные случаи тонут в шуме таймера).
+Замер повторяется в --processes отдельных процессах: у каждого процесса своя раскладка памяти
+и хешей, и микросекундные случаи от процесса к процессу отличаются в разы сильнее, чем между
+повторами внутри одного. Итог: минимум по всем процессам и медиана медиан процессов.
+
+Скорость машины плавает и между запусками, и внутри одного (на общих виртуалках — на десятки
+процентов за секунды), поэтому вокруг каждого повтора замеряется эталонный цикл на чистом Python.
+rel — медиана отношений «вызов / эталон» по повторам, от скорости машины почти не зависит.
+
+--compare сравнивает rel и завершает процесс с кодом 1, если он вырос больше чем на --tolerance.
+Для старых файлов без rel сравниваются минимумы, и рост в пределах их собственного разброса
+(медиана / минимум - 1 в базе и сейчас) регрессией не считается. Случаи, которых нет в базовом
+файле, только печатаются.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import tempfile
+import subprocess
+from datetime import datetime
+
+from bench.harness import prepare_env, seed, wait_idle, ROOT
+
+# Минимальная длительность одного повтора при подборе числа вызовов, сек
+MIN_REPEAT_SEC = 0.05
+# Итераций эталонного цикла (около миллисекунды)
+REFERENCE_LOOPS = 20000
+
+
+def reference():
+    """Время эталонного цикла, сек: мера текущей скорости машины"""
+    started = time.perf_counter()
+    total = 0
+    for i in range(REFERENCE_LOOPS):
+        total += i * i
+    return time.perf_counter() - started
+
+
+class Case:
+    """
+    number вызовов fn() за повтор; setup() — перед каждым повтором, вне замера.
+    Без setup number увеличивается, пока повтор не займет MIN_REPEAT_SEC.
+    """
+
+    def __init__(self, name, fn, number=1000, repeat=7, setup=None):
+        self.name = name
+        self.fn = fn
+        self.number = number
+        self.repeat = repeat
+        self.setup = setup
+
+    def _calibrate(self):
+        fn = self.fn
+        while True:
+            started = time.perf_counter()
+            for _ in range(self.number):
+                fn()
+            if time.perf_counter() - started >= MIN_REPEAT_SEC:
+                return
+            self.number *= 2
+
+    def run(self):
+        if self.setup is None:
+            self._calibrate()
+        timings = []
+        relative = []
+        for _ in range(self.repeat):
+            if self.setup is not None:
+                self.setup()
+            fn = self.fn
+            before = reference()
+            started = time.perf_counter()
+            for _ in range(self.number):
+                fn()
+            timing = (time.perf_counter() - started) / self.number
+            after = reference()
+            timings.append(timing)
+            relative.append(timing / ((before + after) / 2))
+        return {
+            'median_us': statistics.median(timings) * 1e6,
+            'min_us': min(timings) * 1e6,
+            'rel': statistics.median(relative),
+            'number': self.number,
+            'repeat': self.repeat,
+        }
+
+
+# --- СЛУЧАИ ---
+
+def keyboard_cases(main, group, session, catalog):
+    category = catalog.categories[0]
+    return [
+        Case("kb_categories", lambda: main.kb_categories(session)),
+        Case("kb_categories.build", lambda: main._build_kb_categories(session), number=200),
+        Case("kb_items", lambda: main.kb_items(session, category)),
+        Case("kb_items.build", lambda: main._build_kb_items(session, category), number=200),
+        Case("kb_admin_items", lambda: group.kb_admin_items(session, category, mode='add')),
+        Case("kb_admin_items.build", lambda: group._build_kb_admin_items(session, category, 'add', None), number=200),
+    ]
+
+
+def price_cases(group):
+    inputs = ["12", "12.5", "1 234,50", " 0,99 ", "1e3", "abc", "-5", "100000.001"]
+
+    def parse_all():
+        for text in inputs:
+            try:
+                group.parse_cost_price(text)
+            except ValueError:
+                pass
+    return [Case("parse_cost_price", parse_all, number=2000)]
+
+
+def log_cases(sizes):
+    """
+    Журнал, в текущем файле которого уже size строк:
+    excel_flush — сброс пачки в Excel (от size зависеть не должен);
+    log_user_action — запись + остановка журнала: audit_events и сохранение книги, как при ротации
+    """
+    import excel_logger
+    from config import EXCEL_LOG_BATCH_SIZE
+    from user_cache import UserSnapshot
+
+    user = UserSnapshot(id=1, user_id=1, it_code="IT0", first_name="Bench", last_name="User", last_msg_id=None)
+
+    def make_row():
+        now = datetime.now()
+        return [now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"), "IT0", "Bench User",
+                "Создание заявки", "Item", 1, "bench", "Pending"]
+
+    batch = [("Users", make_row(), None) for _ in range(EXCEL_LOG_BATCH_SIZE)]
+    cases = []
+    for size in sizes:
+        def fill(size=size):
+            # Недописанную книгу нельзя бросать: ее временные файлы openpyxl останутся открытыми
+            excel_logger._close_shard()
+            row = make_row()
+            shard = excel_logger._open_shard(row[0][:7])
+            for _ in range(size):
+                shard.append("Users", list(row))
+            excel_logger._shard = shard
+
+        def log_and_flush():
+            excel_logger.log_user_action(user, "Создание заявки", "Item", 1, "bench", "Pending")
+            excel_logger.shutdown()
+
+        # Книга на 100k строк сохраняется секунды: повторов меньше
+        repeat = 3 if size >= 100000 else 5
+        cases.append(Case(f"excel_flush[{size // 1000}k]", lambda: excel_logger._write_batch(batch),
+                          number=20, repeat=repeat, setup=fill))
+        cases.append(Case(f"log_user_action[{size // 1000}k]", log_and_flush, number=1, repeat=repeat, setup=fill))
+    return cases
+
+
+def restore_cases(main, session, catalog):
+    from state_store import UserSession
+    from user_cache import users
+    chat_id = catalog.employees[0]
+    item_id = catalog.items[catalog.categories[0]][0]
+
+    def menu_state():
+        main.user_data.put(chat_id, UserSession())
+        users.remember_last_msg_id(chat_id, 1)
+
+    def qty_state():
+        main.user_data.put(chat_id, UserSession(state=main.STATES['WAIT_QTY'], item_id=item_id))
+        users.remember_last_msg_id(chat_id, 1)
+
+    def restore():
+        main.restore_user_interface(chat_id, session)
+        # Outbox разбирается тут же, чтобы очередь не росла между вызовами
+        wait_idle(main)
+
+    return [
+        Case("restore_user_interface", restore, number=200, setup=menu_state),
+        Case("restore_user_interface.wait_qty", restore, number=200, setup=qty_state),
+    ]
+
+
+# --- СРАВНЕНИЕ ---
+
+def spread(result):
+    """Разброс замеров: насколько медиана выше минимума (доля)"""
+    return result['median_us'] / result['min_us'] - 1 if result['min_us'] else 0.0
+
+
+def metric(current, base):
+    """
+    Что сравнивать: rel, если он есть в обоих замерах (от скорости машины не зависит, допуск —
+    только tolerance), иначе минимумы с поправкой на их собственный разброс
+    """
+    if 'rel' in current and 'rel' in base:
+        return 'rel', 0.0
+    return 'min_us', spread(base) + spread(current)
+
+
+def compare(results, baseline, tolerance):
+    """Печатает сравнение с базой; возвращает список регрессий"""
+    regressions = []
+    print(f"\n{'case':<36}{'metric':>8}{'base':>12}{'now':>12}{'change':>9}{'noise':>8}")
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<36}{'min_us':>8}{'-':>12}{current['min_us']:>12.2f}{'new':>9}")
+            continue
+        key, noise = metric(current, base)
+        change = current[key] / base[key] - 1 if base[key] else 0.0
+        mark = ""
+        if change > max(tolerance, noise):
+            regressions.append(name)
+            mark = "  ← регрессия"
+        print(f"{name:<36}{key:>8}{base[key]:>12.4g}{current[key]:>12.4g}{change:>+9.1%}{noise:>8.0%}{mark}")
+    return regressions
+
+
+def run_processes(args):
+    """Замеры в args.processes дочерних процессах; результаты по случаям, сведенные вместе"""
+    runs = []
+    for _ in range(args.processes):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            subprocess.run(
+                [sys.executable, "-m", "bench.micro", "--processes", "1", "--json", path,
+                 "--filter", args.filter, "--log-rows", args.log_rows,
+                 "--categories", str(args.categories), "--items", str(args.items)],
+                cwd=ROOT, check=True
+            )
+            with open(path, encoding="utf-8") as f:
+                runs.append(json.load(f)['results'])
+        finally:
+            os.remove(path)
+
+    results = {}
+    for name in runs[0]:
+        per_process = [run[name] for run in runs if name in run]
+        results[name] = {
+            'median_us': statistics.median(r['median_us'] for r in per_process),
+            'min_us': min(r['min_us'] for r in per_process),
+            'rel': statistics.median(r['rel'] for r in per_process),
+            'number': max(r['number'] for r in per_process),
+            'repeat': sum(r['repeat'] for r in per_process),
+            'processes': len(per_process),
+        }
+    return results
+
+
+def measure(args):
+    """Замер всех случаев в текущем процессе"""
+    sizes = [int(n) for n in args.log_rows.split(",") if n.strip()]
+    # Журнал не должен ротироваться посреди замера на большой книге
+    prepare_env(EXCEL_LOG_MAX_ROWS=max(sizes + [0]) * 2 + 1000, EXCEL_LOG_MAX_BYTES=0)
+
+    catalog = seed(args.categories, args.items, employees=10)
+    import main
+    import group
+    from db import Session
+    session = Session()
+
+    cases = (keyboard_cases(main, group, session, catalog) + price_cases(group)
+             + log_cases(sizes) + restore_cases(main, session, catalog))
+    if args.filter:
+        cases = [c for c in cases if args.filter in c.name]
+
+    results = {}
+    for case in cases:
+        results[case.name] = case.run()
+        r = results[case.name]
+        print(f"{case.name:<36}{r['median_us']:>12.2f} us  (min {r['min_us']:.2f}, {r['repeat']}x{r['number']})")
+    session.close()
+    main.outbox.stop()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Микробенчмарки клавиатур, журнала, цены и меню")
+    parser.add_argument("--filter", default="", help="только случаи, в имени которых есть подстрока")
+    parser.add_argument("--log-rows", default="1000,10000,100000", help="размеры книги журнала, строк")
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument("--items", type=int, default=30, help="товаров в категории")
+    parser.add_argument("--json", dest="json_path", default=None, help="записать результаты в файл JSON")
+    parser.add_argument("--processes", type=int, default=3, help="сколько процессов делают замер")
+    parser.add_argument("--compare", default=None, help="базовый JSON для проверки регрессий")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="допустимый рост rel (0.2 = +20%%), если разброс замеров меньше")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    if args.processes > 1:
+        results = run_processes(args)
+        print(f"\nИтог по {args.processes} процессам:")
+        for name, r in results.items():
+            print(f"{name:<36}{r['median_us']:>12.2f} us  (min {r['min_us']:.2f}, разброс {spread(r):.0%})")
+    else:
+        results = measure(args)
+
+    if args.json_path:
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+            },
+            'results': results,
+        }
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f).get('results', {})
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ Регрессии (> {args.tolerance:.0%}): {', '.join(regressions)}")
+            return 1
+        print(f"\n✔ Регрессий нет (допуск {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
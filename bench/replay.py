@@ -0,0 +1,185 @@
+"""
+Сквозной бенчмарк: реальные хендлеры main.py / group.py, фейковый Telegram, засеянный SQLite.
+
+    python -m bench.replay                       # все сценарии, 100 прогонов
+    python -m bench.replay -n 500 --flows order,req_appr
+    python -m bench.replay --json result.json
+
+Сценарий — цепочка апдейтов одного пользователя (как в жизни); время сценария —
+от первого апдейта до момента, когда outbox отправил последний вызов.
+Запросы к БД считаются только в потоке обработки (фоновые сбросы журнала и кешей — нет).
+"""
+import sys
+import json
+import time
+import argparse
+
+from bench.harness import (
+    prepare_env, seed, add_pending_request, UpdateFactory, QueryCounter, wait_idle, percentile,
+    ADMIN_ID, GROUP_ID,
+)
+
+
+class Flow:
+    """Сценарий: updates(i) -> [апдейты]; prepare(i) — подготовка вне замера"""
+
+    def __init__(self, name, updates, prepare=None):
+        self.name = name
+        self.updates = updates
+        self.prepare = prepare
+
+
+def build_flows(catalog, updates):
+    employees = catalog.employees
+    categories = catalog.categories
+
+    def employee(i):
+        return employees[i % len(employees)]
+
+    def category(i):
+        return categories[i % len(categories)]
+
+    def item(i):
+        ids = catalog.items[category(i)]
+        return ids[i % len(ids)]
+
+    pending = {}
+
+    def prepare_req_appr(i):
+        pending[i] = add_pending_request(employee(i), item(i))
+
+    return [
+        Flow("start", lambda i: [updates.message(employee(i), "/start")]),
+        Flow("registration", lambda i: [
+            updates.message(500000 + i, "/start"),
+            updates.message(500000 + i, f"NEW{i}"),
+            updates.message(500000 + i, "Bench Newcomer"),
+        ]),
+        Flow("order", lambda i: [
+            updates.callback(employee(i), f"cat_{category(i)}"),
+            updates.callback(employee(i), f"prod_{item(i)}"),
+            updates.message(employee(i), "1"),
+            updates.message(employee(i), "bench order"),
+            updates.callback(employee(i), "confirm_order"),
+        ]),
+        Flow("req_appr", lambda i: [
+            updates.callback(GROUP_ID, f"req_appr:{pending.pop(i)}", from_id=ADMIN_ID, text="📦 НОВАЯ ЗАЯВКА"),
+        ], prepare=prepare_req_appr),
+        Flow("add", lambda i: [
+            updates.message(GROUP_ID, "/add", from_id=ADMIN_ID),
+            updates.callback(GROUP_ID, f"adm_cat_exist:{category(i)}", from_id=ADMIN_ID),
+            updates.callback(GROUP_ID, f"adm_item_exist:{item(i)}", from_id=ADMIN_ID),
+            updates.message(GROUP_ID, "1", from_id=ADMIN_ID),
+        ]),
+        Flow("edit", lambda i: [
+            updates.message(GROUP_ID, "/edit", from_id=ADMIN_ID),
+            updates.callback(GROUP_ID, f"adm_cat_exist:{category(i)}", from_id=ADMIN_ID),
+            updates.callback(GROUP_ID, f"adm_item_edit:{item(i)}", from_id=ADMIN_ID),
+            updates.callback(GROUP_ID, f"edt_cost:{item(i)}", from_id=ADMIN_ID),
+            updates.message(GROUP_ID, f"{10 + i % 90}.50", from_id=ADMIN_ID),
+        ]),
+    ]
+
+
+def run_flow(main, flow, queries, iterations, warmup, offset):
+    """Прогоняет сценарий; возвращает сводку по замеренным прогонам"""
+    latencies = []
+    query_total = 0
+    calls_total = 0
+    updates_total = 0
+    started_all = time.perf_counter()
+    measured_time = 0.0
+
+    for n in range(warmup + iterations):
+        i = offset + n
+        if flow.prepare is not None:
+            flow.prepare(i)
+        batch = flow.updates(i)
+        queries_before = queries.count
+        calls_before = main.bot.call_count()
+
+        started = time.perf_counter()
+        for update in batch:
+            main.bot.process_new_updates([update])
+        wait_idle(main)
+        elapsed = time.perf_counter() - started
+
+        if n >= warmup:
+            latencies.append(elapsed)
+            measured_time += elapsed
+            query_total += queries.count - queries_before
+            calls_total += main.bot.call_count() - calls_before
+            updates_total += len(batch)
+
+    return {
+        'flow': flow.name,
+        'runs': iterations,
+        'updates_per_run': updates_total / iterations if iterations else 0,
+        'throughput_per_sec': iterations / measured_time if measured_time else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000 if latencies else 0.0,
+        'queries_per_run': query_total / iterations if iterations else 0,
+        'api_calls_per_run': calls_total / iterations if iterations else 0,
+        'wall_sec': time.perf_counter() - started_all,
+    }
+
+
+def print_table(results):
+    header = f"{'flow':<14}{'runs':>6}{'upd/run':>9}{'runs/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'SQL/run':>9}{'API/run':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['flow']:<14}{r['runs']:>6}{r['updates_per_run']:>9.1f}{r['throughput_per_sec']:>10.1f}"
+              f"{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['max_ms']:>9.2f}{r['queries_per_run']:>9.1f}{r['api_calls_per_run']:>9.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк хендлеров бота (без сети)")
+    parser.add_argument("-n", "--iterations", type=int, default=100, help="замеряемых прогонов на сценарий")
+    parser.add_argument("--warmup", type=int, default=5, help="прогонов на прогрев (не замеряются)")
+    parser.add_argument("--flows", default="", help="через запятую: start,registration,order,req_appr,add,edit")
+    parser.add_argument("--categories", type=int, default=5)
+    parser.add_argument("--items", type=int, default=20, help="товаров в категории")
+    parser.add_argument("--employees", type=int, default=50)
+    parser.add_argument("--history", type=int, default=1000, help="обработанных заявок в истории")
+    parser.add_argument("--db-url", default=None, help="вместо временного SQLite (БД будет пересоздана!)")
+    parser.add_argument("--json", dest="json_path", default=None, help="записать результаты в файл JSON")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    workdir = prepare_env(db_url=args.db_url)
+
+    catalog = seed(args.categories, args.items, args.employees, args.history)
+    import main
+    from db import engine
+    queries = QueryCounter(engine)
+
+    flows = build_flows(catalog, UpdateFactory())
+    if args.flows:
+        wanted = [name.strip() for name in args.flows.split(",") if name.strip()]
+        unknown = set(wanted) - {f.name for f in flows}
+        if unknown:
+            print(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+            return 2
+        flows = [f for f in flows if f.name in wanted]
+
+    results = []
+    offset = 0
+    for flow in flows:
+        results.append(run_flow(main, flow, queries, args.iterations, args.warmup, offset))
+        offset += args.iterations + args.warmup
+
+    print_table(results)
+    print(f"\nБД и журналы: {workdir}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({'args': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+    main.outbox.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,166 @@
+import threading
+from models import Storage, Category
+from config import PAGE_SIZE
+from pagination import slice_page
+
+
+class CatalogCategory:
+    """Снимок категории (Category): id идет в callback_data, name — на кнопки"""
+    __slots__ = ("id", "name")
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class CatalogItem:
+    """Снимок строки склада (Storage) для построения меню; category — название категории"""
+    __slots__ = ("id", "category_id", "category", "item_name", "quantity", "cost_price")
+
+    def __init__(self, id, category_id, category, item_name, quantity, cost_price):
+        self.id = id
+        self.category_id = category_id
+        self.category = category
+        self.item_name = item_name
+        self.quantity = quantity
+        self.cost_price = cost_price
+
+    @classmethod
+    def from_storage(cls, item, category_name=None):
+        """category_name — если уже известно (иначе подгрузится item.category)"""
+        if category_name is None:
+            category_name = item.category.name
+        return cls(item.id, item.category_id, category_name, item.item_name, item.quantity, item.cost_price)
+
+
+class CatalogCache:
+    """
+    Каталог склада в памяти: категории, товары и остатки.
+    Загружается одним запросом при первом обращении. Любое изменение
+    увеличивает version, по которой можно кешировать производные данные (клавиатуры).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = 0
+        self._loaded = False
+        self._items = {}        # id -> CatalogItem
+        self._categories = {}   # id категории -> CatalogCategory (только непустые, по первому товару)
+        self._by_category = {}  # id категории -> [id товара, ...] по возрастанию id
+
+    @property
+    def version(self):
+        return self._version
+
+    def current_version(self, session):
+        """Версия после загрузки каталога (для ключей производных кешей)"""
+        self._ensure_loaded(session)
+        return self._version
+
+    def _ensure_loaded(self, session):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            rows = session.query(
+                Storage.id, Storage.category_id, Category.name, Storage.item_name, Storage.quantity, Storage.cost_price
+            ).join(Category, Storage.category_id == Category.id).order_by(Storage.id).all()
+
+            self._items = {}
+            self._categories = {}
+            self._by_category = {}
+            for row in rows:
+                self._items[row.id] = CatalogItem(*row)
+                if row.category_id not in self._categories:
+                    self._categories[row.category_id] = CatalogCategory(row.category_id, row.name)
+                self._by_category.setdefault(row.category_id, []).append(row.id)
+            self._loaded = True
+            self._version += 1
+
+    # --- ЧТЕНИЕ ---
+
+    def categories(self, session):
+        """Категории, в которых есть товары (CatalogCategory)"""
+        self._ensure_loaded(session)
+        with self._lock:
+            # Фильтруем пустые названия, если есть
+            return [cat for cat in self._categories.values() if cat.name]
+
+    def category(self, session, category_id):
+        """Категория по id; id можно передать строкой прямо из callback_data (мусор -> None)"""
+        try:
+            category_id = int(category_id)
+        except (TypeError, ValueError):
+            return None
+        self._ensure_loaded(session)
+        with self._lock:
+            return self._categories.get(category_id)
+
+    def items(self, session, category_id):
+        self._ensure_loaded(session)
+        with self._lock:
+            return [self._items[i] for i in self._by_category.get(category_id, ())]
+
+    def items_page(self, session, category_id, cursor=None, limit=PAGE_SIZE):
+        """Одна страница товаров категории: (товары, курсор назад, курсор вперед)"""
+        self._ensure_loaded(session)
+        with self._lock:
+            page, prev_cursor, next_cursor = slice_page(self._by_category.get(category_id, []), cursor, limit)
+            return [self._items[i] for i in page], prev_cursor, next_cursor
+
+    def get(self, session, item_id):
+        self._ensure_loaded(session)
+        with self._lock:
+            return self._items.get(item_id)
+
+    # --- ИЗМЕНЕНИЯ (вызывать после commit) ---
+
+    def invalidate(self):
+        """Сброс: следующее чтение перечитает каталог из БД"""
+        with self._lock:
+            self._loaded = False
+            self._items = {}
+            self._categories = {}
+            self._by_category = {}
+            self._version += 1
+
+    def set_quantity(self, item_id, quantity):
+        """Точечное обновление остатка без перечитывания каталога"""
+        with self._lock:
+            item = self._items.get(item_id)
+            if item is not None:
+                item.quantity = quantity
+                self._version += 1
+
+    def update_item(self, storage_item):
+        """
+        Обновляет товар по ORM-объекту или CatalogItem.from_storage(...);
+        новый товар или смена категории — полный сброс.
+        """
+        with self._lock:
+            item = self._items.get(storage_item.id)
+            if not self._loaded:
+                return
+            if item is None or item.category_id != storage_item.category_id:
+                self.invalidate()
+                return
+            item.item_name = storage_item.item_name
+            item.quantity = storage_item.quantity
+            item.cost_price = storage_item.cost_price
+            self._version += 1
+
+    def rename_category(self, category_id, name):
+        """Переименование категории: меняется только название в снимках, без перечитывания"""
+        with self._lock:
+            category = self._categories.get(category_id)
+            if category is None:
+                return
+            category.name = name
+            for item_id in self._by_category.get(category_id, ()):
+                self._items[item_id].category = name
+            self._version += 1
+
+
+# Общий кеш процесса: используется и в main.py, и в group.py
+catalog = CatalogCache()
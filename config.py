@@ -27,4 +27,88 @@ if not DB_URL:
         print(f"🔧 DB_URL сгенерирован автоматически для хоста: {db_host}")
     else:
         # Если чего-то не хватает, оставляем None (вызовет ошибку позже, но понятную)
-        print("⚠️ Не удалось сгенерировать DB_URL: не хватает DB_USER, DB_HOST или других переменных.")
\ No newline at end of file
+        print("⚠️ Не удалось сгенерировать DB_URL: не хватает DB_USER, DB_HOST или других переменных.")
+
+# --- ПУЛ СОЕДИНЕНИЙ С БД ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+
+# --- ОБРАБОТКА АПДЕЙТОВ ---
+# Потоки-обработчики (0 — обрабатывать последовательно в потоке polling)
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "8"))
+# Сколько апдейтов одного чата может ждать в очереди; лишние отбрасываются
+DISPATCH_QUEUE_DEPTH = int(os.getenv("DISPATCH_QUEUE_DEPTH", "20"))
+# Сколько апдейтов всего может ждать обработки: polling при переполнении ждет, webhook отвечает 503
+DISPATCH_MAX_QUEUED = int(os.getenv("DISPATCH_MAX_QUEUED", "1000"))
+
+# --- РЕЖИМ ЗАПУСКА ---
+# 'polling' — long polling (по умолчанию), 'webhook' — встроенный HTTP-сервер,
+# 'async' — AsyncTeleBot и хендлеры-корутины (async_bot.py, нужен aiohttp)
+RUN_MODE = os.getenv("RUN_MODE", "polling").lower()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Публичный адрес (https://bot.example.com). Если не задан — setWebhook не вызывается (локальный тест)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+# --- СОСТОЯНИЯ ДИАЛОГОВ (FSM) ---
+# 'sqlite' — состояния переживают перезапуск; 'memory' — только в памяти процесса
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite").lower()
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "bot_state.sqlite")
+STATE_TTL = int(os.getenv("STATE_TTL", str(24 * 3600)))
+STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "10000"))
+
+# --- ЖУРНАЛ ДЕЙСТВИЙ (Excel) ---
+# Записи копятся в очереди и сбрасываются пачкой: по размеру или по таймеру
+EXCEL_LOG_BATCH_SIZE = int(os.getenv("EXCEL_LOG_BATCH_SIZE", "50"))
+EXCEL_LOG_FLUSH_INTERVAL = float(os.getenv("EXCEL_LOG_FLUSH_INTERVAL", "5"))
+# Файлы режутся по месяцам (bot_logs_2026-10.xlsx) и по лимиту строк/размера.
+# Файл сохраняется на диск при ротации и при остановке бота; каждый запуск начинает
+# новый файл (bot_logs_2026-10_2.xlsx, _3, ...). Полный журнал — таблица audit_events.
+EXCEL_LOG_DIR = os.getenv("EXCEL_LOG_DIR", ".")
+EXCEL_LOG_MAX_ROWS = int(os.getenv("EXCEL_LOG_MAX_ROWS", "10000"))
+EXCEL_LOG_MAX_BYTES = int(os.getenv("EXCEL_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+# Строки, которые БД не приняла (audit_events), повторяются с паузой от DELAY до MAX_DELAY сек;
+# в памяти держим не больше MAX_ROWS (старейшие сверх лимита теряются, в Excel они есть)
+AUDIT_RETRY_DELAY = float(os.getenv("AUDIT_RETRY_DELAY", "1"))
+AUDIT_RETRY_MAX_DELAY = float(os.getenv("AUDIT_RETRY_MAX_DELAY", "60"))
+AUDIT_RETRY_MAX_ROWS = int(os.getenv("AUDIT_RETRY_MAX_ROWS", "10000"))
+
+# --- ИСХОДЯЩИЕ СООБЩЕНИЯ (outbox.py) ---
+# Лимиты Telegram: ~30 сообщений/сек на бота, ~1/сек в личный чат, ~20/мин в группу
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_GROUP_PER_MINUTE = float(os.getenv("OUTBOX_GROUP_PER_MINUTE", "20"))
+# Сколько хендлер ждет ответа Telegram на вызов из очереди (job.result()), сек
+OUTBOX_RESULT_TIMEOUT = float(os.getenv("OUTBOX_RESULT_TIMEOUT", "30"))
+
+# --- КЛАВИАТУРЫ ---
+# Сколько товаров / заявок на одной странице клавиатуры (кнопки ◀️ ▶️ листают дальше)
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "10"))
+
+# --- КЕШ ПОЛЬЗОВАТЕЛЕЙ ---
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "600"))
+# last_msg_id копится в памяти и пишется в БД пачкой раз в N секунд (и при остановке)
+LAST_MSG_FLUSH_INTERVAL = float(os.getenv("LAST_MSG_FLUSH_INTERVAL", "5"))
+
+# --- МЕТРИКИ (Prometheus) ---
+# METRICS_ENABLED=0 отключает сбор и HTTP-эндпоинт полностью
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# --- ПРОФИЛИРОВАНИЕ SQL ---
+SQL_PROFILE_ENABLED = os.getenv("SQL_PROFILE_ENABLED", "1").lower() in ("1", "true", "yes")
+# Запросы дольше порога (мс) пишутся в журнал медленных запросов
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+# Сколько одинаковых по форме запросов за один апдейт считать признаком N+1
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+# Файл журнала медленных запросов и N+1 (пусто — вывод в stdout)
+SQL_SLOW_LOG = os.getenv("SQL_SLOW_LOG", "")
@@ -1,9 +1,11 @@
 import os
+import sys
 import secrets
 import string
+import argparse
 from urllib.parse import quote_plus
-from sqlalchemy import create_engine, text
-from models import Base
+from sqlalchemy import create_engine, text, inspect, MetaData, Table, Column, Integer, String, DateTime, func
+from models import Base, Category, Storage, Request, AuditEvent
 
 # --- НАСТРОЙКИ ПО УМОЛЧАНИЮ ---
 DEFAULT_DB_HOST = "localhost"
@@ -106,10 +108,165 @@ def init_tables(db_url):
     try:
         engine = create_engine(db_url)
         Base.metadata.create_all(engine)
+        # Свежая схема уже содержит все изменения — помечаем миграции примененными
+        with engine.begin() as conn:
+            _stamp_all(conn)
         print("✔ Таблицы SQLAlchemy созданы.")
     except Exception as e:
         print(f"❌ Ошибка при создании таблиц: {e}")
 
+# --- МИГРАЦИИ СХЕМЫ ---
+# create_all() создает только отсутствующие таблицы и не меняет существующие,
+# поэтому изменения схемы живой БД описываются здесь и применяются по версиям.
+
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, server_default=func.now()),
+)
+
+def _create_indexes(conn, table):
+    # Индексы по колонкам, которых в живой таблице еще нет, создаст миграция, добавляющая колонку
+    existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    for index in table.indexes:
+        if all(c.name in existing for c in index.columns):
+            index.create(conn, checkfirst=True)
+
+def _m1_indexes(conn):
+    _create_indexes(conn, Storage.__table__)
+    _create_indexes(conn, Request.__table__)
+
+def _m2_audit_events(conn):
+    AuditEvent.__table__.create(conn, checkfirst=True)
+
+def _m3_categories(conn):
+    """
+    storage.category (строка в каждой строке) -> справочник categories + storage.category_id.
+    Данные переносятся: категория создается для каждого различного названия.
+    """
+    Category.__table__.create(conn, checkfirst=True)
+    sqlite = conn.dialect.name == "sqlite"
+    columns = {c['name'] for c in inspect(conn).get_columns('storage')}
+
+    if 'category_id' not in columns:
+        conn.execute(text("ALTER TABLE storage ADD COLUMN category_id INTEGER NULL"))
+    if 'category' in columns:
+        conn.execute(text(
+            "INSERT INTO categories (name) SELECT DISTINCT s.category FROM storage s "
+            "WHERE NOT EXISTS (SELECT 1 FROM categories c WHERE c.name = s.category)"
+        ))
+        conn.execute(text(
+            "UPDATE storage SET category_id = (SELECT c.id FROM categories c WHERE c.name = storage.category)"
+        ))
+        # Индекс по старой колонке мешает ее удалить
+        for index in inspect(conn).get_indexes('storage'):
+            if index['column_names'] == ['category']:
+                conn.execute(text(f"DROP INDEX {index['name']}" if sqlite else f"ALTER TABLE storage DROP INDEX {index['name']}"))
+        conn.execute(text("ALTER TABLE storage DROP COLUMN category"))
+
+    # SQLite не меняет ограничения существующих колонок: NOT NULL и FK там — только у новых БД.
+    # В MySQL каждый ALTER фиксируется сразу, поэтому, как и выше, сначала проверяем:
+    # повторный запуск после сбоя на середине не должен падать на уже сделанном шаге
+    if not sqlite:
+        inspector = inspect(conn)
+        category_id = next(c for c in inspector.get_columns('storage') if c['name'] == 'category_id')
+        if category_id['nullable']:
+            conn.execute(text("ALTER TABLE storage MODIFY category_id INTEGER NOT NULL"))
+        if not any(fk['constrained_columns'] == ['category_id'] and fk['referred_table'] == 'categories'
+                   for fk in inspector.get_foreign_keys('storage')):
+            conn.execute(text(
+                "ALTER TABLE storage ADD CONSTRAINT fk_storage_category_id "
+                "FOREIGN KEY (category_id) REFERENCES categories (id) ON DELETE CASCADE"
+            ))
+    _create_indexes(conn, Storage.__table__)
+
+def _m4_pending_index(conn):
+    """/pending листает заявки keyset'ом по id, а не по created_at"""
+    for index in inspect(conn).get_indexes('requests'):
+        if index['name'] == 'ix_requests_status_created_at':
+            conn.execute(text(
+                "DROP INDEX ix_requests_status_created_at" if conn.dialect.name == "sqlite"
+                else "ALTER TABLE requests DROP INDEX ix_requests_status_created_at"
+            ))
+    _create_indexes(conn, Request.__table__)
+
+# (версия, описание, функция(conn)); новые миграции добавлять в конец
+MIGRATIONS = [
+    (1, "Индексы storage.category, storage.item_name, requests(status, created_at)", _m1_indexes),
+    (2, "Таблица журнала audit_events", _m2_audit_events),
+    (3, "Справочник categories, storage.category -> storage.category_id", _m3_categories),
+    (4, "Индекс requests(status, id) вместо requests(status, created_at)", _m4_pending_index),
+]
+
+# Горячие запросы бота: для них dry-run показывает план выполнения
+HOT_QUERIES = [
+    ("Каталог меню", "SELECT s.*, c.name FROM storage s JOIN categories c ON c.id = s.category_id ORDER BY s.id", {}),
+    ("Товары категории", "SELECT * FROM storage WHERE category_id = :category_id", {"category_id": 0}),
+    ("Товар по имени (ADM_WAIT_QTY)", "SELECT * FROM storage WHERE item_name = :name LIMIT 1", {"name": "-"}),
+    ("Ожидающие заявки (/pending, страница)",
+     "SELECT r.id, r.req_count, u.it_code, s.item_name, s.quantity FROM requests r "
+     "JOIN users u ON r.user_pk = u.id JOIN storage s ON r.item_id = s.id "
+     "WHERE r.status = 'pending' AND r.id > :after_id ORDER BY r.id LIMIT :limit",
+     {"after_id": 0, "limit": 11}),  # PAGE_SIZE + 1
+    ("Журнал за период", "SELECT * FROM audit_events WHERE created_at >= :start ORDER BY id LIMIT 1000", {"start": "2000-01-01"}),
+]
+
+def _applied_versions(conn):
+    schema_migrations.create(conn, checkfirst=True)
+    return {row[0] for row in conn.execute(schema_migrations.select().with_only_columns(schema_migrations.c.version))}
+
+def _stamp_all(conn):
+    applied = _applied_versions(conn)
+    for version, description, _ in MIGRATIONS:
+        if version not in applied:
+            conn.execute(schema_migrations.insert().values(version=version, description=description))
+
+def explain_hot_queries(conn):
+    """Печатает EXPLAIN для горячих запросов"""
+    prefix = "EXPLAIN QUERY PLAN" if conn.dialect.name == "sqlite" else "EXPLAIN"
+    for title, sql, params in HOT_QUERIES:
+        print(f"\n▸ {title}\n  {sql}")
+        try:
+            result = conn.execute(text(f"{prefix} {sql}"), params)
+            columns = list(result.keys())
+            for row in result:
+                print("   ", ", ".join(f"{c}={v}" for c, v in zip(columns, row) if v is not None))
+        except Exception as e:
+            print(f"    ❌ {str(e).splitlines()[0]}")
+
+def migrate(db_url, dry_run=False):
+    """Доводит схему БД до актуальной. dry_run — только показать план, ничего не менять."""
+    engine = create_engine(db_url)
+
+    if not inspect(engine).has_table(Storage.__tablename__):
+        if dry_run:
+            print("Таблиц нет: будет выполнено создание схемы (create_all).")
+            return
+        init_tables(db_url)
+        return
+
+    with engine.connect() as conn:
+        applied = _applied_versions(conn)
+        conn.commit()
+    pending = [m for m in MIGRATIONS if m[0] not in applied]
+
+    if dry_run:
+        print("Ожидают применения:" if pending else "Схема актуальна, миграций нет.")
+        for version, description, _ in pending:
+            print(f"  {version}: {description}")
+        with engine.connect() as conn:
+            explain_hot_queries(conn)
+        return
+
+    for version, description, apply in pending:
+        with engine.begin() as conn:
+            apply(conn)
+            conn.execute(schema_migrations.insert().values(version=version, description=description))
+        print(f"✔ Миграция {version}: {description}")
+    if not pending:
+        print("✔ Схема актуальна.")
+
 def main():
     print("--- АВТОМАТИЧЕСКАЯ НАСТРОЙКА БД ---")
     
@@ -150,5 +307,25 @@ def main():
     else:
         print("\n⛔ Ошибка подключения к MySQL.")
 
+def cli():
+    parser = argparse.ArgumentParser(description="Настройка и миграции БД бота")
+    sub = parser.add_subparsers(dest="command")
+    p_migrate = sub.add_parser("migrate", help="Применить миграции схемы к существующей БД")
+    p_migrate.add_argument("--dry-run", action="store_true", help="Показать миграции и EXPLAIN горячих запросов")
+    p_migrate.add_argument("--db-url", help="По умолчанию DB_URL из .env")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        db_url = args.db_url
+        if not db_url:
+            from config import DB_URL
+            db_url = DB_URL
+        if not db_url:
+            print("❌ DB_URL не задан.")
+            sys.exit(1)
+        migrate(db_url, dry_run=args.dry_run)
+    else:
+        main()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    cli()
\ No newline at end of file
@@ -0,0 +1,131 @@
+import time
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
+from config import (
+    DB_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE, DB_POOL_PRE_PING
+)
+from metrics import instrument_engine
+from sql_profiler import profiler
+
+
+class _PoolWaitStats:
+    """Сколько раз и как долго потоки ждали соединение из пула"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+
+_wait_stats = _PoolWaitStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool, который замеряет время получения соединения (ожидание + подключение)"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            # Ошибки подключения (сеть, авторизация) — не таймаут ожидания пула
+            timed_out = True
+            raise
+        finally:
+            _wait_stats.record(time.perf_counter() - start, timed_out)
+
+
+def _make_engine(url):
+    """Единственный движок процесса; параметры пула берутся из config.py"""
+    if not url:
+        raise RuntimeError("DB_URL не задан. Запустите create_db.py или заполните .env")
+
+    parsed = make_url(url)
+    # In-memory SQLite (бенчмарки) живет в одном соединении — свой пул не нужен
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return create_engine(url)
+
+    return create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+
+engine = _make_engine(DB_URL)
+instrument_engine(engine)
+profiler.install(engine)
+Session = sessionmaker(bind=engine)
+
+# Сессия текущего апдейта Telegram: одна на поток обработки.
+# Открывается/коммитится/закрывается в middlewares.SessionMiddleware.
+update_session = scoped_session(Session)
+
+
+def get_db_session():
+    """Отдельная сессия вне обработки апдейта (скрипты, фоновые задачи)"""
+    return Session()
+
+
+def current_session():
+    """Сессия текущего апдейта (unit of work)"""
+    return update_session()
+
+
+def after_commit(session, callback):
+    """Выполнить callback после успешного commit сессии (например, обновить кеш)"""
+    session.info.setdefault('after_commit', []).append(callback)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit(session):
+    for callback in session.info.pop('after_commit', []):
+        try:
+            callback()
+        except Exception as e:
+            print(f"after_commit error: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_after_commit(session):
+    session.info.pop('after_commit', None)
+
+
+def pool_stats():
+    """Снимок состояния пула для мониторинга (можно опрашивать в любой момент)"""
+    pool = engine.pool
+    stats = {
+        'pool_size': getattr(pool, 'size', lambda: None)(),
+        'checked_out': getattr(pool, 'checkedout', lambda: None)(),
+        'checked_in': getattr(pool, 'checkedin', lambda: None)(),
+        'overflow': getattr(pool, 'overflow', lambda: None)(),
+    }
+    with _wait_stats._lock:
+        stats.update({
+            'acquired': _wait_stats.count,
+            'wait_total_sec': round(_wait_stats.total, 4),
+            'wait_max_sec': round(_wait_stats.max, 4),
+            'wait_avg_sec': round(_wait_stats.total / _wait_stats.count, 4) if _wait_stats.count else 0.0,
+            'timeouts': _wait_stats.timeouts,
+        })
+    return stats
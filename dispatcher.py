@@ -0,0 +1,158 @@
+import time
+import queue
+import threading
+from collections import deque
+import telebot
+from config import GROUP_ID, DISPATCH_WORKERS, DISPATCH_QUEUE_DEPTH, DISPATCH_MAX_QUEUED
+
+
+def update_key(update):
+    """
+    Ключ очереди апдейта: чат сотрудника, а в админ-группе — конкретный админ
+    (у каждого админа свой диалог /add, /edit, и они не должны ждать друг друга).
+    """
+    if update.message:
+        chat_id = update.message.chat.id
+        user_id = update.message.from_user.id if update.message.from_user else None
+    elif update.callback_query:
+        user_id = update.callback_query.from_user.id
+        message = update.callback_query.message
+        chat_id = message.chat.id if message else user_id
+    elif update.inline_query:
+        return update.inline_query.from_user.id
+    else:
+        return None
+
+    if str(chat_id) == str(GROUP_ID) and user_id is not None:
+        return ('admin', user_id)
+    return chat_id
+
+
+class ChatDispatcher:
+    """
+    Пул потоков с гарантией порядка внутри чата: апдейты одного ключа
+    обрабатываются строго по очереди одним потоком, разные ключи — параллельно.
+    Очередь ограничена и на чат (queue_depth), и в сумме (max_queued).
+    """
+
+    def __init__(self, handle, workers, queue_depth, max_queued=DISPATCH_MAX_QUEUED, key_func=update_key):
+        self.handle = handle
+        self.queue_depth = queue_depth
+        self.max_queued = max_queued
+        self.key_func = key_func
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)  # освободилось место в общей очереди
+        self._queued = 0            # апдейтов в очередях (включая обрабатываемые)
+        self._queues = {}           # ключ -> deque апдейтов
+        self._ready = queue.Queue()  # ключи, у которых есть работа и нет активного потока
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"dispatch-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, update, block=False, timeout=None):
+        """
+        Ставит апдейт в очередь его чата. False — апдейт не принят: очередь чата переполнена
+        или нет места в общей очереди (block=True — ждать места, не дольше timeout).
+        """
+        key = self.key_func(update)
+        with self._lock:
+            if block:
+                self._space.wait_for(lambda: self._queued < self.max_queued, timeout)
+            pending = self._queues.get(key)
+            if pending is not None and len(pending) >= self.queue_depth:
+                return self._reject(update, f"Очередь чата {key} переполнена")
+            if self._queued >= self.max_queued:
+                return self._reject(update, f"Очередь апдейтов заполнена ({self.max_queued})")
+            self._queued += 1
+            if pending is None:
+                # Ключа нет — значит, его никто не обрабатывает: отдаем в работу
+                self._queues[key] = deque([update])
+                self._ready.put(key)
+            else:
+                pending.append(update)
+            return True
+
+    def _reject(self, update, reason):
+        self.dropped += 1
+        print(f"⚠️ {reason}, апдейт {update.update_id} не принят")
+        return False
+
+    def load(self):
+        """Заполненность общей очереди (0..1) — для проверки готовности"""
+        with self._lock:
+            return self._queued / self.max_queued if self.max_queued else 0.0
+
+    def _worker(self):
+        while True:
+            key = self._ready.get()
+            if key is StopIteration:
+                return
+            with self._lock:
+                update = self._queues[key][0]
+            try:
+                self.handle(update)
+            except Exception as e:
+                print(f"Dispatch error ({key}): {e}")
+            with self._lock:
+                pending = self._queues[key]
+                pending.popleft()
+                self._queued -= 1
+                self._space.notify()
+                if pending:
+                    self._ready.put(key)
+                else:
+                    del self._queues[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'chats': len(self._queues),
+                'queued': self._queued,
+                'capacity': self.max_queued,
+                'dropped': self.dropped,
+            }
+
+    def stop(self, timeout=30):
+        """Дожидается обработки уже принятых апдейтов и останавливает потоки"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._queues:
+                    break
+            time.sleep(0.05)
+        for _ in self._threads:
+            self._ready.put(StopIteration)
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+
+class DispatchingTeleBot(telebot.TeleBot):
+    """TeleBot, который раздает апдейты по ChatDispatcher вместо последовательной обработки"""
+
+    def __init__(self, token, workers=DISPATCH_WORKERS, queue_depth=DISPATCH_QUEUE_DEPTH, **kwargs):
+        # Собственный пул telebot не нужен: параллельность дает диспетчер
+        kwargs['threaded'] = False
+        super().__init__(token, **kwargs)
+        self.dispatcher = ChatDispatcher(self._process_one, workers, queue_depth) if workers > 0 else None
+
+    def process_new_updates(self, updates):
+        if self.dispatcher is None:
+            return super().process_new_updates(updates)
+        for update in updates:
+            # Смещение двигаем сразу, иначе polling снова получит те же апдейты
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            # Общая очередь заполнена — polling ждет, а не теряет апдейты
+            self.dispatcher.submit(update, block=True)
+
+    def _process_one(self, update):
+        super().process_new_updates([update])
+
+    def stop_dispatcher(self):
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
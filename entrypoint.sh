@@ -6,5 +6,8 @@ if [ -z "$BOT_TOKEN" ]; then
   exit 1
 fi
 
+echo "🗄 Применение миграций БД..."
+python create_db.py migrate
+
 echo "🚀 Запуск бота..."
 python main.py
@@ -1,79 +1,314 @@
 import os
-from openpyxl import Workbook, load_workbook
-from datetime import datetime
-
-FILE_NAME = "bot_logs.xlsx"
-
-def _get_workbook():
-    """Открывает существующий или создает новый файл Excel"""
-    if not os.path.exists(FILE_NAME):
-        wb = Workbook()
-        
-        # Настраиваем лист Пользователей
-        ws_users = wb.active
-        ws_users.title = "Users"
-        ws_users.append(["Дата", "Время", "IT-код", "Имя Фамилия", "Действие", "Товар", "Кол-во", "Комментарий", "Статус"])
-        
-        # Настраиваем лист Админов
-        ws_admin = wb.create_sheet("Admins")
-        ws_admin.append(["Дата", "Время", "Admin ID", "Действие", "Детали"])
-        
-        wb.save(FILE_NAME)
-        return wb
-    else:
-        return load_workbook(FILE_NAME)
+import time
+import queue
+import atexit
+import threading
+from openpyxl import Workbook
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select
+from config import (
+    EXCEL_LOG_BATCH_SIZE, EXCEL_LOG_FLUSH_INTERVAL,
+    EXCEL_LOG_DIR, EXCEL_LOG_MAX_ROWS, EXCEL_LOG_MAX_BYTES,
+    AUDIT_RETRY_DELAY, AUDIT_RETRY_MAX_DELAY, AUDIT_RETRY_MAX_ROWS
+)
+from models import AuditEvent
+from db import engine
+from metrics import observe_excel_flush
+
+FILE_PREFIX = "bot_logs"
+
+USERS_HEADER = ["Дата", "Время", "IT-код", "Имя Фамилия", "Действие", "Товар", "Кол-во", "Комментарий", "Статус"]
+ADMINS_HEADER = ["Дата", "Время", "Admin ID", "Действие", "Детали"]
+
+# Сколько строк журнала читать из БД за один запрос при выгрузке
+EXPORT_CHUNK_SIZE = 1000
+
+# Очередь событий: (имя листа, строка, запись для БД). Пишет только фоновый поток.
+_events = queue.Queue()
+_STOP = object()
+_writer = None
+_writer_lock = threading.Lock()
+
+class _Shard:
+    """
+    Текущий файл журнала за период (месяц).
+    Книга открыта в режиме write_only: строки при сбросе дописываются на листы и уходят
+    во временный файл openpyxl, в памяти не копятся и уже записанное не пересобирается.
+    На диск книга сохраняется один раз — при ротации или остановке журнала. До этого
+    файла нет; записи, не попавшие в файл из-за падения процесса, остаются в audit_events.
+    """
+    __slots__ = ("period", "path", "wb", "sheets", "rows", "bytes")
+
+    def __init__(self, period, path):
+        self.period = period
+        self.path = path
+        self.wb = Workbook(write_only=True)
+        self.sheets = {
+            "Users": self.wb.create_sheet("Users"),
+            "Admins": self.wb.create_sheet("Admins"),
+        }
+        self.sheets["Users"].append(USERS_HEADER)
+        self.sheets["Admins"].append(ADMINS_HEADER)
+        self.rows = 0
+        self.bytes = 0
+
+    def append(self, sheet, row):
+        self.sheets[sheet].append(row)
+        self.rows += 1
+        # Оценка размера по значениям ячеек: сжатый xlsx получается меньше
+        self.bytes += sum(len(str(value).encode("utf-8")) for value in row)
+
+    def is_full(self):
+        if self.rows >= EXCEL_LOG_MAX_ROWS:
+            return True
+        return bool(EXCEL_LOG_MAX_BYTES) and self.bytes >= EXCEL_LOG_MAX_BYTES
+
+_shard = None
+
+def _shard_path(period, index):
+    suffix = period if index == 1 else f"{period}_{index}"
+    return os.path.join(EXCEL_LOG_DIR, f"{FILE_PREFIX}_{suffix}.xlsx")
+
+def _open_shard(period):
+    """
+    Новый файл за период: берем первый свободный номер, существующие не трогаем.
+    Поэтому каждый перезапуск бота начинает новый файл bot_logs_<месяц>_<N>.xlsx.
+    """
+    index = 1
+    while os.path.exists(_shard_path(period, index)):
+        index += 1
+    return _Shard(period, _shard_path(period, index))
+
+def _save_shard(shard):
+    """Сохраняет книгу через временный файл (write_only книгу можно сохранить только раз)"""
+    tmp_path = shard.path + ".tmp"
+    shard.wb.save(tmp_path)
+    os.replace(tmp_path, shard.path)
+
+def _close_shard():
+    """Сохраняет и закрывает текущий файл"""
+    global _shard
+    shard, _shard = _shard, None
+    if shard is None:
+        return
+    try:
+        _save_shard(shard)
+    except Exception as e:
+        print(f"❌ Ошибка сохранения лога {shard.path} ({shard.rows} строк): {e}")
+
+def _write_batch(batch):
+    """Дописывает пачку в файл текущего периода, при смене периода или переполнении — ротация"""
+    global _shard
+    try:
+        for sheet, row, _ in batch:
+            period = row[0][:7]  # "2026-10-18" -> "2026-10"
+            if _shard is None or _shard.period != period or _shard.is_full():
+                _close_shard()
+                _shard = _open_shard(period)
+            _shard.append(sheet, row)
+    except Exception as e:
+        print(f"❌ Ошибка записи лога ({len(batch)} строк): {e}")
+
+def _audit_rows(batch):
+    # Для executemany у всех строк должен быть одинаковый набор колонок
+    columns = [c.name for c in AuditEvent.__table__.columns if c.name != 'id']
+    return [{c: audit.get(c) for c in columns} for _, _, audit in batch]
+
+def _insert_audit(rows):
+    """Строки в audit_events одним INSERT (executemany); False — не записаны, нужен повтор"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(AuditEvent), rows)
+        return True
+    except Exception as e:
+        print(f"❌ Ошибка записи журнала в БД ({len(rows)} строк, повтор позже): {e}")
+        return False
+
+def _writer_loop():
+    """
+    Фоновый поток: копит события и сбрасывает их по размеру пачки или по таймеру.
+    Строки, которые БД не приняла, остаются в очереди повтора (пауза растет от
+    AUDIT_RETRY_DELAY до AUDIT_RETRY_MAX_DELAY). Теряются они только при переполнении
+    очереди (старейшие сверх AUDIT_RETRY_MAX_ROWS) или если БД недоступна и при остановке;
+    об этом пишется в лог, а в Excel-файле такие строки есть.
+    """
+    batch = []
+    deadline = None
+    stopping = False
+    audit = []
+    retry_at = None
+    retry_delay = 0
+
+    while not stopping:
+        wake = [t for t in (deadline, retry_at) if t is not None]
+        timeout = max(0.0, min(wake) - time.monotonic()) if wake else None
+        try:
+            event = _events.get(timeout=timeout)
+        except queue.Empty:
+            event = None
+
+        if event is _STOP:
+            stopping = True
+        elif event is not None:
+            batch.append(event)
+            if deadline is None:
+                deadline = time.monotonic() + EXCEL_LOG_FLUSH_INTERVAL
+
+        flushed = False
+        if batch and (stopping or len(batch) >= EXCEL_LOG_BATCH_SIZE
+                      or time.monotonic() >= deadline):
+            started = time.perf_counter()
+            _write_batch(batch)
+            audit.extend(_audit_rows(batch))
+            flushed = True
+            batch = []
+            deadline = None
+
+        # После ошибки БД новые строки ждут паузы вместе со старыми
+        if audit and (stopping or retry_at is None or time.monotonic() >= retry_at):
+            if _insert_audit(audit):
+                audit = []
+                retry_at = None
+                retry_delay = 0
+            else:
+                retry_delay = min(max(retry_delay * 2, AUDIT_RETRY_DELAY), AUDIT_RETRY_MAX_DELAY)
+                retry_at = time.monotonic() + retry_delay
+                if len(audit) > AUDIT_RETRY_MAX_ROWS:
+                    dropped = len(audit) - AUDIT_RETRY_MAX_ROWS
+                    audit = audit[dropped:]
+                    print(f"❌ Журнал в БД: очередь повтора переполнена, {dropped} старых строк потеряно (есть в Excel)")
+        if flushed:
+            observe_excel_flush(time.perf_counter() - started)
+
+    if audit:
+        print(f"❌ Журнал в БД: при остановке не записано {len(audit)} строк (есть только в Excel)")
+
+    _close_shard()
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_writer_loop, name="excel-logger", daemon=True)
+            _writer.start()
+
+def _enqueue(sheet, row, audit):
+    _ensure_writer()
+    _events.put((sheet, row, audit))
+
+def shutdown(timeout=30):
+    """Сбрасывает накопленные записи, сохраняет текущий файл и останавливает поток записи"""
+    global _writer
+    with _writer_lock:
+        writer = _writer
+        _writer = None
+    if writer is None or not writer.is_alive():
+        _close_shard()
+        return
+    _events.put(_STOP)
+    writer.join(timeout)
+
+atexit.register(shutdown)
 
 def log_user_action(user_obj, action, item_name="-", qty="-", comment="-", status="-"):
     """Запись действий пользователя"""
     try:
-        wb = _get_workbook()
-        ws = wb["Users"]
-        
         now = datetime.now()
         date_str = now.strftime("%Y-%m-%d")
         time_str = now.strftime("%H:%M:%S")
-        
+
+        # Поля читаем сразу: ORM-объект может быть отвязан от сессии к моменту записи
         full_name = f"{user_obj.first_name} {user_obj.last_name or ''}".strip()
-        
-        ws.append([
-            date_str, 
-            time_str, 
-            user_obj.it_code, 
-            full_name, 
-            action, 
-            item_name, 
-            qty, 
-            comment, 
+
+        _enqueue("Users", [
+            date_str,
+            time_str,
+            user_obj.it_code,
+            full_name,
+            action,
+            item_name,
+            qty,
+            comment,
             status
-        ])
-        
-        wb.save(FILE_NAME)
+        ], {
+            'created_at': now,
+            'actor_type': 'user',
+            'actor': user_obj.it_code,
+            'actor_name': full_name,
+            'action': action,
+            'item_name': str(item_name),
+            'qty': str(qty),
+            'comment': comment,
+            'status': status,
+        })
     except Exception as e:
         print(f"❌ Ошибка записи лога (User): {e}")
 
 def log_admin_action(admin_id, action, details):
     """Запись действий админа"""
     try:
-        wb = _get_workbook()
-        # Если вдруг листа нет (файл старый), создадим
-        if "Admins" not in wb.sheetnames:
-            ws = wb.create_sheet("Admins")
-            ws.append(["Дата", "Время", "Admin ID", "Действие", "Детали"])
-        else:
-            ws = wb["Admins"]
-        
         now = datetime.now()
         date_str = now.strftime("%Y-%m-%d")
         time_str = now.strftime("%H:%M:%S")
-        
-        ws.append([
+
+        _enqueue("Admins", [
             date_str,
             time_str,
             str(admin_id),
             action,
             details
-        ])
-        
-        wb.save(FILE_NAME)
+        ], {
+            'created_at': now,
+            'actor_type': 'admin',
+            'actor': str(admin_id),
+            'action': action,
+            'details': details,
+        })
     except Exception as e:
-        print(f"❌ Ошибка записи лога (Admin): {e}")
\ No newline at end of file
+        print(f"❌ Ошибка записи лога (Admin): {e}")
+
+def export_audit_xlsx(date_from, date_to, path):
+    """
+    Выгружает журнал из БД за период [date_from; date_to] (даты включительно) в xlsx.
+    Строки читаются порциями по EXPORT_CHUNK_SIZE (keyset по id) и сразу
+    пишутся в write_only книгу, поэтому память не растет с размером периода.
+    Возвращает количество выгруженных строк.
+    """
+    start = datetime.combine(date_from, datetime.min.time())
+    end = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+
+    wb = Workbook(write_only=True)
+    ws_users = wb.create_sheet("Users")
+    ws_users.append(USERS_HEADER)
+    ws_admin = wb.create_sheet("Admins")
+    ws_admin.append(ADMINS_HEADER)
+
+    total = 0
+    last_id = 0
+    with engine.connect() as conn:
+        while True:
+            rows = conn.execute(
+                select(AuditEvent.__table__)
+                .where(AuditEvent.created_at >= start, AuditEvent.created_at < end, AuditEvent.id > last_id)
+                .order_by(AuditEvent.id)
+                .limit(EXPORT_CHUNK_SIZE)
+            ).all()
+            if not rows:
+                break
+
+            for ev in rows:
+                date_str = ev.created_at.strftime("%Y-%m-%d")
+                time_str = ev.created_at.strftime("%H:%M:%S")
+                if ev.actor_type == 'user':
+                    ws_users.append([date_str, time_str, ev.actor, ev.actor_name, ev.action,
+                                     ev.item_name, ev.qty, ev.comment, ev.status])
+                else:
+                    ws_admin.append([date_str, time_str, ev.actor, ev.action, ev.details])
+
+            total += len(rows)
+            last_id = rows[-1].id
+
+    wb.save(path)
+    return total
@@ -1,20 +1,26 @@
 from telebot import types
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from config import DB_URL, GROUP_ID
-from models import Storage, Request, User
+from config import GROUP_ID
+from db import current_session, after_commit, pool_stats
+from sqlalchemy.orm import joinedload
+from models import Category, Storage, Request, User
 from decimal import Decimal, InvalidOperation
-from excel_logger import log_admin_action
-
-# Создаем подключение
-engine = create_engine(DB_URL, pool_recycle=3600)
-Session = sessionmaker(bind=engine)
-
-def get_db_session():
-    return Session()
+from datetime import date, datetime
+import os
+import tempfile
+from excel_logger import log_admin_action, log_user_action, export_audit_xlsx
+from catalog_cache import catalog, CatalogItem
+from search_index import search
+from user_cache import users
+from keyboard_cache import keyboards
+from state_store import make_state_store, AdminSession
+from approvals import approve_requests, reject_requests
+from pagination import keyset_page, page_buttons
+from metrics import timed
+from sql_profiler import profiler
 
 # --- СОСТОЯНИЯ (FSM) ---
-ADMIN_STATES = {}
+# Диалоги админов: user_id -> AdminSession (ограничено по размеру и TTL)
+ADMIN_STATES = make_state_store(AdminSession, "admin")
 (
     ADM_WAIT_CAT,        # 0
     ADM_WAIT_NAME,       # 1
@@ -27,8 +33,10 @@ ADMIN_STATES = {}
     ADM_EDIT_CAT_TXT,    # 7
     ADM_EDIT_NAME_TXT,   # 8
     ADM_EDIT_COST_TXT,   # 9
-    ADM_CONFIRM_DEL      # 10 - Подтверждение удаления
-) = range(11)
+    ADM_CONFIRM_DEL,     # 10 - Подтверждение удаления
+
+    ADM_PENDING          # 11 - Разбор заявок (/pending)
+) = range(12)
 
 # --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
 
@@ -45,9 +53,10 @@ def parse_cost_price(text: str) -> Decimal:
 
 def cleanup_last_msg(bot, user_id, chat_id):
     """Удаляет последнее сообщение меню"""
-    if user_id in ADMIN_STATES and 'last_msg_id' in ADMIN_STATES[user_id]:
+    st = ADMIN_STATES.get(user_id)
+    if st is not None and st.last_msg_id:
         try:
-            bot.delete_message(chat_id, ADMIN_STATES[user_id]['last_msg_id'])
+            bot.delete_message(chat_id, st.last_msg_id)
         except:
             pass
 
@@ -56,18 +65,15 @@ def reopen_admin_menu(bot, user_id, chat_id, text_prefix=""):
     Переотправляет главное меню.
     Инициализирует состояние, если оно потеряно после перезагрузки.
     """
-    session = get_db_session()
+    session = current_session()
     
     # Восстанавливаем режим или ставим дефолтный 'add'
-    current_data = ADMIN_STATES.get(user_id, {})
-    mode = current_data.get('mode', 'add')
+    current = ADMIN_STATES.get(user_id)
+    mode = current.mode if current is not None else 'add'
     
     # Полная перезапись состояния
-    ADMIN_STATES[user_id] = {
-        'state': ADM_WAIT_CAT,
-        'mode': mode,
-        'data': {} 
-    }
+    st = AdminSession(state=ADM_WAIT_CAT, mode=mode)
+    ADMIN_STATES.put(user_id, st)
     
     # Убрали Markdown форматирование для надежности
     header = "📦 Пополнение склада (/add)" if mode == 'add' else "🛠 Редактор товаров (/edit)"
@@ -76,44 +82,49 @@ def reopen_admin_menu(bot, user_id, chat_id, text_prefix=""):
     
     # 1. Если есть уведомление, отправляем его отдельно
     if text_prefix:
-        try:
-            bot.send_message(chat_id, text_prefix)
-        except: 
-            pass
+        bot.send_message(chat_id, text_prefix)
+
+    # 2. Отправляем само меню (ошибки и повторы после 429 — на стороне outbox)
+    bot.send_message(
+        chat_id, 
+        f"{header}\nВыберите категорию:", 
+        reply_markup=kb_admin_categories(session),
+        on_sent=remember_menu(user_id)
+    )
 
-    # 2. Отправляем само меню
-    try:
-        msg = bot.send_message(
-            chat_id, 
-            f"{header}\nВыберите категорию:", 
-            reply_markup=kb_admin_categories(session)
-        )
-        ADMIN_STATES[user_id]['last_msg_id'] = msg.message_id
-    except Exception as e:
-        try:
-            msg = bot.send_message(chat_id, f"{header}\nВыберите категорию:", reply_markup=kb_admin_categories(session))
-            ADMIN_STATES[user_id]['last_msg_id'] = msg.message_id
-        except: pass
-        
-    session.close()
+def remember_menu(user_id):
+    """
+    on_sent для меню админа: id сообщения попадает в состояние, когда оно уйдет в группу.
+    Отправку не ждем — иначе хендлер держал бы транзакцию, пока outbox выдерживает лимит группы.
+    """
+    def remember(msg):
+        st = ADMIN_STATES.get(user_id)
+        if st is not None:
+            st.last_msg_id = msg.message_id
+            ADMIN_STATES.put(user_id, st)
+    return remember
 
 # --- КЛАВИАТУРЫ ---
 
 def kb_admin_categories(session):
+    return keyboards.get(session, "admin_categories", lambda: _build_kb_admin_categories(session))
+
+def kb_admin_items(session, category_id, mode='add', cursor=None):
+    return keyboards.get(session, "admin_items", lambda: _build_kb_admin_items(session, category_id, mode, cursor),
+                         category=category_id, mode=mode, page=cursor)
+
+def _build_kb_admin_categories(session):
     markup = types.InlineKeyboardMarkup(row_width=2)
-    categories = session.query(Storage.category).distinct().all()
-    # Фильтруем пустые
-    btns = [types.InlineKeyboardButton(cat[0], callback_data=f"adm_cat_exist:{cat[0]}") for cat in categories if cat[0]]
+    btns = [types.InlineKeyboardButton(cat.name, callback_data=f"adm_cat_exist:{cat.id}") for cat in catalog.categories(session)]
     markup.add(*btns)
     
     markup.add(types.InlineKeyboardButton("➕ Новая категория", callback_data="adm_cat_new"))
     markup.add(types.InlineKeyboardButton("Отмена", callback_data="adm_cancel"))
     return markup
 
-def kb_admin_items(session, category, mode='add'):
+def _build_kb_admin_items(session, category_id, mode, cursor=None):
     markup = types.InlineKeyboardMarkup(row_width=1)
-    items = session.query(Storage).filter_by(category=category).all()
-    
+    items, prev_cursor, next_cursor = catalog.items_page(session, category_id, cursor)
     for item in items:
         if mode == 'add':
             btn_text = f"{item.item_name} (📦 {item.quantity})"
@@ -121,12 +132,16 @@ def kb_admin_items(session, category, mode='add'):
         else:
             btn_text = f"✏️ {item.item_name} ({item.cost_price})"
             markup.add(types.InlineKeyboardButton(btn_text, callback_data=f"adm_item_edit:{item.id}"))
+
+    nav = page_buttons(prev_cursor, next_cursor, lambda c: f"adm_pg:{c}:{category_id}")
+    if nav:
+        markup.row(*nav)
     
     if mode == 'add':
         markup.add(types.InlineKeyboardButton("➕ Новый товар", callback_data="adm_item_new"))
     else:
-        markup.add(types.InlineKeyboardButton("🏷 Переим. категорию", callback_data=f"adm_cat_ren:{category}"))
-        markup.add(types.InlineKeyboardButton("🗑 Удалить категорию", callback_data=f"adm_cat_del:{category}"))
+        markup.add(types.InlineKeyboardButton("🏷 Переим. категорию", callback_data=f"adm_cat_ren:{category_id}"))
+        markup.add(types.InlineKeyboardButton("🗑 Удалить категорию", callback_data=f"adm_cat_del:{category_id}"))
 
     markup.add(types.InlineKeyboardButton("🔙 Назад", callback_data="adm_back_cat"))
     return markup
@@ -152,27 +167,278 @@ def kb_confirm_delete(target_type, target_id):
     )
     return markup
 
+def _get_or_create_category(session, st):
+    """Категория для нового товара: выбранная из списка или введенная (если такое название уже есть — она же)"""
+    if st.category_id:
+        category = session.query(Category).get(st.category_id)
+        if category is not None:
+            return category
+    category = session.query(Category).filter_by(name=st.category).first()
+    if category is None:
+        category = Category(name=st.category)
+        session.add(category)
+    return category
+
+def _snapshot(session, item):
+    """CatalogItem по ORM-товару; название категории — из каталога, без SELECT categories"""
+    category = catalog.category(session, item.category_id)
+    return CatalogItem.from_storage(item, category.name if category else None)
+
+def _category_gone(bot, call, session):
+    """Кнопка ведет на удаленную категорию (или устарела после перехода на id): заново список"""
+    bot.answer_callback_query(call.id, "Категория не найдена")
+    bot.edit_message_text("Выберите категорию:", call.message.chat.id, call.message.message_id,
+                          reply_markup=kb_admin_categories(session))
+
+def _set_admin_state(user_id, state, **fields):
+    """Смена этапа текущего диалога админа (KeyError, если диалога нет)"""
+    st = ADMIN_STATES.get(user_id)
+    if st is None:
+        raise KeyError(user_id)
+    st.state = state
+    for name, value in fields.items():
+        setattr(st, name, value)
+    ADMIN_STATES.put(user_id, st)
+
 # --- ЛОГИКА АДМИНИСТРАТОРА (СТАРТ) ---
 
 def start_add_process(bot, message):
     chat_id = message.chat.id
     user_id = message.from_user.id
-    ADMIN_STATES[user_id] = {'state': ADM_WAIT_CAT, 'mode': 'add', 'data': {}}
+    ADMIN_STATES.put(user_id, AdminSession(state=ADM_WAIT_CAT, mode='add'))
     reopen_admin_menu(bot, user_id, chat_id)
 
 def start_edit_process(bot, message):
     chat_id = message.chat.id
     user_id = message.from_user.id
-    ADMIN_STATES[user_id] = {'state': ADM_WAIT_CAT, 'mode': 'edit', 'data': {}}
+    ADMIN_STATES.put(user_id, AdminSession(state=ADM_WAIT_CAT, mode='edit'))
     reopen_admin_menu(bot, user_id, chat_id)
 
+def export_audit_log(bot, message):
+    """
+    /export [ГГГГ-ММ-ДД] [ГГГГ-ММ-ДД] — выгрузка журнала действий из БД в Excel.
+    Без аргументов — текущий месяц, с одной датой — только этот день.
+    """
+    chat_id = message.chat.id
+    args = message.text.split()[1:]
+
+    try:
+        if not args:
+            date_to = date.today()
+            date_from = date_to.replace(day=1)
+        else:
+            date_from = datetime.strptime(args[0], "%Y-%m-%d").date()
+            date_to = datetime.strptime(args[1], "%Y-%m-%d").date() if len(args) > 1 else date_from
+    except ValueError:
+        bot.send_message(chat_id, "Формат: /export 2026-10-01 2026-10-31")
+        return
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        count = export_audit_xlsx(date_from, date_to, path)
+        with open(path, "rb") as f:
+            bot.send_document(
+                chat_id, f,
+                visible_file_name=f"audit_{date_from}_{date_to}.xlsx",
+                caption=f"📑 Журнал {date_from} — {date_to}: {count} записей"
+            )
+        log_admin_action(message.from_user.id, "Выгрузка журнала", f"{date_from} — {date_to} ({count} строк)")
+    except Exception as e:
+        print(f"Export Error: {e}")
+        bot.send_message(chat_id, "Ошибка выгрузки журнала.")
+    finally:
+        os.remove(path)
+
+def show_db_stats(bot, message):
+    """/dbstats — состояние пула соединений и кешей"""
+    pool = pool_stats()
+    kb = keyboards.stats()
+    uc = users.stats()
+    sq = profiler.stats()
+    text = (
+        "🗄 Пул соединений:\n"
+        f"▸ Размер: {pool['pool_size']}, занято: {pool['checked_out']}, overflow: {pool['overflow']}\n"
+        f"▸ Выдано соединений: {pool['acquired']}, ожидание ср.: {pool['wait_avg_sec']}с, макс.: {pool['wait_max_sec']}с, таймаутов: {pool['timeouts']}\n\n"
+        "⌨️ Кеш клавиатур:\n"
+        f"▸ Попаданий: {kb['hits']}, промахов: {kb['misses']} ({kb['hit_rate']:.0%})\n\n"
+        "👤 Кеш пользователей:\n"
+        f"▸ Записей: {uc['size']}, попаданий: {uc['hits']}, промахов: {uc['misses']} ({uc['hit_rate']:.0%})\n\n"
+        "🐢 SQL:\n"
+        f"▸ Запросов на апдейт: {sq['per_update']:.1f}, медленных: {sq['slow']}, подозрений на N+1: {sq['n_plus_one']}"
+    )
+    bot.send_message(message.chat.id, text)
+
+# --- ЗАЯВКИ: ПАКЕТНАЯ ОБРАБОТКА (/pending) ---
+
+def _pending_rows(session, cursor=None):
+    """Одна страница ожидающих заявок (keyset по id, старые первыми): (строки, курсор назад, вперед)"""
+    query = (
+        session.query(Request.id, Request.req_count, User.it_code, Storage.item_name, Storage.quantity)
+        .join(User, Request.user_pk == User.id)
+        .join(Storage, Request.item_id == Storage.id)
+        .filter(Request.status == 'pending')
+    )
+    return keyset_page(query, Request.id, cursor)
+
+def render_pending(session, selected, cursor=None):
+    """
+    Текст и клавиатура страницы заявок с отметками + курсор этой страницы
+    (с ним повторная отрисовка после решения начнется с того же места).
+    """
+    rows, prev_cursor, next_cursor = _pending_rows(session, cursor)
+    if not rows and cursor:
+        # Страница опустела (заявки разобраны) — показываем первую
+        rows, prev_cursor, next_cursor = _pending_rows(session)
+    if not rows:
+        return "✅ Ожидающих заявок нет.", None, None
+
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    for r in rows:
+        mark = "☑" if r.id in selected else "☐"
+        name = r.item_name
+        if len(name) > 20: name = name[:20] + ".."
+        markup.add(types.InlineKeyboardButton(
+            f"{mark} #{r.id} {r.it_code}: {name} × {r.req_count} (📦 {r.quantity})",
+            callback_data=f"pnd_tgl:{r.id}"
+        ))
+    nav = page_buttons(prev_cursor, next_cursor, lambda c: f"pnd_pg:{c}")
+    if nav:
+        markup.row(*nav)
+    markup.add(
+        types.InlineKeyboardButton("☑ Все", callback_data="pnd_all"),
+        types.InlineKeyboardButton("☐ Снять", callback_data="pnd_none")
+    )
+    markup.add(
+        types.InlineKeyboardButton(f"✅ Одобрить ({len(selected)})", callback_data="pnd_appr"),
+        types.InlineKeyboardButton(f"⛔ Отклонить ({len(selected)})", callback_data="pnd_rej")
+    )
+    markup.add(types.InlineKeyboardButton("Закрыть", callback_data="pnd_close"))
+    return "📋 Ожидающие заявки. Отметьте нужные и выберите действие:", markup, f"a{rows[0].id - 1}"
+
+def start_pending_review(bot, message):
+    user_id = message.from_user.id
+    session = current_session()
+    st = AdminSession(state=ADM_PENDING, selected=[])
+    text, markup, st.page = render_pending(session, set())
+    ADMIN_STATES.put(user_id, st)
+    bot.send_message(message.chat.id, text, reply_markup=markup, on_sent=remember_menu(user_id))
+
+def _apply_batch(session, admin_id, result, approved, notify):
+    """Журнал, кеш каталога и уведомления по примененной пачке"""
+    reqs = (
+        session.query(Request)
+        .options(joinedload(Request.user), joinedload(Request.item))
+        .filter(Request.id.in_(result.done))
+        .order_by(Request.id)
+        .all()
+    )
+
+    ids = ", ".join(f"#{r.id}" for r in reqs)
+    if approved:
+        log_admin_action(admin_id, "Пакетное одобрение", f"Заявки {ids} ({len(reqs)} шт.)")
+        quantities = dict(result.quantities)
+        def refresh_catalog():
+            for item_id, quantity in quantities.items():
+                catalog.set_quantity(item_id, quantity)
+        after_commit(session, refresh_catalog)
+    else:
+        log_admin_action(admin_id, "Пакетный отказ", f"Заявки {ids} ({len(reqs)} шт.)")
+
+    # Одно уведомление на сотрудника, даже если у него несколько заявок в пачке
+    by_user = {}
+    for r in reqs:
+        log_user_action(r.user, "Заявка обновлена", r.item.item_name, r.req_count, r.comment,
+                        "Approved" if approved else "Rejected")
+        by_user.setdefault(r.user.user_id, []).append(r)
+
+    for user_chat, user_reqs in by_user.items():
+        if approved:
+            lines = [f"✅ Ваша заявка #{r.id} на **{r.item.item_name}** одобрена!" for r in user_reqs]
+            lines.append("Можете забирать.")
+        else:
+            lines = [f"⛔ Ваша заявка #{r.id} на **{r.item.item_name}** отклонена." for r in user_reqs]
+        notify(session, user_chat, "\n".join(lines))
+
+def handle_pending_callback(bot, call, notify):
+    """
+    Кнопки /pending (pnd_*). Отметки хранятся в AdminSession.selected.
+    notify(session, user_chat_id, text) — уведомление сотрудника (см. main.notify_user).
+    """
+    user_id = call.from_user.id
+    chat_id = call.message.chat.id
+    data = call.data
+    session = current_session()
+
+    st = ADMIN_STATES.get(user_id)
+    if st is None or st.state != ADM_PENDING:
+        st = AdminSession(state=ADM_PENDING, selected=[], last_msg_id=call.message.message_id)
+    selected = set(st.selected or [])
+
+    if data == "pnd_close":
+        ADMIN_STATES.delete(user_id)
+        bot.edit_message_text("📋 Разбор заявок закрыт.", chat_id, call.message.message_id, reply_markup=None)
+        return
+
+    if data.startswith("pnd_tgl:"):
+        req_id = int(data.split(":")[1])
+        selected ^= {req_id}
+
+    elif data.startswith("pnd_pg:"):
+        st.page = data.split(":", 1)[1]
+
+    elif data == "pnd_all":
+        # Отмечаем всё на открытой странице
+        rows, _, _ = _pending_rows(session, st.page)
+        selected |= {r.id for r in rows}
+
+    elif data == "pnd_none":
+        selected = set()
+
+    elif data in ("pnd_appr", "pnd_rej"):
+        if not selected:
+            bot.answer_callback_query(call.id, "Ничего не выбрано")
+            return
+        approved = data == "pnd_appr"
+        ids = sorted(selected)
+        result = approve_requests(session, ids) if approved else reject_requests(session, ids)
+        if result.error:
+            session.rollback()
+            bot.answer_callback_query(call.id, result.error)
+            return
+
+        if result.done:
+            _apply_batch(session, user_id, result, approved, notify)
+        session.flush()
+
+        summary = f"{'Одобрено' if approved else 'Отклонено'}: {len(result.done)}"
+        if result.short:
+            summary += f", мало товара: {len(result.short)}"
+        if result.skipped:
+            summary += f", уже обработаны: {len(result.skipped)}"
+        bot.answer_callback_query(call.id, summary)
+        # Отметки остаются только на заявках, которым не хватило товара
+        selected = set(result.short)
+
+    text, markup, st.page = render_pending(session, selected, st.page)
+    st.selected = sorted(selected)
+    ADMIN_STATES.put(user_id, st)
+
+    try:
+        bot.edit_message_text(text, chat_id, call.message.message_id, reply_markup=markup)
+    except Exception as e:
+        # "message is not modified" при повторном нажатии — не ошибка
+        if "not modified" not in str(e):
+            raise
+
 # --- ОБРАБОТЧИК CALLBACK (КНОПКИ) ---
 
+@timed("handle_admin_callback")
 def handle_admin_callback(bot, call):
     user_id = call.from_user.id
     data = call.data
     chat_id = call.message.chat.id
-    session = get_db_session()
+    session = current_session()
 
     try:
         # 1. ОТМЕНА / НАЗАД
@@ -181,10 +447,11 @@ def handle_admin_callback(bot, call):
             return
 
         if data == "adm_back_cat":
-            if user_id not in ADMIN_STATES: ADMIN_STATES[user_id] = {'mode': 'add', 'data': {}}
-            ADMIN_STATES[user_id]['state'] = ADM_WAIT_CAT
+            st = ADMIN_STATES.get(user_id) or AdminSession(mode='add')
+            st.state = ADM_WAIT_CAT
+            ADMIN_STATES.put(user_id, st)
             
-            mode = ADMIN_STATES[user_id].get('mode', 'add')
+            mode = st.mode
             header = "📦 Пополнение склада:" if mode == 'add' else "🛠 Редактор товаров:"
             
             # Убрали Markdown
@@ -197,37 +464,58 @@ def handle_admin_callback(bot, call):
 
         # 2. НАВИГАЦИЯ
         if data == "adm_cat_new":
-            if user_id not in ADMIN_STATES: ADMIN_STATES[user_id] = {'mode': 'add', 'data': {}}
-            ADMIN_STATES[user_id]['state'] = ADM_NEW_CAT_TXT
+            st = ADMIN_STATES.get(user_id) or AdminSession(mode='add')
+            st.state = ADM_NEW_CAT_TXT
+            ADMIN_STATES.put(user_id, st)
             bot.edit_message_text("✍ Введите название НОВОЙ категории:", chat_id, call.message.message_id, reply_markup=kb_cancel_no_emoji())
             return
 
+        if data.startswith("adm_pg:"):
+            # Листание товаров категории: adm_pg:<курсор>:<id категории>
+            _, cursor, category_id = data.split(":", 2)
+            category = catalog.category(session, category_id)
+            if category is None:
+                _category_gone(bot, call, session)
+                return
+            st = ADMIN_STATES.get(user_id) or AdminSession(mode='add')
+            bot.edit_message_text(
+                call.message.text, chat_id, call.message.message_id,
+                reply_markup=kb_admin_items(session, category.id, st.mode, cursor)
+            )
+            return
+
         if data.startswith("adm_cat_exist:"):
-            if user_id not in ADMIN_STATES: ADMIN_STATES[user_id] = {'mode': 'add', 'data': {}}
-            category = data.split(":", 1)[1]
-            ADMIN_STATES[user_id]['state'] = ADM_WAIT_NAME
-            ADMIN_STATES[user_id]['data']['category'] = category
+            category = catalog.category(session, data.split(":", 1)[1])
+            if category is None:
+                _category_gone(bot, call, session)
+                return
+            st = ADMIN_STATES.get(user_id) or AdminSession(mode='add')
+            st.state = ADM_WAIT_NAME
+            st.category_id, st.category = category.id, category.name
+            ADMIN_STATES.put(user_id, st)
             
-            mode = ADMIN_STATES[user_id].get('mode', 'add')
-            txt = f"\n📂 Категория: {category}\n" + ("Добавление кол-ва:" if mode == 'add' else "Редактирование:")
+            mode = st.mode
+            txt = f"\n📂 Категория: {category.name}\n" + ("Добавление кол-ва:" if mode == 'add' else "Редактирование:")
             
-            bot.edit_message_text(txt, chat_id, call.message.message_id, reply_markup=kb_admin_items(session, category, mode))
+            bot.edit_message_text(txt, chat_id, call.message.message_id, reply_markup=kb_admin_items(session, category.id, mode))
             return
 
         # 3. ADD MODE
         if data == "adm_item_new":
-            ADMIN_STATES[user_id]['state'] = ADM_NEW_NAME_TXT
+            _set_admin_state(user_id, ADM_NEW_NAME_TXT)
             bot.edit_message_text("✍ Введите название НОВОГО товара:", chat_id, call.message.message_id, reply_markup=kb_cancel_no_emoji())
             return
 
         if data.startswith("adm_item_exist:"):
-            if user_id not in ADMIN_STATES: ADMIN_STATES[user_id] = {'mode': 'add', 'data': {}}
+            st = ADMIN_STATES.get(user_id) or AdminSession(mode='add')
             item_id = int(data.split(":")[1])
             item = session.query(Storage).get(item_id)
             
-            ADMIN_STATES[user_id]['state'] = ADM_WAIT_QTY
+            st.state = ADM_WAIT_QTY
+            if item:
+                st.item_name, st.exist_id, st.category_id = item.item_name, item_id, item.category_id
+            ADMIN_STATES.put(user_id, st)
             if item:
-                ADMIN_STATES[user_id]['data'].update({'item_name': item.item_name, 'exist_id': item_id, 'category': item.category})
                 bot.edit_message_text(
                     f"📦 {item.item_name}\nОстаток: {item.quantity}\nСебестоимость: {item.cost_price}₸\n\n▸ Введите кол-во для добавления:", 
                     chat_id, call.message.message_id, 
@@ -239,13 +527,15 @@ def handle_admin_callback(bot, call):
 
         # 4. EDIT MODE
         if data.startswith("adm_item_edit:"):
-            if user_id not in ADMIN_STATES: ADMIN_STATES[user_id] = {'mode': 'edit', 'data': {}}
+            st = ADMIN_STATES.get(user_id) or AdminSession(mode='edit')
             item_id = int(data.split(":")[1])
             item = session.query(Storage).get(item_id)
             
-            ADMIN_STATES[user_id]['state'] = ADM_EDIT_MENU
+            st.state = ADM_EDIT_MENU
+            if item:
+                st.edit_id, st.category_id = item_id, item.category_id
+            ADMIN_STATES.put(user_id, st)
             if item:
-                ADMIN_STATES[user_id]['data'].update({'edit_id': item_id, 'category': item.category})
                 bot.edit_message_text(
                     f"🛠 {item.item_name}\nСебестоимость: {item.cost_price}₸", 
                     chat_id, call.message.message_id, 
@@ -254,38 +544,43 @@ def handle_admin_callback(bot, call):
             return
 
         if data.startswith("edt_back:"):
-            if user_id not in ADMIN_STATES: ADMIN_STATES[user_id] = {'mode': 'edit', 'data': {}}
+            st = ADMIN_STATES.get(user_id) or AdminSession(mode='edit')
             item_id = int(data.split(":")[1])
             item = session.query(Storage).get(item_id)
             
-            ADMIN_STATES[user_id]['state'] = ADM_WAIT_NAME
-            if item:
-                ADMIN_STATES[user_id]['data']['category'] = item.category
-                bot.edit_message_text(f"📂 Категория: {item.category}", chat_id, call.message.message_id, reply_markup=kb_admin_items(session, item.category, mode='edit'))
+            st.state = ADM_WAIT_NAME
+            category = catalog.category(session, item.category_id) if item else None
+            if category:
+                st.category_id, st.category = category.id, category.name
+            ADMIN_STATES.put(user_id, st)
+            if category:
+                bot.edit_message_text(f"📂 Категория: {category.name}", chat_id, call.message.message_id, reply_markup=kb_admin_items(session, category.id, mode='edit'))
             return
 
         if data.startswith("edt_name:"):
-            ADMIN_STATES[user_id]['state'] = ADM_EDIT_NAME_TXT
+            _set_admin_state(user_id, ADM_EDIT_NAME_TXT)
             bot.edit_message_text("✍ Введите НОВОЕ название:", chat_id, call.message.message_id, reply_markup=kb_cancel_no_emoji())
             return
 
         if data.startswith("edt_cost:"):
-            ADMIN_STATES[user_id]['state'] = ADM_EDIT_COST_TXT
+            _set_admin_state(user_id, ADM_EDIT_COST_TXT)
             bot.edit_message_text("💰 Введите НОВУЮ себестоимость:", chat_id, call.message.message_id, reply_markup=kb_cancel_no_emoji())
             return
 
         if data.startswith("adm_cat_ren:"):
-            cat_name = data.split(":", 1)[1]
-            ADMIN_STATES[user_id]['state'] = ADM_EDIT_CAT_TXT
-            ADMIN_STATES[user_id]['data']['old_cat_name'] = cat_name
-            bot.edit_message_text(f"✍ Категория: {cat_name}\nВведите НОВОЕ название:", chat_id, call.message.message_id, reply_markup=kb_cancel_no_emoji())
+            category = catalog.category(session, data.split(":", 1)[1])
+            if category is None:
+                _category_gone(bot, call, session)
+                return
+            _set_admin_state(user_id, ADM_EDIT_CAT_TXT, category_id=category.id, category=category.name)
+            bot.edit_message_text(f"✍ Категория: {category.name}\nВведите НОВОЕ название:", chat_id, call.message.message_id, reply_markup=kb_cancel_no_emoji())
             return
 
         # 5. УДАЛЕНИЕ (Подтверждение)
         if data.startswith("edt_del:"):
             item_id = int(data.split(":")[1])
             item = session.query(Storage).get(item_id)
-            ADMIN_STATES[user_id]['state'] = ADM_CONFIRM_DEL
+            _set_admin_state(user_id, ADM_CONFIRM_DEL)
             # Убрали Markdown
             bot.edit_message_text(
                 f"⚠️ Удалить товар '{item.item_name}'?", 
@@ -295,14 +590,17 @@ def handle_admin_callback(bot, call):
             return
 
         if data.startswith("adm_cat_del:"):
-            cat_name = data.split(":", 1)[1]
-            ADMIN_STATES[user_id]['state'] = ADM_CONFIRM_DEL
-            count = session.query(Storage).filter_by(category=cat_name).count()
+            category = catalog.category(session, data.split(":", 1)[1])
+            if category is None:
+                _category_gone(bot, call, session)
+                return
+            _set_admin_state(user_id, ADM_CONFIRM_DEL)
+            count = len(catalog.items(session, category.id))
             # Убрали Markdown
             bot.edit_message_text(
-                f"⛔️ Удалить категорию '{cat_name}' и ВСЕ её товары ({count} шт)?", 
+                f"⛔️ Удалить категорию '{category.name}' и ВСЕ её товары ({count} шт)?", 
                 chat_id, call.message.message_id, 
-                reply_markup=kb_confirm_delete('cat', cat_name)
+                reply_markup=kb_confirm_delete('cat', category.id)
             )
             return
 
@@ -324,29 +622,35 @@ def handle_admin_callback(bot, call):
                         # Удаляем заявки
                         session.query(Request).filter(Request.item_id == item.id).delete(synchronize_session=False)
                         # Удаляем товар
+                        item_id = item.id
                         session.delete(item)
-                        session.commit()
+                        session.flush()
+                        after_commit(session, catalog.invalidate)
+                        after_commit(session, lambda: search.remove(item_id))
                         msg_result = f"🗑 Товар '{name}' удален."
                     else:
                         msg_result = "Ошибка: товар не найден."
 
                 elif target_type == 'cat':
-                    # Удаление категории: находим товары -> удаляем заявки -> удаляем товары
-                    items = session.query(Storage).filter_by(category=target_id).all()
-                    deleted_count = 0
-                    
-                    # LOG
-                    log_admin_action(user_id, "Удаление категории", f"Удалена категория: {target_id}")
-
-                    for itm in items:
-                        # Удаляем заявки для текущего товара
-                        session.query(Request).filter(Request.item_id == itm.id).delete(synchronize_session=False)
-                        # Удаляем сам товар
-                        session.delete(itm)
-                        deleted_count += 1
-                        
-                    session.commit()
-                    msg_result = f"🗑 Категория '{target_id}' удалена ({deleted_count} товаров)."
+                    # Удаление категории: три DELETE на всю категорию вместо пары запросов на каждый товар
+                    category = session.query(Category).get(int(target_id))
+                    if category:
+                        name = category.name
+                        item_ids = [row.id for row in session.query(Storage.id).filter(Storage.category_id == category.id)]
+
+                        # LOG
+                        log_admin_action(user_id, "Удаление категории", f"Удалена категория: {name}")
+
+                        if item_ids:
+                            session.query(Request).filter(Request.item_id.in_(item_ids)).delete(synchronize_session=False)
+                            session.query(Storage).filter(Storage.category_id == category.id).delete(synchronize_session=False)
+                        session.query(Category).filter(Category.id == category.id).delete(synchronize_session=False)
+
+                        after_commit(session, catalog.invalidate)
+                        after_commit(session, lambda: search.remove_items(item_ids))
+                        msg_result = f"🗑 Категория '{name}' удалена ({len(item_ids)} товаров)."
+                    else:
+                        msg_result = "Ошибка: категория не найдена."
             
             except Exception as e:
                 session.rollback()
@@ -363,122 +667,143 @@ def handle_admin_callback(bot, call):
 
     except Exception as e:
         print(f"Callback Error: {e}")
+        session.rollback()
         try: bot.answer_callback_query(call.id, "Ошибка сессии")
         except: pass
-    finally:
-        session.close()
 
 # --- ОБРАБОТЧИК ТЕКСТА ---
 
+@timed("handle_admin_text")
 def handle_admin_text(bot, message):
     user_id = message.from_user.id
     chat_id = message.chat.id
     text = message.text.strip()
     
-    if user_id not in ADMIN_STATES: return False
+    st = ADMIN_STATES.get(user_id)
+    if st is None: return False
     
-    state = ADMIN_STATES[user_id].get('state')
-    data = ADMIN_STATES[user_id].get('data', {})
+    state = st.state
     
     try: bot.delete_message(chat_id, message.message_id)
     except: pass
     
-    session = get_db_session()
+    session = current_session()
+
+    if state == ADM_NEW_CAT_TXT:
+        st.category_id, st.category = None, text
+        st.state = ADM_NEW_NAME_TXT
+        ADMIN_STATES.put(user_id, st)
+        bot.edit_message_text(f"Категория: {text}\n✍ Название первого товара:", chat_id, st.last_msg_id, reply_markup=kb_cancel_no_emoji())
+        return True
     
-    try:
-        if state == ADM_NEW_CAT_TXT:
-            ADMIN_STATES[user_id]['data']['category'] = text
-            ADMIN_STATES[user_id]['state'] = ADM_NEW_NAME_TXT
-            bot.edit_message_text(f"Категория: {text}\n✍ Название первого товара:", chat_id, ADMIN_STATES[user_id]['last_msg_id'], reply_markup=kb_cancel_no_emoji())
+    elif state == ADM_NEW_NAME_TXT:
+        st.item_name = text
+        st.state = ADM_WAIT_COST
+        ADMIN_STATES.put(user_id, st)
+        bot.edit_message_text(f"Товар: {text}\n💰 Себестоимость:", chat_id, st.last_msg_id, reply_markup=kb_cancel_no_emoji())
+        return True
+    
+    elif state == ADM_WAIT_COST:
+        try:
+            cost = parse_cost_price(text)
+            st.cost_price = cost
+            st.state = ADM_WAIT_QTY
+            ADMIN_STATES.put(user_id, st)
+            bot.edit_message_text(f"Себестоимость: {cost}\n🔢 Введите кол-во:", chat_id, st.last_msg_id, reply_markup=kb_cancel_no_emoji())
             return True
-        
-        elif state == ADM_NEW_NAME_TXT:
-            ADMIN_STATES[user_id]['data']['item_name'] = text
-            ADMIN_STATES[user_id]['state'] = ADM_WAIT_COST
-            bot.edit_message_text(f"Товар: {text}\n💰 Себестоимость:", chat_id, ADMIN_STATES[user_id]['last_msg_id'], reply_markup=kb_cancel_no_emoji())
+        except:
+            bot.send_message(chat_id, "Ошибка цены. Попробуйте еще раз.")
             return True
+
+    elif state == ADM_WAIT_QTY:
+        if not text.isdigit():
+            bot.send_message(chat_id, "Введите число!")
+            return True
+        qty = int(text)
+        exist_id = st.exist_id
+        changed = None
         
-        elif state == ADM_WAIT_COST:
-            try:
-                cost = parse_cost_price(text)
-                ADMIN_STATES[user_id]['data']['cost_price'] = cost
-                ADMIN_STATES[user_id]['state'] = ADM_WAIT_QTY
-                bot.edit_message_text(f"Себестоимость: {cost}\n🔢 Введите кол-во:", chat_id, ADMIN_STATES[user_id]['last_msg_id'], reply_markup=kb_cancel_no_emoji())
-                return True
-            except:
-                bot.send_message(chat_id, "Ошибка цены. Попробуйте еще раз.")
-                return True
-
-        elif state == ADM_WAIT_QTY:
-            if not text.isdigit():
-                bot.send_message(chat_id, "Введите число!")
-                return True
-            qty = int(text)
-            exist_id = data.get('exist_id')
-            category = data.get('category')
-            
-            if exist_id:
-                item = session.query(Storage).get(exist_id)
-                if item:
-                    item.quantity += qty
-                    msg = f"✅ Товар обновлен! Остаток: {item.quantity}"
-                    # LOG
-                    log_admin_action(user_id, "Пополнение", f"{item.item_name}: +{qty} шт.")
+        if exist_id:
+            item = session.query(Storage).get(exist_id)
+            if item:
+                item.quantity += qty
+                changed = item
+                msg = f"✅ Товар обновлен! Остаток: {item.quantity}"
+                # LOG
+                log_admin_action(user_id, "Пополнение", f"{item.item_name}: +{qty} шт.")
+        else:
+            name = st.item_name
+            cost = st.cost_price
+            exist = session.query(Storage).filter_by(item_name=name).first()
+            if exist:
+                exist.quantity += qty
+                changed = exist
+                msg = f"✅ Товар пополнен! Остаток: {exist.quantity}"
+                # LOG
+                log_admin_action(user_id, "Пополнение (сущ)", f"{exist.item_name}: +{qty} шт.")
             else:
-                name = data.get('item_name')
-                cost = data.get('cost_price')
-                exist = session.query(Storage).filter_by(item_name=name).first()
-                if exist:
-                    exist.quantity += qty
-                    msg = f"✅ Товар пополнен! Остаток: {exist.quantity}"
-                    # LOG
-                    log_admin_action(user_id, "Пополнение (сущ)", f"{exist.item_name}: +{qty} шт.")
-                else:
-                    new_item = Storage(category=category, item_name=name, quantity=qty, cost_price=cost)
-                    session.add(new_item)
-                    msg = f"✅ Товар создан! Остаток: {qty}"
-                    # LOG
-                    log_admin_action(user_id, "Создание товара", f"{name} (Кат: {category}, Цена: {cost}, Кол: {qty})")
-            
-            session.commit()
-            reopen_admin_menu(bot, user_id, chat_id, text_prefix=msg)
-            return True
+                category = _get_or_create_category(session, st)
+                new_item = Storage(category=category, item_name=name, quantity=qty, cost_price=cost)
+                session.add(new_item)
+                changed = new_item
+                msg = f"✅ Товар создан! Остаток: {qty}"
+                # LOG
+                log_admin_action(user_id, "Создание товара", f"{name} (Кат: {category.name}, Цена: {cost}, Кол: {qty})")
+        
+        if changed is not None:
+            session.flush()
+            snapshot = _snapshot(session, changed)
+            after_commit(session, lambda: catalog.update_item(snapshot))
+            after_commit(session, lambda: search.update_item(snapshot))
+        reopen_admin_menu(bot, user_id, chat_id, text_prefix=msg)
+        return True
+
+    elif state == ADM_EDIT_NAME_TXT:
+        item = session.query(Storage).get(st.edit_id)
+        if item:
+            old_name = item.item_name
+            item.item_name = text
+            snapshot = _snapshot(session, item)
+            after_commit(session, lambda: catalog.update_item(snapshot))
+            after_commit(session, lambda: search.update_item(snapshot))
+            # LOG
+            log_admin_action(user_id, "Переименование товара", f"'{old_name}' -> '{text}'")
+            reopen_admin_menu(bot, user_id, chat_id, text_prefix=f"✅ Переименовано: {text}")
+        return True
 
-        elif state == ADM_EDIT_NAME_TXT:
-            item = session.query(Storage).get(data.get('edit_id'))
+    elif state == ADM_EDIT_COST_TXT:
+        try:
+            cost = parse_cost_price(text)
+            item = session.query(Storage).get(st.edit_id)
             if item:
-                old_name = item.item_name
-                item.item_name = text
-                session.commit()
+                old_cost = item.cost_price
+                item.cost_price = cost
+                snapshot = _snapshot(session, item)
+                after_commit(session, lambda: catalog.update_item(snapshot))
                 # LOG
-                log_admin_action(user_id, "Переименование товара", f"'{old_name}' -> '{text}'")
-                reopen_admin_menu(bot, user_id, chat_id, text_prefix=f"✅ Переименовано: {text}")
+                log_admin_action(user_id, "Изменение цены", f"{item.item_name}: {old_cost} -> {cost}")
+                reopen_admin_menu(bot, user_id, chat_id, text_prefix=f"✅ Цена обновлена: {cost}")
             return True
+        except: return True
 
-        elif state == ADM_EDIT_COST_TXT:
-            try:
-                cost = parse_cost_price(text)
-                item = session.query(Storage).get(data.get('edit_id'))
-                if item:
-                    old_cost = item.cost_price
-                    item.cost_price = cost
-                    session.commit()
-                    # LOG
-                    log_admin_action(user_id, "Изменение цены", f"{item.item_name}: {old_cost} -> {cost}")
-                    reopen_admin_menu(bot, user_id, chat_id, text_prefix=f"✅ Цена обновлена: {cost}")
-                return True
-            except: return True
-
-        elif state == ADM_EDIT_CAT_TXT:
-            old = data.get('old_cat_name')
-            session.query(Storage).filter(Storage.category == old).update({Storage.category: text}, synchronize_session=False)
-            session.commit()
-            # LOG
-            log_admin_action(user_id, "Переименование категории", f"'{old}' -> '{text}'")
-            reopen_admin_menu(bot, user_id, chat_id, text_prefix=f"✅ Категория: {text}")
+    elif state == ADM_EDIT_CAT_TXT:
+        category = session.query(Category).get(st.category_id) if st.category_id else None
+        if category is None:
+            reopen_admin_menu(bot, user_id, chat_id, text_prefix="Ошибка: категория не найдена.")
             return True
+        old = category.name
+        if text != old and session.query(Category.id).filter(Category.name == text).first():
+            bot.send_message(chat_id, f"Категория '{text}' уже есть. Введите другое название.")
+            return True
+        # Название хранится в одной строке categories — товары не трогаем
+        category_id = category.id
+        category.name = text
+        item_ids = [item.id for item in catalog.items(session, category_id)]
+        after_commit(session, lambda: catalog.rename_category(category_id, text))
+        after_commit(session, lambda: search.update_category(old, text, item_ids))
+        # LOG
+        log_admin_action(user_id, "Переименование категории", f"'{old}' -> '{text}'")
+        reopen_admin_menu(bot, user_id, chat_id, text_prefix=f"✅ Категория: {text}")
+        return True
 
-    finally:
-        session.close()
-    
     return False
\ No newline at end of file
@@ -0,0 +1,54 @@
+import threading
+from catalog_cache import catalog
+
+
+class KeyboardCache:
+    """
+    Готовые (сериализованные в JSON) InlineKeyboardMarkup.
+    Ключ: (вид клавиатуры, категория, режим, страница, версия каталога). При смене версии
+    каталога все старые клавиатуры выбрасываются разом.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session, kind, builder, category=None, mode=None, page=None):
+        """Возвращает JSON клавиатуры; builder() строит InlineKeyboardMarkup при промахе"""
+        version = catalog.current_version(session)
+        key = (kind, category, mode, page, version)
+
+        with self._lock:
+            if self._version != version:
+                self._entries.clear()
+                self._version = version
+            markup_json = self._entries.get(key)
+            if markup_json is not None:
+                self.hits += 1
+                return markup_json
+            self.misses += 1
+
+        markup_json = builder().to_json()
+
+        with self._lock:
+            if self._version == version and len(self._entries) < self.max_entries:
+                self._entries[key] = markup_json
+        return markup_json
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+# Общий кеш клавиатур (пользовательских и админских)
+keyboards = KeyboardCache()
@@ -1,20 +1,49 @@
-import telebot
+import sys
+import signal
+
+# `python main.py` выполняет этот файл как модуль __main__, а async_bot делает `import main`.
+# Без псевдонима файл выполнился бы второй раз: второй бот с диспетчером, второй outbox и
+# свои хранилища состояний, а finally ниже остановил бы не те объекты, что работают.
+if __name__ == "__main__":
+    sys.modules.setdefault("main", sys.modules[__name__])
 from telebot import types
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from config import BOT_TOKEN, GROUP_ID, DB_URL
+from sqlalchemy.orm import joinedload
+from config import BOT_TOKEN, GROUP_ID, RUN_MODE
+from db import current_session, after_commit, get_db_session, pool_stats
 from models import Base, User, Storage, Request
 # Импортируем функции админки
-from group import start_add_process, start_edit_process, handle_admin_text, handle_admin_callback
+from group import (
+    start_add_process, start_edit_process, handle_admin_text, handle_admin_callback,
+    export_audit_log, show_db_stats, start_pending_review, handle_pending_callback
+)
 # Импортируем логгер
 from excel_logger import log_user_action, log_admin_action
-
-bot = telebot.TeleBot(BOT_TOKEN)
-
-engine = create_engine(DB_URL, pool_recycle=3600)
-Session = sessionmaker(bind=engine)
-
-user_data = {}
+from catalog_cache import catalog
+from keyboard_cache import keyboards
+from pagination import page_buttons
+from search_index import search
+from user_cache import users
+from middlewares import SessionMiddleware
+from dispatcher import DispatchingTeleBot
+from state_store import make_state_store, UserSession
+from outbox import Outbox, OutboxBot
+from approvals import approve_request, reject_request
+import metrics
+from sql_profiler import profiler
+
+# Апдейты разных чатов обрабатываются параллельно, одного чата — по порядку
+bot = DispatchingTeleBot(BOT_TOKEN, use_class_middlewares=True)
+bot.setup_middleware(SessionMiddleware())
+
+# Исходящие вызовы Telegram идут через очередь с лимитами (flood control).
+# Без ожидания результата — просто outbox.*(...); нужен ответ — outbox.*(...).result()
+outbox = Outbox(bot)
+# Админка (group.py) получает bot аргументом: отдаем ей обертку, чтобы сообщения в админ-группу
+# тоже шли через outbox и учитывались в ее лимите
+outbox_bot = OutboxBot(bot, outbox)
+
+# Диалоги сотрудников: chat_id -> UserSession (ограничено по размеру и TTL)
+user_data = make_state_store(UserSession, "user")
 
 STATES = {
     'REG_IT': 1,
@@ -23,31 +52,38 @@ STATES = {
     'WAIT_COMMENT': 4
 }
 
-def get_db_session():
-    return Session()
-
 def get_user(session, user_id):
-    return session.query(User).filter_by(user_id=user_id).first()
+    """Снимок пользователя из кеша (UserSnapshot, только чтение) или None"""
+    return users.get(session, user_id)
 
 def clear_state(chat_id):
-    if chat_id in user_data:
-        if 'state' in user_data[chat_id]:
-            del user_data[chat_id]['state']
-        if 'temp' in user_data[chat_id]:
-            del user_data[chat_id]['temp']
+    session_state = user_data.get(chat_id)
+    if session_state is not None:
+        session_state.clear()
+        user_data.put(chat_id, session_state)
 
-# --- ХЕЛПЕР: Сохранение ID сообщения в БД ---
+# --- ХЕЛПЕР: Сохранение ID сообщения ---
 def save_last_msg_id(chat_id, message_id):
-    session = get_db_session()
+    # Сразу в кеше пользователей; в БД уйдет пачкой (user_cache, write-behind)
+    users.remember_last_msg_id(chat_id, message_id)
+
+def notify_user(session, user_chat_id, text):
+    """
+    Уведомление сотрудника о решении по заявке и меню заново внизу чата.
+    Уходит только после commit: при откате сотрудник не узнает о несостоявшемся решении.
+    """
     try:
-        user = session.query(User).filter_by(user_id=chat_id).first()
-        if user:
-            user.last_msg_id = message_id
-            session.commit()
+        # Меню собираем сейчас: после commit сессия уже не выполняет запросы
+        send_interface = prepare_user_interface(user_chat_id, session)
     except Exception as e:
-        print(f"Error saving msg_id: {e}")
-    finally:
-        session.close()
+        print(f"Ошибка UX обновления: {e}")
+        return
+
+    def send():
+        outbox.send_message(user_chat_id, text, parse_mode="Markdown")
+        # ВОССТАНАВЛИВАЕМ ИНТЕРФЕЙС ПОЛЬЗОВАТЕЛЯ
+        send_interface()
+    after_commit(session, send)
 
 # --- ХЕЛПЕР: Кнопка отмены (для этапов ввода) ---
 def kb_cancel_only():
@@ -55,47 +91,45 @@ def kb_cancel_only():
     markup.add(types.InlineKeyboardButton("Отмена", callback_data="cancel_order"))
     return markup
 
+# --- ХЕЛПЕР: Карточка товара при создании заказа ---
+def order_prompt_text(item):
+    return (
+        f"🔽 Создание заказа:\n\n"
+        f"Выбрано: **{item.item_name}**\n"
+        f"Доступно: {item.quantity}\n"
+        f"Себестоимость: {item.cost_price}₸\n\n"
+        f"🔢 Введите количество в чат:"
+    )
+
 # --- ХЕЛПЕР: Восстановление интерфейса ---
-def restore_user_interface(chat_id, session):
+def build_user_interface(chat_id, session):
     """
-    1. Удаляет старое сообщение (меню/ввод).
-    2. Отправляет новое актуальное состояние вниз чата.
+    Текст и клавиатура текущего шага пользователя (меню или ввод заказа).
+    Состояние только читается: функцию вызывают и из потока админа (notify_user),
+    а черновик сотрудника меняет лишь поток его чата.
     """
-    user_state = user_data.get(chat_id, {}).get('state')
-    temp = user_data.get(chat_id, {}).get('temp', {})
-    
-    # 1. Удаляем старое сообщение
-    user = session.query(User).filter_by(user_id=chat_id).first()
-    if user and user.last_msg_id:
-        try:
-            bot.delete_message(chat_id, user.last_msg_id)
-        except Exception:
-            pass 
+    draft = user_data.get(chat_id) or UserSession()
+    user_state = draft.state
 
     text_to_send = ""
     markup_to_send = None
 
     # Сценарий 1: Пользователь вводил количество
     if user_state == STATES['WAIT_QTY']:
-        item = session.query(Storage).get(temp.get('item_id'))
+        # Товар из кеша каталога: меню восстанавливается после каждого уведомления
+        item = catalog.get(session, draft.item_id)
         if item:
-            text_to_send = (
-                f"🔽 Создание заказа:\n\n"
-                f"Выбрано: **{item.item_name}**\n"
-                f"Доступно: {item.quantity}\n"
-                f"Себестоимость: {item.cost_price}₸\n\n"
-                f"🔢 Введите количество в чат:"
-            )
+            text_to_send = order_prompt_text(item)
             markup_to_send = kb_cancel_only()
         else:
+            # Черновик сбросит обработчик ввода в потоке чата сотрудника
             text_to_send = "Товар больше недоступен. Выберите категорию:"
             markup_to_send = kb_categories(session)
-            user_data[chat_id] = {}
 
     # Сценарий 2: Пользователь писал комментарий
     elif user_state == STATES['WAIT_COMMENT']:
-        item = session.query(Storage).get(temp.get('item_id'))
-        qty = temp.get('qty')
+        item = catalog.get(session, draft.item_id)
+        qty = draft.qty
         if item:
             text_to_send = f"🔽 Создание заказа:\n\nТовар: **{item.item_name}**\nКоличество: {qty}\n\n📝 Напишите комментарий (цель использования):"
             markup_to_send = kb_cancel_only()
@@ -105,32 +139,73 @@ def restore_user_interface(chat_id, session):
         text_to_send = "Что-нибудь ещё? Выберите категорию:"
         markup_to_send = kb_categories(session)
 
-    # 2. Отправляем новое сообщение ВНИЗ
-    try:
-        msg = bot.send_message(chat_id, text_to_send, reply_markup=markup_to_send, parse_mode="Markdown")
-        if user:
-            user.last_msg_id = msg.message_id
-            session.commit()
-    except Exception as e:
-        print(f"Error restoring UI: {e}")
+    return text_to_send, markup_to_send
+
+def prepare_user_interface(chat_id, session):
+    """
+    Собирает актуальный экран пользователя и возвращает функцию, которая:
+    1. Удаляет старое сообщение (меню/ввод).
+    2. Отправляет новое актуальное состояние вниз чата.
+    Запросы к БД — здесь; сама отправка к сессии не обращается (можно вызвать после commit).
+    """
+    user = get_user(session, chat_id)
+    text_to_send, markup_to_send = build_user_interface(chat_id, session)
+
+    def send():
+        # 1. Удаляем старое сообщение
+        if user and user.last_msg_id:
+            outbox.delete_message(chat_id, user.last_msg_id)
+
+        # 2. Отправляем новое сообщение ВНИЗ (id запомним, когда оно уйдет)
+        on_sent = (lambda msg: save_last_msg_id(chat_id, msg.message_id)) if user else None
+        outbox.send_message(chat_id, text_to_send, reply_markup=markup_to_send, parse_mode="Markdown", on_sent=on_sent)
+    return send
+
+def restore_user_interface(chat_id, session):
+    """Удаляет старое сообщение и отправляет актуальное состояние вниз чата (сразу)"""
+    prepare_user_interface(chat_id, session)()
 
 # --- Клавиатуры ---
+# kb_categories / kb_items возвращают готовый JSON из кеша клавиатур
 def kb_categories(session):
+    return keyboards.get(session, "user_categories", lambda: _build_kb_categories(session))
+
+def kb_items(session, category_id, cursor=None):
+    return keyboards.get(session, "user_items", lambda: _build_kb_items(session, category_id, cursor), category=category_id, page=cursor)
+
+def _build_kb_categories(session):
     markup = types.InlineKeyboardMarkup(row_width=2)
-    categories = session.query(Storage.category).distinct().all()
-    # Фильтруем пустые категории, если есть
-    buttons = [types.InlineKeyboardButton(cat[0], callback_data=f"cat_{cat[0]}") for cat in categories if cat[0]]
+    buttons = [types.InlineKeyboardButton(cat.name, callback_data=f"cat_{cat.id}") for cat in catalog.categories(session)]
     markup.add(*buttons)
     return markup
 
-def kb_items(session, category):
+def _build_kb_items(session, category_id, cursor=None):
     markup = types.InlineKeyboardMarkup(row_width=1)
-    items = session.query(Storage).filter_by(category=category).all()
+    items, prev_cursor, next_cursor = catalog.items_page(session, category_id, cursor)
     for item in items:
         name = item.item_name
         if len(name) > 20: name = name[:20] + ".."
         btn_text = f"{name} (📦 {item.quantity})"
         markup.add(types.InlineKeyboardButton(btn_text, callback_data=f"prod_{item.id}"))
+    nav = page_buttons(prev_cursor, next_cursor, lambda c: f"pg:{c}:{category_id}")
+    if nav:
+        markup.row(*nav)
+    markup.add(types.InlineKeyboardButton("🔙 Назад", callback_data="back_main"))
+    return markup
+
+def parse_category_callback(data):
+    """cat_<id> или pg:<курсор>:<id> -> (id категории строкой, курсор)"""
+    if data.startswith("pg:"):
+        _, cursor, category_id = data.split(":", 2)
+        return category_id, cursor
+    return data.split("cat_", 1)[1], None
+
+def kb_search_results(items):
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    for item in items:
+        name = item.item_name
+        if len(name) > 20: name = name[:20] + ".."
+        markup.add(types.InlineKeyboardButton(f"{name} (📦 {item.quantity})", callback_data=f"prod_{item.id}"))
     markup.add(types.InlineKeyboardButton("🔙 Назад", callback_data="back_main"))
     return markup
 
@@ -145,52 +220,145 @@ def kb_confirm():
 # --- Handlers ---
 
 @bot.message_handler(commands=['start'])
+@metrics.timed("cmd_start")
 def cmd_start(message):
     # Если пишут в админскую группу, игнорируем
     if str(message.chat.id) == str(GROUP_ID):
         return
 
-    session = get_db_session()
+    session = current_session()
     user = get_user(session, message.chat.id)
     
     if user:
         if user.last_msg_id:
-            try: bot.delete_message(message.chat.id, user.last_msg_id)
-            except: pass
+            outbox.delete_message(message.chat.id, user.last_msg_id)
 
-        msg = bot.send_message(
+        msg = outbox.send_message(
             message.chat.id, 
             f"Привет, {user.first_name}! Выбери категорию:", 
             reply_markup=kb_categories(session)
-        )
-        user.last_msg_id = msg.message_id
-        session.commit()
+        ).result()
+        save_last_msg_id(message.chat.id, msg.message_id)
     else:
-        user_data[message.chat.id] = {'state': STATES['REG_IT'], 'temp': {}}
-        bot.send_message(message.chat.id, "Вы не зарегистрированы.\nВведите ваш IT-код (например, IT293):")
-    
-    session.close()
+        user_data.put(message.chat.id, UserSession(state=STATES['REG_IT']))
+        outbox.send_message(message.chat.id, "Вы не зарегистрированы.\nВведите ваш IT-код (например, IT293):")
+
+def replace_menu(chat_id, user, text, markup, parse_mode=None):
+    """Удаляет старое меню пользователя и присылает новое (его id запоминается)"""
+    if user.last_msg_id:
+        outbox.delete_message(chat_id, user.last_msg_id)
+    msg = outbox.send_message(chat_id, text, reply_markup=markup, parse_mode=parse_mode).result()
+    save_last_msg_id(chat_id, msg.message_id)
+
+@bot.message_handler(commands=['find'])
+def cmd_find(message):
+    """/find <запрос> — поиск товара по названию или категории"""
+    chat_id = message.chat.id
+    if str(chat_id) == str(GROUP_ID):
+        return
+    session = current_session()
+    user = get_user(session, chat_id)
+    if not user:
+        outbox.send_message(chat_id, "Вы не зарегистрированы. /start")
+        return
+
+    query = message.text.partition(" ")[2].strip()
+    if not query:
+        outbox.send_message(chat_id, "Формат: /find hdmi\nИли наберите здесь @имя_бота и запрос.")
+        return
+
+    items = search.search(session, query)
+    outbox.delete_message(chat_id, message.message_id)
+    if not items:
+        replace_menu(chat_id, user, f"🔎 «{query}»: ничего не найдено. Выберите категорию:", kb_categories(session))
+        return
+    replace_menu(chat_id, user, f"🔎 «{query}»: найдено {len(items)}", kb_search_results(items))
+
+@bot.message_handler(commands=['item'])
+def cmd_item(message):
+    """/item <id> — карточка товара (приходит из inline-поиска)"""
+    chat_id = message.chat.id
+    if str(chat_id) == str(GROUP_ID):
+        return
+    session = current_session()
+    user = get_user(session, chat_id)
+    arg = message.text.partition(" ")[2].strip()
+    item = session.query(Storage).get(int(arg)) if user and arg.isdigit() else None
+    outbox.delete_message(chat_id, message.message_id)
+    if not user:
+        outbox.send_message(chat_id, "Вы не зарегистрированы. /start")
+        return
+    if not item:
+        outbox.send_message(chat_id, "Товар не найден.")
+        return
+
+    user_data.put(chat_id, UserSession(state=STATES['WAIT_QTY'], item_id=item.id))
+    replace_menu(chat_id, user, order_prompt_text(item), kb_cancel_only(), parse_mode="Markdown")
+
+# Inline-поиск работает только в чате с ботом: выбранный результат отправляет /item <id>
+# в текущий чат, а в чужих чатах бот этих сообщений не получает. Там — кнопка перехода к боту.
+INLINE_SEARCH_BUTTON = types.InlineQueryResultsButton("🔎 Искать в чате с ботом", start_parameter="find")
+
+def inline_results(items):
+    return [
+        types.InlineQueryResultArticle(
+            id=str(item.id),
+            title=item.item_name,
+            description=f"{item.category} · 📦 {item.quantity}",
+            input_message_content=types.InputTextMessageContent(f"/item {item.id}")
+        )
+        for item in items
+    ]
+
+@bot.inline_handler(func=lambda query: True)
+def handle_inline_query(query):
+    """@бот <запрос> в чате с ботом — поиск товаров из индекса в памяти; выбор отправляет /item <id>"""
+    # cache_time=0: Telegram кэширует ответ по тексту запроса, а не по типу чата
+    if query.chat_type != 'sender':
+        bot.answer_inline_query(query.id, [], cache_time=0, button=INLINE_SEARCH_BUTTON)
+        return
+    items = search.search(current_session(), query.query) if query.query.strip() else []
+    bot.answer_inline_query(query.id, inline_results(items), cache_time=0)
 
 @bot.message_handler(commands=['add', 'add_item'])
 def cmd_add_item(message):
     # АДМИНКА: проверка группы отключена для тестов
     if str(message.chat.id) != str(GROUP_ID):
        return
-    start_add_process(bot, message)
+    start_add_process(outbox_bot, message)
     
 @bot.message_handler(commands=['edit', 'change'])
 def cmd_edit_item(message):
     # АДМИНКА: проверка группы отключена для тестов
     if str(message.chat.id) != str(GROUP_ID):
        return
-    start_edit_process(bot, message)
+    start_edit_process(outbox_bot, message)
+
+@bot.message_handler(commands=['export'])
+def cmd_export_log(message):
+    if str(message.chat.id) != str(GROUP_ID):
+       return
+    export_audit_log(outbox_bot, message)
+
+@bot.message_handler(commands=['dbstats'])
+def cmd_db_stats(message):
+    if str(message.chat.id) != str(GROUP_ID):
+       return
+    show_db_stats(outbox_bot, message)
     
+@bot.message_handler(commands=['pending'])
+def cmd_pending(message):
+    if str(message.chat.id) != str(GROUP_ID):
+       return
+    start_pending_review(outbox_bot, message)
+
 @bot.message_handler(content_types=['text'])
+@metrics.timed("handle_text")
 def handle_text(message):
     chat_id = message.chat.id
     
     # 1. Сначала проверяем админские состояния (ввод цены, названия и т.д.)
-    if handle_admin_text(bot, message):
+    if handle_admin_text(outbox_bot, message):
         return
     
     # 2. Если сообщение в админ-группе и не обработано админкой -> игнор
@@ -198,26 +366,25 @@ def handle_text(message):
         return
 
     # 3. Обработка пользовательских состояний
-    if chat_id not in user_data:
+    draft = user_data.get(chat_id)
+    if draft is None:
         return
 
-    state = user_data[chat_id].get('state')
+    state = draft.state
     text = message.text.strip()
-    session = get_db_session()
+    session = current_session()
 
-    try:
-        bot.delete_message(chat_id, message.message_id)
-    except:
-        pass
+    outbox.delete_message(chat_id, message.message_id)
 
     # --- РЕГИСТРАЦИЯ ---
     if state == STATES['REG_IT']:
-        user_data[chat_id]['temp']['it_code'] = text
-        user_data[chat_id]['state'] = STATES['REG_NAME']
-        msg = bot.send_message(chat_id, "Введите Имя и Фамилию:")
+        draft.it_code = text
+        draft.state = STATES['REG_NAME']
+        user_data.put(chat_id, draft)
+        outbox.send_message(chat_id, "Введите Имя и Фамилию:")
         
     elif state == STATES['REG_NAME']:
-        it_code = user_data[chat_id]['temp']['it_code']
+        it_code = draft.it_code
         parts = text.split(maxsplit=1)
         first_name = parts[0]
         last_name = parts[1] if len(parts) > 1 else ""
@@ -225,17 +392,21 @@ def handle_text(message):
         new_user = User(user_id=chat_id, it_code=it_code, first_name=first_name, last_name=last_name)
         session.add(new_user)
         try:
-            session.commit()
-            msg = bot.send_message(chat_id, "✅ Регистрация успешна!", reply_markup=kb_categories(session))
-            new_user.last_msg_id = msg.message_id
-            session.commit()
+            # flush сразу проверяет уникальность IT-кода; commit — в конце апдейта
+            session.flush()
+            markup = kb_categories(session)
+            # Об успехе сообщаем после commit; id меню запомнит кеш пользователей (write-behind)
+            after_commit(session, lambda: outbox.send_message(
+                chat_id, "✅ Регистрация успешна!", reply_markup=markup,
+                on_sent=lambda msg: save_last_msg_id(chat_id, msg.message_id)
+            ))
             
             # LOG
             log_user_action(new_user, "Регистрация", status="Success")
             
-            user_data[chat_id] = {} 
+            user_data.put(chat_id, UserSession())
         except Exception as e:
-            bot.send_message(chat_id, "Ошибка регистрации. /start")
+            outbox.send_message(chat_id, "Ошибка регистрации. /start")
             session.rollback()
 
     # --- ЗАКАЗ ТОВАРА ---
@@ -244,72 +415,81 @@ def handle_text(message):
             return
 
         qty = int(text)
-        item_id = user_data[chat_id]['temp']['item_id']
+        item_id = draft.item_id
         item = session.query(Storage).get(item_id)
+        if item is None:
+            # Товар удалили, пока шел ввод
+            clear_state(chat_id)
+            replace_menu(chat_id, get_user(session, chat_id), "Товар больше недоступен. Выберите категорию:",
+                         kb_categories(session))
+            return
 
         if item.quantity < qty:
-            bot.send_message(chat_id, f"❌ Недостаточно товара. Доступно: {item.quantity}")
-            session.close()
+            outbox.send_message(chat_id, f"❌ Недостаточно товара. Доступно: {item.quantity}")
             return
 
-        user_data[chat_id]['temp']['qty'] = qty
-        user_data[chat_id]['state'] = STATES['WAIT_COMMENT']
+        draft.qty = qty
+        draft.state = STATES['WAIT_COMMENT']
+        user_data.put(chat_id, draft)
         
-        user = session.query(User).filter_by(user_id=chat_id).first()
+        user = get_user(session, chat_id)
         last_id = user.last_msg_id if user else None
 
         msg_text = f"Товар: **{item.item_name}**\nКоличество: {qty}\n\n📝 Напишите комментарий (цель использования):"
 
         if last_id:
             try:
-                bot.edit_message_text(
+                outbox.edit_message_text(
                     chat_id=chat_id,
                     message_id=last_id,
                     text=msg_text,
                     parse_mode="Markdown",
                     reply_markup=kb_cancel_only()
-                )
+                ).result()
             except:
-                msg = bot.send_message(chat_id, msg_text, parse_mode="Markdown", reply_markup=kb_cancel_only())
+                msg = outbox.send_message(chat_id, msg_text, parse_mode="Markdown", reply_markup=kb_cancel_only()).result()
                 save_last_msg_id(chat_id, msg.message_id)
 
     elif state == STATES['WAIT_COMMENT']:
-        user_data[chat_id]['temp']['comment'] = text
-        temp = user_data[chat_id]['temp']
-        item = session.query(Storage).get(temp['item_id'])
+        draft.comment = text
+        item = session.query(Storage).get(draft.item_id)
         
-        summary = f"📋 **Проверка**:\nТовар: {item.item_name}\nКол-во: {temp['qty']}\nКоммент: {temp['comment']}"
+        summary = f"📋 **Проверка**:\nТовар: {item.item_name}\nКол-во: {draft.qty}\nКоммент: {draft.comment}"
         
-        user = session.query(User).filter_by(user_id=chat_id).first()
+        user = get_user(session, chat_id)
         last_id = user.last_msg_id
 
         try:
-            bot.edit_message_text(
+            outbox.edit_message_text(
                 chat_id=chat_id,
                 message_id=last_id,
                 text=summary,
                 parse_mode="Markdown",
                 reply_markup=kb_confirm()
-            )
+            ).result()
         except:
-            msg = bot.send_message(chat_id, summary, parse_mode="Markdown", reply_markup=kb_confirm())
+            msg = outbox.send_message(chat_id, summary, parse_mode="Markdown", reply_markup=kb_confirm()).result()
             save_last_msg_id(chat_id, msg.message_id)
 
-        user_data[chat_id]['state'] = None 
-
-    session.close()
+        draft.state = None
+        user_data.put(chat_id, draft)
 
 # --- Callback Handler ---
 @bot.callback_query_handler(func=lambda call: True)
+@metrics.timed("handle_all_callbacks")
 def handle_all_callbacks(call):
     chat_id = call.message.chat.id
     data = call.data
-    session = get_db_session()
+    session = current_session()
 
     # АДМИНКА (Раскомментировано)
     if data.startswith("adm_") or data.startswith("edt_") or data.startswith("conf_"):
-        handle_admin_callback(bot, call)
-        session.close()
+        handle_admin_callback(outbox_bot, call)
+        return
+
+    # Пакетный разбор заявок (/pending)
+    if data.startswith("pnd_"):
+        handle_pending_callback(outbox_bot, call, notify_user)
         return
 
     # Админские кнопки заявок (req_) обрабатываем здесь
@@ -317,10 +497,15 @@ def handle_all_callbacks(call):
         action, req_id = data.split(":")
         req_id = int(req_id)
         
-        req = session.query(Request).get(req_id)
+        # Сотрудник и товар — тем же запросом (без двух ленивых SELECT)
+        req = (
+            session.query(Request)
+            .options(joinedload(Request.user), joinedload(Request.item))
+            .filter(Request.id == req_id)
+            .first()
+        )
         if not req or req.status != 'pending':
             bot.answer_callback_query(call.id, "Заявка уже обработана")
-            session.close()
             return
 
         user = req.user
@@ -328,30 +513,28 @@ def handle_all_callbacks(call):
         admin_id = call.from_user.id
         
         notification_text = ""
+        new_text = None
 
         if action == "req_appr":
-            if item.quantity >= req.req_count:
-                item.quantity -= req.req_count
-                req.is_approved = True
-                req.status = 'approved'
-                
-                # LOG
-                log_admin_action(admin_id, "Одобрение заявки", f"Заявка #{req.id}, Товар: {item.item_name}, Кол-во: {req.req_count}")
-                log_user_action(user, "Заявка обновлена", item.item_name, req.req_count, req.comment, "Approved")
-                
-                notification_text = f"✅ Ваша заявка #{req.id} на **{item.item_name}** одобрена! Можете забирать."
-                
-                new_text = call.message.text + f"\n\n✅ ОДОБРЕНО администратором."
-                try: bot.edit_message_text(new_text, chat_id, call.message.message_id, reply_markup=None)
-                except: pass
-            else:
-                bot.answer_callback_query(call.id, "Мало товара!")
-                session.close()
+            # Условные UPDATE вместо проверки остатка в Python (см. approvals.py)
+            decision = approve_request(session, req_id)
+            if not decision.ok:
+                bot.answer_callback_query(call.id, decision.error)
                 return
 
+            # LOG
+            log_admin_action(admin_id, "Одобрение заявки", f"Заявка #{req.id}, Товар: {item.item_name}, Кол-во: {req.req_count}")
+            log_user_action(user, "Заявка обновлена", item.item_name, req.req_count, req.comment, "Approved")
+
+            notification_text = f"✅ Ваша заявка #{req.id} на **{item.item_name}** одобрена! Можете забирать."
+
+            new_text = call.message.text + f"\n\n✅ ОДОБРЕНО администратором."
+
         elif action == "req_rej":
-            req.is_approved = False
-            req.status = 'rejected'
+            decision = reject_request(session, req_id)
+            if not decision.ok:
+                bot.answer_callback_query(call.id, decision.error)
+                return
             
             # LOG
             log_admin_action(admin_id, "Отказ заявки", f"Заявка #{req.id}")
@@ -360,37 +543,44 @@ def handle_all_callbacks(call):
             notification_text = f"⛔ Ваша заявка #{req.id} на **{item.item_name}** отклонена."
             
             new_text = call.message.text + f"\n\n⛔ ОТКЛОНЕНО администратором."
-            try: bot.edit_message_text(new_text, chat_id, call.message.message_id, reply_markup=None)
-            except: pass
 
-        session.commit()
-        
+        if action == "req_appr":
+            after_commit(session, lambda: catalog.set_quantity(decision.item_id, decision.quantity))
+
+        # Отметка в группе и уведомление — после commit (при откате решения не было)
+        message_id = call.message.message_id
+        if new_text:
+            after_commit(session, lambda: outbox.edit_message_text(new_text, chat_id, message_id, reply_markup=None))
         if notification_text:
-            try:
-                bot.send_message(user.user_id, notification_text, parse_mode="Markdown")
-                # ВОССТАНАВЛИВАЕМ ИНТЕРФЕЙС ПОЛЬЗОВАТЕЛЯ
-                restore_user_interface(user.user_id, session)
-            except Exception as e:
-                print(f"Ошибка UX обновления: {e}")
-        
-        session.close()
+            notify_user(session, user.user_id, notification_text)
         return
 
     # === ЛОГИКА ПОЛЬЗОВАТЕЛЯ ===
     
     save_last_msg_id(chat_id, call.message.message_id)
 
-    if data.startswith("cat_"):
-        cat = data.split("cat_")[1]
-        bot.edit_message_text(
+    if data.startswith("cat_") or data.startswith("pg:"):
+        # pg:<курсор>:<id категории> — другая страница той же категории
+        category_id, cursor = parse_category_callback(data)
+        category = catalog.category(session, category_id)
+        if category is None:
+            # Категорию удалили (или кнопка из старого меню с названием вместо id)
+            outbox.edit_message_text(
+                chat_id=chat_id,
+                message_id=call.message.message_id,
+                text="Категория не найдена. Выберите категорию:",
+                reply_markup=kb_categories(session)
+            )
+            return
+        outbox.edit_message_text(
             chat_id=chat_id,
             message_id=call.message.message_id,
-            text=f"📂 Категория: {cat}",
-            reply_markup=kb_items(session, cat)
+            text=f"📂 Категория: {category.name}",
+            reply_markup=kb_items(session, category.id, cursor)
         )
 
     elif data == "back_main":
-        bot.edit_message_text(
+        outbox.edit_message_text(
             chat_id=chat_id,
             message_id=call.message.message_id,
             text="Выберите категорию:",
@@ -401,39 +591,28 @@ def handle_all_callbacks(call):
         item_id = int(data.split("prod_")[1])
         item = session.query(Storage).get(item_id)
         
-        user_data[chat_id] = {
-            'state': STATES['WAIT_QTY'],
-            'temp': {'item_id': item_id}
-        }
-        
-        text_msg = (
-            f"🔽 Создание заказа:\n\n"
-            f"Выбрано: **{item.item_name}**\n"
-            f"Доступно: {item.quantity}\n"
-            f"Себестоимость: {item.cost_price}₸\n\n"
-            f"🔢 Введите количество в чат:"
-        )
+        user_data.put(chat_id, UserSession(state=STATES['WAIT_QTY'], item_id=item_id))
 
-        bot.edit_message_text(
+        outbox.edit_message_text(
             chat_id=chat_id,
             message_id=call.message.message_id,
-            text=text_msg,
+            text=order_prompt_text(item),
             parse_mode="Markdown",
             reply_markup=kb_cancel_only()
         )
 
     elif data == "confirm_order":
-        if chat_id not in user_data or 'temp' not in user_data[chat_id]:
+        draft = user_data.get(chat_id)
+        if draft is None or draft.item_id is None or draft.qty is None:
             bot.answer_callback_query(call.id, "Сессия истекла")
             return
 
-        temp = user_data[chat_id]['temp']
-        item_id = temp['item_id']
-        qty = temp['qty']
-        comment = temp['comment']
+        item_id = draft.item_id
+        qty = draft.qty
+        comment = draft.comment
         
         item = session.query(Storage).get(item_id)
-        user = session.query(User).filter_by(user_id=chat_id).first()
+        user = get_user(session, chat_id)
 
         new_req = Request(
             user_pk=user.id,
@@ -443,19 +622,15 @@ def handle_all_callbacks(call):
             status='pending'
         )
         session.add(new_req)
-        session.commit()
+        # flush — чтобы получить id заявки; commit сделает middleware, сообщения — после него
+        session.flush()
         
         # LOG
         log_user_action(user, "Новая заявка", item.item_name, qty, comment, "Pending")
 
         success_text = f"✅ **Заявка #{new_req.id} отправлена!**\n\nНужно заказать что-то ещё? Выберите категорию:"
-        bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=call.message.message_id,
-            text=success_text,
-            parse_mode="Markdown",
-            reply_markup=kb_categories(session)
-        )
+        success_markup = kb_categories(session)
+        message_id = call.message.message_id
         
         markup_admin = types.InlineKeyboardMarkup()
         markup_admin.add(
@@ -472,20 +647,76 @@ def handle_all_callbacks(call):
             f"💬 Цель: {comment}"
         )
         
-        bot.send_message(GROUP_ID, report, parse_mode="Markdown", reply_markup=markup_admin)
+        # Сотруднику и админам — только после commit: откаченная заявка не должна «уйти»
+        def send_order():
+            outbox.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=success_text,
+                parse_mode="Markdown",
+                reply_markup=success_markup
+            )
+            outbox.send_message(GROUP_ID, report, parse_mode="Markdown", reply_markup=markup_admin)
+        after_commit(session, send_order)
         clear_state(chat_id)
 
     elif data == "cancel_order":
         clear_state(chat_id)
-        bot.edit_message_text(
+        outbox.edit_message_text(
             chat_id=chat_id,
             message_id=call.message.message_id,
             text="Отменено.\nВыберите категорию:",
             reply_markup=kb_categories(session)
         )
 
-    session.close()
+def _labeled(stats):
+    """{'hits': 1, ...} -> {(('key', 'hits'),): 1, ...} для gauge с меткой key"""
+    return {(('key', k),): v for k, v in stats.items() if isinstance(v, (int, float))}
+
+def register_metrics():
+    """Gauges состояния процесса: пул БД, очереди отправки и апдейтов, кеши"""
+    metrics.register_gauge("bot_db_pool", "DB connection pool state", lambda: _labeled(pool_stats()))
+    metrics.register_gauge("bot_outbox_pending", "Telegram calls waiting in outbox", outbox.pending)
+    metrics.register_gauge("bot_outbox_calls", "Outbox totals (sent/failed/retried/coalesced)",
+                           lambda: _labeled(outbox.stats()))
+    if bot.dispatcher is not None:
+        metrics.register_gauge("bot_dispatcher", "Per-chat update queues",
+                               lambda: _labeled(bot.dispatcher.stats()))
+    metrics.register_gauge("bot_user_cache", "User cache state", lambda: _labeled(users.stats()))
+    metrics.register_gauge("bot_sql_profile", "SQL per update, slow queries, N+1 candidates",
+                           lambda: _labeled(profiler.stats()))
+    metrics.register_gauge("bot_keyboard_cache", "Keyboard cache state", lambda: _labeled(keyboards.stats()))
 
 if __name__ == "__main__":
     print("Бот запущен...")
-    bot.infinity_polling()
\ No newline at end of file
+    # docker stop шлет SIGTERM: выходим через finally, чтобы дописать очереди и кеши
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # Индекс поиска строим сразу, чтобы первый запрос не ждал загрузки каталога
+    warm_session = get_db_session()
+    try:
+        search.warm(warm_session)
+    except Exception as e:
+        print(f"Search index warmup error: {e}")
+    finally:
+        warm_session.close()
+    metrics.instrument_telegram_api()
+    register_metrics()
+    try:
+        metrics.start_server()
+    except OSError as e:
+        print(f"Metrics server error: {e}")
+    try:
+        if RUN_MODE == "webhook":
+            from webhook import run_webhook
+            run_webhook(bot)
+        elif RUN_MODE == "async":
+            from async_bot import run_async
+            run_async()
+        else:
+            bot.remove_webhook()
+            bot.infinity_polling()
+    finally:
+        bot.stop_dispatcher()
+        outbox.stop()
+        # last_msg_id из памяти — в БД, чтобы после перезапуска меню нашлось
+        users.shutdown()
\ No newline at end of file
@@ -0,0 +1,237 @@
+"""
+Метрики в текстовом формате Prometheus: GET http://METRICS_HOST:METRICS_PORT/metrics
+
+- bot_handler_seconds{handler}            — время хендлеров (декоратор timed)
+- bot_handler_errors_total{handler}       — исключения в хендлерах
+- bot_db_query_seconds{op}                — SQL-запросы (события engine), count = число запросов
+- bot_db_errors_total                     — ошибки SQL
+- bot_telegram_api_seconds{method}        — вызовы Bot API (apihelper.CUSTOM_REQUEST_SENDER)
+- bot_telegram_api_errors_total{method,code}
+- bot_excel_flush_seconds                 — сброс пачки журнала (Excel + audit_events)
+- gauges от register_gauge (пул БД, очереди, кеши)
+
+METRICS_ENABLED=0: декоратор возвращает функцию как есть, события не вешаются, порт не открывается.
+"""
+import time
+import bisect
+import functools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+
+# Границы корзин в секундах (как в prometheus_client по умолчанию)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+_lock = threading.Lock()
+_metrics = []   # в порядке регистрации
+_gauges = []    # (имя, описание, fn() -> {labels: значение} или число)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        with _lock:
+            _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with _lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # значения меток -> [счетчики корзин..., sum, count]
+        with _lock:
+            _metrics.append(self)
+
+    def observe(self, seconds, *label_values):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with _lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {series[-1]}")
+        return lines
+
+
+def register_gauge(name, help_text, fn):
+    """fn() вызывается при каждом опросе: число или {(('метка', 'значение'),...): число}"""
+    if METRICS_ENABLED:
+        with _lock:
+            _gauges.append((name, help_text, fn))
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    with _lock:
+        metrics = list(_metrics)
+        gauges = list(_gauges)
+    for metric in metrics:
+        with _lock:
+            lines.extend(metric.render())
+    for name, help_text, fn in gauges:
+        try:
+            value = fn()
+        except Exception as e:
+            print(f"Metrics gauge {name} error: {e}")
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        if isinstance(value, dict):
+            for labels, v in sorted(value.items()):
+                names, values = zip(*labels) if labels else ((), ())
+                lines.append(f"{name}{_format_labels(names, values)} {v}")
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# --- МЕТРИКИ БОТА ---
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Handler latency", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Exceptions raised by handlers", ["handler"])
+DB_QUERY_SECONDS = Histogram("bot_db_query_seconds", "SQL statement latency", ["op"])
+DB_ERRORS = Counter("bot_db_errors_total", "SQL statement errors")
+API_SECONDS = Histogram("bot_telegram_api_seconds", "Telegram Bot API call latency", ["method"],
+                        buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+API_ERRORS = Counter("bot_telegram_api_errors_total", "Failed Telegram Bot API calls", ["method", "code"])
+EXCEL_FLUSH_SECONDS = Histogram("bot_excel_flush_seconds", "Audit log batch flush time (Excel + DB)")
+
+
+def timed(handler_name):
+    """Декоратор: время и ошибки хендлера. Ставить под @bot.message_handler (ближе к функции)"""
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler_name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, handler_name)
+        return wrapper
+    return decorator
+
+
+def observe_excel_flush(seconds):
+    if METRICS_ENABLED:
+        EXCEL_FLUSH_SECONDS.observe(seconds)
+
+
+# --- ИНСТРУМЕНТИРОВАНИЕ ---
+
+def instrument_engine(engine):
+    """Время каждого SQL-запроса по типу (SELECT/INSERT/UPDATE/DELETE/...)"""
+    if not METRICS_ENABLED:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        op = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, op)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        DB_ERRORS.inc()
+        stack = context.connection.info.get("metrics_started") if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+
+def instrument_telegram_api():
+    """Время и ошибки каждого HTTP-вызова Bot API синхронного клиента (telebot.apihelper)"""
+    if not METRICS_ENABLED:
+        return
+    from telebot import apihelper
+
+    def timed_sender(method, url, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            response = apihelper._get_req_session().request(method, url, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, api_method)
+        if response.status_code != 200:
+            API_ERRORS.inc(api_method, str(response.status_code))
+        return response
+
+    apihelper.CUSTOM_REQUEST_SENDER = timed_sender
+
+
+# --- HTTP ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    """HTTP-сервер метрик в фоновом потоке (ничего не делает при METRICS_ENABLED=0)"""
+    if not METRICS_ENABLED:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"📈 Метрики: http://{host}:{port}/metrics")
+    return server
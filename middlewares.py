@@ -0,0 +1,33 @@
+from telebot.handler_backends import BaseMiddleware
+from db import update_session
+from sql_profiler import profiler, describe_update
+
+
+class SessionMiddleware(BaseMiddleware):
+    """
+    Unit of work на апдейт: все хендлеры и хелперы берут db.current_session(),
+    в конце апдейта — один commit (или rollback при исключении) и закрытие сессии.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ['message', 'callback_query', 'inline_query']
+
+    def pre_process(self, message, data):
+        # На случай, если в потоке осталась сессия от кода вне апдейта
+        update_session.remove()
+        profiler.begin(describe_update(message))
+
+    def post_process(self, message, data, exception):
+        session = update_session()
+        try:
+            if exception is None:
+                session.commit()
+            else:
+                session.rollback()
+        except Exception as e:
+            print(f"Unit of work error: {e}")
+            session.rollback()
+        finally:
+            update_session.remove()
+            profiler.end()
@@ -1,6 +1,6 @@
 # models.py
 import os
-from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Text, ForeignKey, Numeric
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Text, ForeignKey, Numeric, Index
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import func
 from dotenv import load_dotenv
@@ -29,18 +29,33 @@ class User(Base):
         return f"<User {self.it_code}>"
 
 
+class Category(Base):
+    __tablename__ = 'categories'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Название хранится один раз: переименование — одна строка, в callback_data — только id
+    name = Column(String(100), unique=True, nullable=False)
+
+    items = relationship("Storage", back_populates="category")
+
+    def __repr__(self):
+        return f"<Category {self.name}>"
+
+
 class Storage(Base):
     __tablename__ = 'storage'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    category = Column(String(100), nullable=False)
-    item_name = Column(String(255), nullable=False)
+    # Индексы: категория — в каждом меню, имя — поиск при пополнении (ADM_WAIT_QTY)
+    category_id = Column(Integer, ForeignKey('categories.id', ondelete='CASCADE'), nullable=False, index=True)
+    item_name = Column(String(255), nullable=False, index=True)
     quantity = Column(Integer, default=0, nullable=False)
     cost_price = Column(Numeric(12, 2), nullable=False, server_default="0")
     
     # === ИЗМЕНЕНИЕ ЗДЕСЬ ===
     # Добавлено cascade="all, delete-orphan"
     requests = relationship("Request", back_populates="item", cascade="all, delete-orphan")
+    category = relationship("Category", back_populates="items")
 
 
     def __repr__(self):
@@ -49,6 +64,10 @@ class Storage(Base):
 
 class Request(Base):
     __tablename__ = 'requests'
+    __table_args__ = (
+        # Ожидающие заявки постранично: WHERE status = 'pending' AND id > ? ORDER BY id (group._pending_rows)
+        Index('ix_requests_status_id', 'status', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     
@@ -68,4 +87,26 @@ class Request(Base):
     item = relationship("Storage", back_populates="requests")
 
     def __repr__(self):
-        return f"<Request {self.id} by {self.user_pk}>"
\ No newline at end of file
+        return f"<Request {self.id} by {self.user_pk}>"
+
+
+class AuditEvent(Base):
+    """Журнал действий (дублирует Excel-лог, но доступен для запросов)"""
+    __tablename__ = 'audit_events'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+    actor_type = Column(String(10), nullable=False)  # 'user' / 'admin'
+    actor = Column(String(50), nullable=False, index=True)  # IT-код или Telegram ID админа
+    actor_name = Column(String(200), nullable=True)
+    action = Column(String(100), nullable=False, index=True)
+
+    item_name = Column(String(255), nullable=True)
+    qty = Column(String(20), nullable=True)
+    comment = Column(Text, nullable=True)
+    status = Column(String(20), nullable=True)
+    details = Column(Text, nullable=True)
+
+    def __repr__(self):
+        return f"<AuditEvent {self.action} by {self.actor}>"
\ No newline at end of file
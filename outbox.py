@@ -0,0 +1,324 @@
+import time
+import threading
+from collections import OrderedDict, deque
+from telebot.apihelper import ApiTelegramException
+from config import (
+    OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_GROUP_PER_MINUTE, OUTBOX_RESULT_TIMEOUT
+)
+
+# Сколько раз повторять вызов после 429 Too Many Requests
+MAX_RETRIES = 5
+# Ошибки, о которых не нужно сообщать: повторное нажатие кнопки дает ту же правку
+BENIGN_ERRORS = ("message is not modified",)
+
+_callbacks_lock = threading.Lock()
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def ready_in(self, now):
+        """Через сколько секунд появится токен (0 — уже есть)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class OutboxJob:
+    """Отложенный вызов Bot API; result() ждет выполнения (как обычный вызов bot.*)"""
+    __slots__ = ("method", "chat_id", "args", "kwargs", "on_sent", "quiet", "attempts",
+                 "_done", "_result", "_error", "_callbacks", "edit_key")
+
+    def __init__(self, method, chat_id, args, kwargs, on_sent=None, quiet=False, edit_key=None):
+        self.method = method
+        self.chat_id = Outbox._chat_key(chat_id)
+        self.args = args
+        self.kwargs = kwargs
+        self.on_sent = on_sent
+        self.quiet = quiet
+        self.attempts = 0
+        self.edit_key = edit_key
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def _finish(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        with _callbacks_lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"Outbox callback error: {e}")
+
+    def add_done_callback(self, callback):
+        """callback(job) после выполнения (в потоке outbox; сразу, если уже выполнен)"""
+        with _callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=OUTBOX_RESULT_TIMEOUT):
+        # Без таймаута хендлер (и поток диспетчера) мог бы ждать вечно, если outbox встал
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.method} to {self.chat_id} not sent in {timeout}s")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class Outbox:
+    """
+    Очередь исходящих вызовов Telegram с ограничением частоты:
+    общий token bucket на бота и свой на каждый чат (группы — строже).
+    - Порядок вызовов внутри чата сохраняется.
+    - 429: чат ставится на паузу на retry_after, вызов повторяется.
+    - Несколько правок одного сообщения, еще не отправленных, схлопываются в последнюю.
+    Хендлеры ставят вызовы в очередь и не ждут HTTP (или ждут через job.result()).
+    """
+
+    def __init__(self, bot, global_rate=OUTBOX_GLOBAL_RATE, chat_rate=OUTBOX_CHAT_RATE,
+                 chat_burst=OUTBOX_CHAT_BURST, group_per_minute=OUTBOX_GROUP_PER_MINUTE,
+                 clock=time.monotonic, start=True):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60.0
+        self.clock = clock
+
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # chat_id -> deque[OutboxJob], порядок — round robin
+        self._edits = {}              # (chat_id, message_id) -> ожидающая правка
+        self._buckets = {}
+        self._paused = {}             # chat_id -> время окончания паузы после 429
+        self._global = TokenBucket(global_rate, global_rate, clock())
+        self._busy = 0
+        self._stopping = False
+        self._counters = {'sent': 0, 'failed': 0, 'retried': 0, 'coalesced': 0}
+
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._loop, name="outbox", daemon=True)
+            self._thread.start()
+
+    # --- ПОСТАНОВКА В ОЧЕРЕДЬ ---
+
+    @staticmethod
+    def _chat_key(chat_id):
+        # GROUP_ID приходит из env строкой, а chat.id в апдейтах — число: это один чат
+        try:
+            return int(chat_id)
+        except (TypeError, ValueError):
+            return chat_id
+
+    def _submit(self, job):
+        with self._cond:
+            self._queues.setdefault(job.chat_id, deque()).append(job)
+            if job.edit_key is not None:
+                self._edits[job.edit_key] = job
+            self._cond.notify()
+        return job
+
+    def send_message(self, chat_id, text, on_sent=None, **kwargs):
+        return self._submit(OutboxJob("send_message", chat_id, (chat_id, text), kwargs, on_sent))
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        key = (self._chat_key(chat_id), message_id)
+        with self._cond:
+            pending = self._edits.get(key)
+            if pending is not None:
+                # Предыдущая правка еще не ушла — отправим только последнюю
+                pending.args = (text, chat_id, message_id)
+                pending.kwargs = kwargs
+                self._counters['coalesced'] += 1
+                return pending
+        return self._submit(OutboxJob("edit_message_text", chat_id, (text, chat_id, message_id), kwargs, edit_key=key))
+
+    def send_document(self, chat_id, document, **kwargs):
+        return self._submit(OutboxJob("send_document", chat_id, (chat_id, document), kwargs))
+
+    def delete_message(self, chat_id, message_id):
+        key = (self._chat_key(chat_id), message_id)
+        # Старое сообщение могло уже исчезнуть — такие ошибки не интересны
+        job = OutboxJob("delete_message", chat_id, (chat_id, message_id), {}, quiet=True)
+        # Снятие правки и постановка удаления — под одной блокировкой:
+        # поток отправки не должен увидеть очередь чата пустой
+        with self._cond:
+            pending = self._edits.pop(key, None)
+            if pending is not None:
+                # Править сообщение, которое сейчас удалим, незачем
+                jobs = self._queues[pending.chat_id]
+                jobs.remove(pending)
+                if not jobs:
+                    del self._queues[pending.chat_id]
+                pending._finish()
+                self._counters['coalesced'] += 1
+            return self._submit(job)
+
+    # --- ОБРАБОТКА ---
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.chat_burst, now)
+        return bucket
+
+    def _next_job(self, now):
+        """(job, 0) — можно отправлять; (None, wait) — ближайшая возможность через wait секунд"""
+        wait = None
+        for chat_id, jobs in self._queues.items():
+            if not jobs:
+                # Пустых очередей быть не должно, но и ронять поток из-за них незачем
+                continue
+            delay = max(self._paused.get(chat_id, 0) - now, self._bucket(chat_id, now).ready_in(now))
+            if delay <= 0:
+                delay = self._global.ready_in(now)
+                if delay <= 0:
+                    job = jobs.popleft()
+                    if job.edit_key is not None:
+                        self._edits.pop(job.edit_key, None)
+                    if jobs:
+                        self._queues.move_to_end(chat_id)
+                    else:
+                        del self._queues[chat_id]
+                    self._bucket(chat_id, now).take(now)
+                    self._global.take(now)
+                    return job, 0.0
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _execute(self, job):
+        job.attempts += 1
+        try:
+            result = getattr(self.bot, job.method)(*job.args, **job.kwargs)
+        except ApiTelegramException as e:
+            retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after')
+            if e.error_code == 429 and job.attempts < MAX_RETRIES:
+                with self._cond:
+                    self._counters['retried'] += 1
+                    self._paused[job.chat_id] = self.clock() + (retry_after or 1)
+                    self._queues.setdefault(job.chat_id, deque()).appendleft(job)
+                    self._queues.move_to_end(job.chat_id, last=False)
+                return
+            self._fail(job, e)
+            return
+        except Exception as e:
+            self._fail(job, e)
+            return
+
+        with self._cond:
+            self._counters['sent'] += 1
+        job._finish(result)
+        if job.on_sent is not None:
+            try:
+                job.on_sent(result)
+            except Exception as e:
+                print(f"Outbox callback error: {e}")
+
+    def _fail(self, job, error):
+        with self._cond:
+            self._counters['failed'] += 1
+        if not job.quiet and not any(text in str(error) for text in BENIGN_ERRORS):
+            print(f"❌ Telegram {job.method} ({job.chat_id}): {error}")
+        job._finish(error=error)
+
+    def run_pending(self):
+        """Выполняет все вызовы, разрешенные лимитами прямо сейчас (для тестов без потока)"""
+        while True:
+            with self._cond:
+                job, _ = self._next_job(self.clock())
+            if job is None:
+                return
+            self._execute(job)
+
+    def _loop(self):
+        while True:
+            try:
+                with self._cond:
+                    job, wait = self._next_job(self.clock())
+                    if job is None:
+                        if self._stopping and not self._queues:
+                            return
+                        self._cond.wait(wait)
+                        continue
+                    self._busy += 1
+            except Exception as e:
+                # Поток отправки один: если он умрет, все ждущие job.result() повиснут
+                print(f"Outbox loop error: {e}")
+                time.sleep(0.1)
+                continue
+            try:
+                self._execute(job)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+                    self._cond.notify_all()
+
+    def stats(self):
+        """Счетчики sent/failed/retried/coalesced (снимок под блокировкой)"""
+        with self._cond:
+            return dict(self._counters)
+
+    def pending(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values()) + self._busy
+
+    def stop(self, timeout=30):
+        """Отправляет всё, что осталось в очереди, и останавливает поток"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+class OutboxBot:
+    """
+    Обертка с интерфейсом TeleBot для кода, который получает bot аргументом (group.py):
+    сообщения идут через outbox — с лимитами чата и админ-группы и повтором после 429.
+    Вызовы только ставятся в очередь и возвращают OutboxJob (message_id — через on_sent),
+    кроме send_document: файл закрывается сразу после вызова, поэтому его отправку ждем.
+    Остальные методы (answer_callback_query и т.п.) — напрямую в бота.
+    """
+
+    def __init__(self, bot, outbox):
+        self.bot = bot
+        self.outbox = outbox
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self.outbox.send_message(chat_id, text, **kwargs)
+
+    def send_document(self, chat_id, document, **kwargs):
+        return self.outbox.send_document(chat_id, document, **kwargs).result()
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return self.outbox.edit_message_text(text, chat_id, message_id, **kwargs)
+
+    def delete_message(self, chat_id, message_id):
+        return self.outbox.delete_message(chat_id, message_id)
+
+    def __getattr__(self, name):
+        return getattr(self.bot, name)
@@ -0,0 +1,62 @@
+from bisect import bisect_left, bisect_right
+from telebot import types
+from config import PAGE_SIZE
+
+# Курсор страницы (keyset по id) — короткая строка для callback_data:
+#   None  — первая страница
+#   'a12' — записи с id > 12 (вперед)
+#   'b30' — последние записи с id < 30 (назад)
+
+
+def parse_cursor(cursor):
+    """Курсор -> (after_id, before_id)"""
+    if not cursor:
+        return 0, None
+    value = int(cursor[1:])
+    return (value, None) if cursor[0] == 'a' else (None, value)
+
+
+def _cursors(page_ids, has_prev, has_next):
+    prev_cursor = f"b{page_ids[0]}" if has_prev and page_ids else None
+    next_cursor = f"a{page_ids[-1]}" if has_next and page_ids else None
+    return prev_cursor, next_cursor
+
+
+def slice_page(ids, cursor, limit=PAGE_SIZE):
+    """Страница из отсортированного списка id (кеш каталога): (id страницы, курсор назад, курсор вперед)"""
+    after_id, before_id = parse_cursor(cursor)
+    if before_id is not None:
+        end = bisect_left(ids, before_id)
+        start = max(0, end - limit)
+    else:
+        start = bisect_right(ids, after_id)
+        end = start + limit
+    page = ids[start:end]
+    return (page, *_cursors(page, start > 0, end < len(ids)))
+
+
+def keyset_page(query, id_column, cursor, limit=PAGE_SIZE):
+    """
+    Страница из БД: WHERE id > ? ORDER BY id LIMIT n+1 (или id < ? ... DESC для «назад»).
+    Лишняя строка только показывает, есть ли следующая страница — OFFSET не используется.
+    """
+    after_id, before_id = parse_cursor(cursor)
+    if before_id is not None:
+        rows = query.filter(id_column < before_id).order_by(id_column.desc()).limit(limit + 1).all()
+        has_prev, has_next = len(rows) > limit, True
+        rows = rows[:limit][::-1]
+    else:
+        rows = query.filter(id_column > after_id).order_by(id_column).limit(limit + 1).all()
+        has_prev, has_next = after_id > 0, len(rows) > limit
+        rows = rows[:limit]
+    return (rows, *_cursors([r.id for r in rows], has_prev, has_next))
+
+
+def page_buttons(prev_cursor, next_cursor, make_data):
+    """Кнопки ◀️ ▶️ (make_data(курсор) -> callback_data); пустой список, если листать некуда"""
+    buttons = []
+    if prev_cursor:
+        buttons.append(types.InlineKeyboardButton("◀️", callback_data=make_data(prev_cursor)))
+    if next_cursor:
+        buttons.append(types.InlineKeyboardButton("▶️", callback_data=make_data(next_cursor)))
+    return buttons
@@ -0,0 +1,142 @@
+import threading
+from catalog_cache import catalog
+
+# Сколько результатов отдавать (inline-режим Telegram принимает до 50)
+SEARCH_LIMIT = 20
+# Нечеткое совпадение (опечатка) засчитывается, если совпала хотя бы такая доля триграмм запроса
+MIN_OVERLAP = 0.5
+
+
+def normalize(text):
+    return " ".join((text or "").lower().replace("ё", "е").split())
+
+
+def trigrams(text):
+    """Триграммы слов с границами: 'usb' -> {'  u', ' us', 'usb', 'sb '}"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SearchIndex:
+    """
+    Поиск товаров по названию и категории без LIKE-запросов к БД.
+    Инвертированный индекс «триграмма -> id товаров»: кандидаты — пересечение
+    списков триграмм запроса, ранжирование — префикс слова > подстрока > доля совпавших триграмм.
+    Строится из каталога (catalog_cache) и обновляется точечно при правках в group.py.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._docs = {}   # id -> (название, категория, нормализованный текст)
+        self._grams = {}  # триграмма -> {id, ...}
+
+    def _ensure_built(self, session):
+        if self._built:
+            return
+        with self._lock:
+            if self._built:
+                return
+            self._docs = {}
+            self._grams = {}
+            for category in catalog.categories(session):
+                for item in catalog.items(session, category.id):
+                    self._add(item.id, item.item_name, item.category)
+            self._built = True
+
+    def warm(self, session):
+        """Построение индекса при старте (иначе — при первом поиске)"""
+        self._ensure_built(session)
+
+    # --- ИЗМЕНЕНИЯ (вызывать после commit) ---
+
+    def _add(self, item_id, item_name, category):
+        text = normalize(f"{item_name} {category}")
+        self._docs[item_id] = (item_name, category, text)
+        for gram in trigrams(text):
+            self._grams.setdefault(gram, set()).add(item_id)
+
+    def remove(self, item_id):
+        with self._lock:
+            doc = self._docs.pop(item_id, None)
+            if doc is None:
+                return
+            for gram in trigrams(doc[2]):
+                ids = self._grams.get(gram)
+                if ids is not None:
+                    ids.discard(item_id)
+                    if not ids:
+                        del self._grams[gram]
+
+    def remove_items(self, item_ids):
+        with self._lock:
+            for item_id in item_ids:
+                self.remove(item_id)
+
+    def update_item(self, item):
+        """Новый или измененный товар (ORM-объект или CatalogItem)"""
+        with self._lock:
+            if not self._built:
+                return
+            self.remove(item.id)
+            self._add(item.id, item.item_name, item.category)
+
+    def update_category(self, old, new, item_ids):
+        """Переименование категории: переиндексируются только ее товары"""
+        with self._lock:
+            if not self._built:
+                return
+            for item_id in item_ids:
+                doc = self._docs.get(item_id)
+                if doc is None or doc[1] != old:
+                    continue
+                self.remove(item_id)
+                self._add(item_id, doc[0], new)
+
+    def invalidate(self):
+        with self._lock:
+            self._built = False
+            self._docs = {}
+            self._grams = {}
+
+    # --- ПОИСК ---
+
+    def search(self, session, query, limit=SEARCH_LIMIT):
+        """Товары каталога (CatalogItem) по запросу, лучшие первыми"""
+        self._ensure_built(session)
+        q = normalize(query)
+        if not q:
+            return []
+        q_grams = trigrams(q)
+
+        with self._lock:
+            postings = [self._grams.get(g, set()) for g in q_grams]
+            # Опечатка не должна обнулять выдачу: если пересечение пусто, берем объединение
+            candidates = set.intersection(*postings) or set().union(*postings)
+
+            scored = []
+            for item_id in candidates:
+                text = self._docs[item_id][2]
+                prefix = text.startswith(q) or f" {q}" in text
+                substring = q in text
+                overlap = len(q_grams & trigrams(text)) / len(q_grams)
+                if not substring and overlap < MIN_OVERLAP:
+                    continue
+                scored.append(((not prefix, not substring, -overlap, len(text)), item_id))
+
+        scored.sort()
+        results = []
+        for _, item_id in scored:
+            item = catalog.get(session, item_id)
+            if item is not None:
+                results.append(item)
+            if len(results) >= limit:
+                break
+        return results
+
+
+# Общий индекс процесса
+search = SearchIndex()
@@ -0,0 +1,160 @@
+"""
+Профилирование SQL по апдейтам Telegram.
+
+SessionMiddleware (и sync_admin_call в async-режиме) открывает контекст апдейта,
+события engine считают в нем запросы. В конце апдейта:
+- одинаковые по форме запросы (параметры и списки IN схлопнуты), повторенные
+  SQL_N_PLUS_ONE_THRESHOLD раз и больше, пишутся в журнал как кандидаты в N+1;
+- любой запрос дольше SQL_SLOW_QUERY_MS пишется в журнал сразу, с типом апдейта.
+Запросы фоновых потоков (журнал, сброс кешей) попадают только в журнал медленных
+с типом "background".
+"""
+import re
+import time
+import threading
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+from config import SQL_PROFILE_ENABLED, SQL_SLOW_QUERY_MS, SQL_N_PLUS_ONE_THRESHOLD, SQL_SLOW_LOG
+
+# Длина текста запроса в журнале
+MAX_STATEMENT_CHARS = 500
+
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|:\w+))*\s*\)")
+_NUMBER = re.compile(r"\b\d+\b")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def statement_shape(statement):
+    """Форма запроса: литералы и списки параметров заменены, пробелы схлопнуты"""
+    shape = _STRING.sub("?", statement)
+    shape = _NUMBER.sub("?", shape)
+    shape = _IN_LIST.sub("(?)", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+def describe_update(update):
+    """Тип апдейта для журнала: команда, callback-префикс или тип контента"""
+    data = getattr(update, "data", None)
+    if isinstance(data, str):
+        return "callback:" + re.split(r"[:_]", data, 1)[0]
+    if hasattr(update, "query") and hasattr(update, "offset"):
+        return "inline_query"
+    text = getattr(update, "text", None) or ""
+    if text.startswith("/"):
+        return "command:" + text.split()[0].split("@")[0]
+    return "message:" + getattr(update, "content_type", "unknown")
+
+
+class UpdateProfile:
+    """Запросы одного апдейта"""
+    __slots__ = ("update_type", "statements", "seconds", "shapes")
+
+    def __init__(self, update_type):
+        self.update_type = update_type
+        self.statements = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def repeated(self, threshold=SQL_N_PLUS_ONE_THRESHOLD):
+        """[(форма, сколько раз), ...] — повторы не реже threshold, самые частые первыми"""
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+
+class SqlProfiler:
+    def __init__(self, slow_ms=SQL_SLOW_QUERY_MS, threshold=SQL_N_PLUS_ONE_THRESHOLD, log_path=SQL_SLOW_LOG):
+        self.slow_seconds = slow_ms / 1000.0
+        self.threshold = threshold
+        self.log_path = log_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.statements = 0
+        self.slow = 0
+        self.n_plus_one = 0
+
+    # --- КОНТЕКСТ АПДЕЙТА ---
+
+    def begin(self, update_type):
+        self._local.profile = UpdateProfile(update_type)
+
+    def end(self):
+        """Закрывает контекст апдейта и пишет кандидатов в N+1; возвращает UpdateProfile"""
+        profile = getattr(self._local, "profile", None)
+        self._local.profile = None
+        if profile is None:
+            return None
+        repeated = profile.repeated(self.threshold)
+        with self._lock:
+            self.updates += 1
+            self.statements += profile.statements
+            self.n_plus_one += len(repeated)
+        for shape, count in repeated:
+            self._write(f"N+1? {profile.update_type}: {count}x {shape[:MAX_STATEMENT_CHARS]}"
+                        f" ({profile.statements} statements in update)")
+        return profile
+
+    def current(self):
+        return getattr(self._local, "profile", None)
+
+    # --- СОБЫТИЯ ENGINE ---
+
+    def install(self, engine):
+        if not SQL_PROFILE_ENABLED:
+            return
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("profiler_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            self._record(statement, time.perf_counter() - conn.info["profiler_started"].pop())
+
+        @event.listens_for(engine, "handle_error")
+        def _error(context):
+            stack = context.connection.info.get("profiler_started") if context.connection is not None else None
+            if stack:
+                stack.pop()
+
+    def _record(self, statement, seconds):
+        profile = self.current()
+        if profile is not None:
+            profile.statements += 1
+            profile.seconds += seconds
+            profile.shapes[statement_shape(statement)] += 1
+        if seconds >= self.slow_seconds:
+            with self._lock:
+                self.slow += 1
+            update_type = profile.update_type if profile is not None else "background"
+            self._write(f"SLOW {seconds * 1000:.0f}ms {update_type}: {statement_shape(statement)[:MAX_STATEMENT_CHARS]}")
+
+    # --- ЖУРНАЛ ---
+
+    def _write(self, line):
+        line = f"{datetime.now().isoformat(timespec='seconds')} {line}"
+        if not self.log_path:
+            print(f"🐢 {line}")
+            return
+        try:
+            with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"Slow query log error: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'updates': self.updates,
+                'statements': self.statements,
+                'per_update': self.statements / self.updates if self.updates else 0.0,
+                'slow': self.slow,
+                'n_plus_one': self.n_plus_one,
+            }
+
+
+# Общий профайлер процесса
+profiler = SqlProfiler()
@@ -0,0 +1,236 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from config import STATE_BACKEND, STATE_DB_PATH, STATE_TTL, STATE_MAX_ENTRIES
+
+# Как часто (сек) удалять просроченные записи, к которым никто не обращается
+PRUNE_INTERVAL = 300
+
+
+# --- ЗАПИСИ СОСТОЯНИЙ ---
+
+class UserSession:
+    """Диалог сотрудника: этап (STATES в main.py) и черновик заказа/регистрации"""
+    __slots__ = ("state", "item_id", "qty", "comment", "it_code")
+
+    def __init__(self, state=None, item_id=None, qty=None, comment=None, it_code=None):
+        self.state = state
+        self.item_id = item_id
+        self.qty = qty
+        self.comment = comment
+        self.it_code = it_code
+
+    def clear(self):
+        """Сброс этапа и черновика (запись остается — пользователь «в меню»)"""
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class AdminSession:
+    """Диалог админа в /add, /edit и /pending: этап (ADM_* в group.py), режим и данные шага"""
+    __slots__ = ("state", "mode", "last_msg_id",
+                 "category_id", "category", "item_name", "exist_id", "cost_price", "edit_id",
+                 "selected", "page")
+
+    def __init__(self, state=None, mode='add', last_msg_id=None, category_id=None, category=None, item_name=None,
+                 exist_id=None, cost_price=None, edit_id=None, selected=None, page=None):
+        self.state = state
+        self.mode = mode
+        self.last_msg_id = last_msg_id
+        self.category_id = category_id  # выбранная категория (None — новая, название в category)
+        self.category = category        # название категории для текстов
+        self.item_name = item_name
+        self.exist_id = exist_id
+        self.cost_price = cost_price
+        self.edit_id = edit_id
+        self.selected = selected  # id заявок, отмеченных в /pending
+        self.page = page          # курсор открытой страницы /pending (pagination.py)
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        if data["cost_price"] is not None:
+            data["cost_price"] = str(data["cost_price"])
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("cost_price") is not None:
+            data["cost_price"] = Decimal(data["cost_price"])
+        # Записи, сохраненные старой версией, могут содержать уже несуществующие поля
+        return cls(**{k: v for k, v in data.items() if k in cls.__slots__})
+
+
+# --- ХРАНИЛИЩА ---
+
+class MemoryStateStore:
+    """
+    Состояния в памяти: LRU с ограничением по числу записей и TTL.
+    После изменения записи ее нужно сохранить через put().
+    """
+
+    def __init__(self, max_entries=STATE_MAX_ENTRIES, ttl=STATE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()  # ключ -> (время записи, запись)
+        self._pruned_at = time.time()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stamp, record = entry
+            if self.ttl and time.time() - stamp > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return record
+
+    def put(self, key, record):
+        with self._lock:
+            stamp = time.time()
+            self._remember(key, record, stamp)
+            self._maybe_prune(stamp)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _remember(self, key, record, stamp):
+        """Запоминает запись; возвращает ключи, вытесненные по LRU"""
+        self._entries[key] = (stamp, record)
+        self._entries.move_to_end(key)
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            evicted.append(self._entries.popitem(last=False)[0])
+        return evicted
+
+    def _maybe_prune(self, now):
+        """Раз в PRUNE_INTERVAL удаляет просроченные записи; ключи удаленных или None, если не время"""
+        if not self.ttl or now - self._pruned_at < PRUNE_INTERVAL:
+            return None
+        self._pruned_at = now
+        expired = [k for k, (stamp, _) in self._entries.items() if now - stamp > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        return expired
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SqliteStateStore(MemoryStateStore):
+    """
+    Память (как MemoryStateStore) + запись в локальный SQLite-файл.
+    Переживает перезапуск: незавершенные заказы и диалоги админов восстанавливаются.
+    Файл ограничен так же, как память: вытесненные по LRU и просроченные записи удаляются и с диска.
+    Пишет в файл только этот процесс, поэтому набор ключей на диске известен заранее —
+    промах (например, текст от сотрудника без диалога админки) не читает SQLite.
+    """
+
+    def __init__(self, record_cls, namespace, path=STATE_DB_PATH,
+                 max_entries=STATE_MAX_ENTRIES, ttl=STATE_TTL):
+        super().__init__(max_entries, ttl)
+        self.record_cls = record_cls
+        self.namespace = namespace
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fsm_state ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, updated_at REAL NOT NULL, data TEXT NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        if self.ttl:
+            self._db.execute("DELETE FROM fsm_state WHERE namespace = ? AND updated_at < ?",
+                             (namespace, time.time() - self.ttl))
+        # Сверх лимита (например, лимит уменьшили) — удаляем самые старые
+        self._db.execute(
+            "DELETE FROM fsm_state WHERE namespace = ? AND key NOT IN ("
+            " SELECT key FROM fsm_state WHERE namespace = ? ORDER BY updated_at DESC LIMIT ?)",
+            (namespace, namespace, max_entries)
+        )
+        # Ключи, которые есть на диске (строками, как в таблице)
+        self._stored = {row[0] for row in self._db.execute(
+            "SELECT key FROM fsm_state WHERE namespace = ?", (namespace,)
+        )}
+
+    def get(self, key):
+        with self._lock:
+            record = super().get(key)
+            if record is not None:
+                return record
+            if str(key) not in self._stored:
+                return None
+            row = self._db.execute(
+                "SELECT updated_at, data FROM fsm_state WHERE namespace = ? AND key = ?",
+                (self.namespace, str(key))
+            ).fetchone()
+            if row is None:
+                self._stored.discard(str(key))
+                return None
+            stamp, data = row
+            if self.ttl and time.time() - stamp > self.ttl:
+                self.delete(key)
+                return None
+            record = self.record_cls.from_dict(json.loads(data))
+            self._forget(self._remember(key, record, stamp))
+            return record
+
+    def put(self, key, record):
+        with self._lock:
+            stamp = time.time()
+            evicted = self._remember(key, record, stamp)
+            self._db.execute(
+                "INSERT OR REPLACE INTO fsm_state (namespace, key, updated_at, data) VALUES (?, ?, ?, ?)",
+                (self.namespace, str(key), stamp, json.dumps(record.to_dict(), ensure_ascii=False))
+            )
+            self._stored.add(str(key))
+            self._forget(evicted)
+            self._maybe_prune(stamp)
+
+    def delete(self, key):
+        with self._lock:
+            super().delete(key)
+            self._forget([key])
+
+    def _forget(self, keys):
+        """Удаляет записи с диска (вытесненные, просроченные, завершенные диалоги)"""
+        keys = [str(k) for k in keys if str(k) in self._stored]
+        if not keys:
+            return
+        self._db.executemany("DELETE FROM fsm_state WHERE namespace = ? AND key = ?",
+                             [(self.namespace, k) for k in keys])
+        self._stored.difference_update(keys)
+
+    def _maybe_prune(self, now):
+        expired = super()._maybe_prune(now)
+        if expired is None:
+            return None
+        self._forget(expired)
+        # На диске могут быть просроченные записи, которые так и не загрузились в память
+        rows = self._db.execute("SELECT key FROM fsm_state WHERE namespace = ? AND updated_at < ?",
+                                (self.namespace, now - self.ttl)).fetchall()
+        self._forget([row[0] for row in rows])
+        return expired
+
+
+def make_state_store(record_cls, namespace):
+    """Хранилище по настройке STATE_BACKEND: 'memory' или 'sqlite'"""
+    if STATE_BACKEND == "sqlite":
+        return SqliteStateStore(record_cls, namespace)
+    return MemoryStateStore()
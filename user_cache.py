@@ -0,0 +1,186 @@
+import time
+import atexit
+import threading
+from collections import OrderedDict
+from sqlalchemy import event, bindparam
+from sqlalchemy.orm import object_session
+from config import USER_CACHE_SIZE, USER_CACHE_TTL, LAST_MSG_FLUSH_INTERVAL
+from models import User
+from db import engine, after_commit
+
+
+class UserSnapshot:
+    """Неизменяемый снимок строки users (то, что нужно хендлерам и логгеру)"""
+    __slots__ = ("id", "user_id", "it_code", "first_name", "last_name", "last_msg_id")
+
+    def __init__(self, id, user_id, it_code, first_name, last_name, last_msg_id):
+        object.__setattr__(self, "id", id)
+        object.__setattr__(self, "user_id", user_id)
+        object.__setattr__(self, "it_code", it_code)
+        object.__setattr__(self, "first_name", first_name)
+        object.__setattr__(self, "last_name", last_name)
+        object.__setattr__(self, "last_msg_id", last_msg_id)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserSnapshot is read-only")
+
+    def replace(self, **changes):
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return UserSnapshot(**fields)
+
+
+# Запоминаем и отсутствие пользователя: незарегистрированные пишут часто
+_MISSING = object()
+
+
+class UserCache:
+    """
+    Пользователи по Telegram user_id: LRU с TTL, один запрос на промах.
+    Сбрасывается ORM-событиями на User (регистрация, изменение, удаление).
+
+    last_msg_id пишется отложенно (write-behind): remember_last_msg_id меняет снимок
+    и помечает запись «грязной», фоновый поток раз в LAST_MSG_FLUSH_INTERVAL секунд
+    отправляет все изменения одним executemany UPDATE. При остановке — синхронный flush.
+    """
+
+    def __init__(self, max_entries=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, flush_interval=LAST_MSG_FLUSH_INTERVAL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (время загрузки, UserSnapshot | _MISSING)
+        self._dirty = {}               # user_id -> last_msg_id, еще не записанный в БД
+        self._inflight = {}            # пачка, которая пишется прямо сейчас
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._stop = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.flushed = 0
+
+    def get(self, session, user_id):
+        """UserSnapshot или None, если пользователь не зарегистрирован"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return None if entry[1] is _MISSING else entry[1]
+            self.misses += 1
+
+        row = session.query(
+            User.id, User.user_id, User.it_code, User.first_name, User.last_name, User.last_msg_id
+        ).filter_by(user_id=user_id).first()
+        snapshot = UserSnapshot(*row) if row else None
+        return self._store(user_id, snapshot)
+
+    def _store(self, user_id, snapshot):
+        with self._lock:
+            # Незаписанный last_msg_id новее того, что сейчас в БД
+            pending = self._dirty.get(user_id, self._inflight.get(user_id))
+            if snapshot is not None and pending is not None:
+                snapshot = snapshot.replace(last_msg_id=pending)
+            value = snapshot if snapshot is not None else _MISSING
+            self._entries[user_id] = (time.monotonic(), value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return snapshot
+
+    # --- last_msg_id (write-behind) ---
+
+    def remember_last_msg_id(self, user_id, message_id):
+        """Новое сообщение меню пользователя: сразу в кеше, в БД — со следующей пачкой"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] is not _MISSING:
+                if entry[1].last_msg_id == message_id and user_id not in self._dirty:
+                    return
+                self._entries[user_id] = (entry[0], entry[1].replace(last_msg_id=message_id))
+            self._dirty[user_id] = message_id
+        self._ensure_flusher()
+
+    def flush(self):
+        """Записывает накопленные last_msg_id одним executemany UPDATE"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._dirty = self._dirty, {}
+                self._inflight = batch
+            if not batch:
+                return 0
+            table = User.__table__
+            try:
+                with engine.begin() as conn:
+                    conn.execute(
+                        table.update()
+                        .where(table.c.user_id == bindparam('b_user_id'))
+                        .values(last_msg_id=bindparam('b_msg_id')),
+                        [{'b_user_id': uid, 'b_msg_id': mid} for uid, mid in batch.items()]
+                    )
+            except Exception as e:
+                print(f"❌ Ошибка записи last_msg_id ({len(batch)} шт.): {e}")
+                with self._lock:
+                    # Вернем в очередь то, что не перезаписано за время попытки
+                    for uid, mid in batch.items():
+                        self._dirty.setdefault(uid, mid)
+                    self._inflight = {}
+                return 0
+            with self._lock:
+                self._inflight = {}
+            self.flushed += len(batch)
+            return len(batch)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._flush_lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._stop.clear()
+                self._flusher = threading.Thread(target=self._flush_loop, name="last-msg-flush", daemon=True)
+                self._flusher.start()
+
+    def shutdown(self):
+        """Останавливает фоновую запись и синхронно сбрасывает остаток"""
+        self._stop.set()
+        flusher = self._flusher
+        if flusher is not None:
+            flusher.join(self.flush_interval + 5)
+        self.flush()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'hit_rate': self.hits / total if total else 0.0,
+                'pending_writes': len(self._dirty),
+                'flushed_writes': self.flushed,
+            }
+
+
+# Общий кеш процесса
+users = UserCache()
+atexit.register(users.shutdown)
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_user(mapper, connection, target):
+    user_id = target.user_id
+    users.invalidate(user_id)
+    # Повторно — после commit: параллельный читатель мог успеть закешировать старую строку
+    session = object_session(target)
+    if session is not None:
+        after_commit(session, lambda: users.invalidate(user_id))
@@ -0,0 +1,154 @@
+"""
+Режим webhook: Telegram сам присылает апдейты POST-запросами на WEBHOOK_PATH.
+
+Локальная проверка без Telegram (WEBHOOK_URL не задан):
+    RUN_MODE=webhook python main.py
+    curl -X POST localhost:8080/telegram -H 'Content-Type: application/json' -d @update.json
+    curl localhost:8080/readyz
+"""
+import json
+import queue
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from telebot import types
+from config import (
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL,
+    WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE
+)
+
+# Доля заполнения очереди, после которой сервер сообщает, что не готов
+READY_QUEUE_RATIO = 0.9
+
+
+class WebhookServer:
+    """
+    HTTP-сервер приема апдейтов. Запрос только ставит апдейт в очередь и сразу отвечает:
+    - с диспетчером (DISPATCH_WORKERS > 0) — прямо в очередь его чата (bot.dispatcher.submit);
+    - без него — в ограниченную очередь, которую по порядку разбирает отдельный поток.
+    200 отдается только принятому апдейту. Нет места (в очереди чата или в общей) — 503,
+    Telegram повторит доставку позже; после 200 апдейт уже не потеряется.
+    """
+
+    def __init__(self, bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                 secret=WEBHOOK_SECRET, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.dispatcher = getattr(bot, "dispatcher", None)
+        self.updates = queue.Queue(maxsize=queue_size)
+        self.rejected = 0
+        self._consumer = threading.Thread(target=self._consume, name="webhook-consumer", daemon=True)
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    def _consume(self):
+        while True:
+            update = self.updates.get()
+            if update is None:
+                return
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                print(f"Webhook processing error: {e}")
+
+    def accept(self, update):
+        """True — апдейт принят в обработку, False — места нет (ответим 503)"""
+        if self.dispatcher is not None:
+            accepted = self.dispatcher.submit(update)
+        else:
+            try:
+                self.updates.put_nowait(update)
+                accepted = True
+            except queue.Full:
+                accepted = False
+        if not accepted:
+            self.rejected += 1
+        return accepted
+
+    def queue_state(self):
+        """(в очереди, емкость) — очередь диспетчера или собственная"""
+        if self.dispatcher is not None:
+            stats = self.dispatcher.stats()
+            return stats['queued'], stats['capacity']
+        return self.updates.qsize(), self.updates.maxsize
+
+    def is_ready(self):
+        queued, capacity = self.queue_state()
+        return self._consumer.is_alive() and queued < capacity * READY_QUEUE_RATIO
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code, body=b"", headers=None):
+                self.send_response(code)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/healthz":
+                    self._reply(200, b"ok")
+                elif self.path == "/readyz":
+                    ready = server.is_ready()
+                    queued, capacity = server.queue_state()
+                    body = json.dumps({
+                        "ready": ready,
+                        "queued": queued,
+                        "capacity": capacity,
+                        "rejected": server.rejected,
+                    }).encode()
+                    self._reply(200 if ready else 503, body, {"Content-Type": "application/json"})
+                else:
+                    self._reply(404)
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                if server.secret and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != server.secret:
+                    self._reply(403)
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    update = types.Update.de_json(self.rfile.read(length).decode("utf-8"))
+                except Exception:
+                    self._reply(400)
+                    return
+                if not server.accept(update):
+                    self._reply(503, headers={"Retry-After": "1"})
+                    return
+                self._reply(200)
+
+            def log_message(self, format, *args):
+                # Не засоряем вывод строкой на каждый апдейт
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        self._consumer.start()
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        """Останавливает прием и дожидается обработки уже принятых апдейтов"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.updates.put(None)
+        self._consumer.join(30)
+
+
+def run_webhook(bot):
+    server = WebhookServer(bot)
+    if WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    print(f"Webhook-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()